@@ -0,0 +1,188 @@
+"""
+Benchmark parse_file_str against the previous recursive implementation.
+
+Usage:
+    python benchmarks/bench_parse_file_str.py [FILE ...] [--repeat N]
+
+Without FILE arguments a synthetic 4k-line React component is used. Both
+implementations must return identical declarations for every input.
+"""
+import argparse
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "multi_tool_agent"))
+
+from tree_sitter_language_pack import get_parser  # noqa: E402
+from parse_cache import parse_cache  # noqa: E402
+from parse_file_str import EXT_LANGUAGE_MAP, parse_file_str  # noqa: E402
+
+
+def legacy_parse_file_str(code_str: str, file_extension: str):
+    """The pre-rewrite extractor: per-byte line table, linear lookups, recursion."""
+    parser = get_parser(EXT_LANGUAGE_MAP[file_extension.lower()])
+    code_bytes = code_str.encode("utf8")
+    tree = parser.parse(code_bytes)
+
+    line_offsets = [0]
+    for i, c in enumerate(code_bytes):
+        if c == ord(b'\n'):
+            line_offsets.append(i + 1)
+
+    def byte_to_line(byte_offset):
+        for idx, offset in enumerate(line_offsets):
+            if offset > byte_offset:
+                return idx
+        return len(line_offsets)
+
+    declarations = []
+
+    def walk(node):
+        if node.type in (
+            "jsx_element",
+            "jsx_self_closing_element",
+            "function_declaration",
+            "arrow_function",
+            "method_definition",
+            "class_declaration",
+            "variable_declaration",
+            "lexical_declaration"
+        ):
+            name = ""
+            if node.type in ("jsx_element", "jsx_self_closing_element"):
+                if node.type == "jsx_element":
+                    opening = node.child_by_field_name("opening_element")
+                    if opening and opening.named_child_count:
+                        tag_node = opening.named_children[0]
+                        if tag_node:
+                            name = tag_node.text.decode()
+            if node.type in ("function_declaration", "class_declaration"):
+                id_node = node.child_by_field_name("name")
+                if id_node:
+                    name = id_node.text.decode()
+            elif node.type in ("variable_declaration", "lexical_declaration"):
+                declarator = node.child_by_field_name("declarator")
+                if declarator is None and node.named_children:
+                    declarator = node.named_children[0]
+                if declarator:
+                    name_node = declarator.child_by_field_name("name")
+                    if name_node:
+                        name = name_node.text.decode()
+                    else:
+                        name = declarator.text.decode()
+            elif node.type == "method_definition":
+                name_node = node.child_by_field_name("name")
+                if name_node:
+                    name = name_node.text.decode()
+            elif node.type == "arrow_function":
+                parent = node.parent
+                if parent and parent.type == "variable_declarator":
+                    id_node = parent.child_by_field_name("name")
+                    if id_node:
+                        name = id_node.text.decode()
+
+            declarations.append({
+                "type": node.type,
+                "name": name,
+                "start_line": byte_to_line(node.start_byte),
+                "end_line": byte_to_line(node.end_byte),
+                "code": code_bytes[node.start_byte:node.end_byte].decode("utf8", errors="ignore")
+            })
+
+        for child in node.children:
+            walk(child)
+
+    walk(tree.root_node)
+    return declarations
+
+
+def synthetic_component(components: int = 80) -> str:
+    """A React module of roughly 50 lines per component with nested JSX."""
+    parts = ["import React, { useState } from 'react';\n"]
+    for i in range(components):
+        parts.append(f"""
+export const Widget{i} = ({{ items, onSelect }}) => {{
+  const [open, setOpen] = useState(false);
+  const handleClick = (item) => {{
+    setOpen(!open);
+    onSelect(item);
+  }};
+  function label(item) {{
+    return `${{item.name}} ({i})`;
+  }}
+  return (
+    <div className="widget-{i}">
+      <header>
+        <h2>Widget {i}</h2>
+        <button onClick={{() => setOpen(!open)}}>Toggle</button>
+      </header>
+      {{open && (
+        <ul>
+          {{items.map((item) => (
+            <li key={{item.id}} onClick={{() => handleClick(item)}}>
+              <span>{{label(item)}}</span>
+              <img src={{item.icon}} alt="" />
+            </li>
+          ))}}
+        </ul>
+      )}}
+      <footer>
+        <small>Total: {{items.length}}</small>
+      </footer>
+    </div>
+  );
+}};
+
+class Store{i} {{
+  constructor() {{
+    this.items = [];
+  }}
+  add(item) {{
+    this.items.push(item);
+  }}
+  remove(id) {{
+    this.items = this.items.filter((item) => item.id !== id);
+  }}
+}}
+""")
+    return "".join(parts)
+
+
+def uncached_parse_file_str(code_str: str, file_extension: str):
+    # Measure extraction including the parse, not a parse-cache hit.
+    parse_cache.clear()
+    return parse_file_str(code_str, file_extension)
+
+
+def time_call(fn, *args, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(*args)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument("files", nargs="*", type=Path)
+    arg_parser.add_argument("--repeat", type=int, default=5)
+    args = arg_parser.parse_args()
+
+    inputs = [(str(path), path.read_text(encoding="utf-8"), path.suffix.lstrip(".")) for path in args.files]
+    if not inputs:
+        inputs = [("<synthetic>", synthetic_component(), "jsx")]
+
+    for name, code, ext in inputs:
+        if legacy_parse_file_str(code, ext) != parse_file_str(code, ext):
+            raise SystemExit(f"{name}: output differs from the legacy implementation")
+        legacy = time_call(legacy_parse_file_str, code, ext, repeat=args.repeat)
+        current = time_call(uncached_parse_file_str, code, ext, repeat=args.repeat)
+        lines = code.count("\n") + 1
+        print(f"{name}: {lines} lines  legacy {legacy * 1000:.1f} ms  current {current * 1000:.1f} ms  "
+              f"speedup {legacy / current:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
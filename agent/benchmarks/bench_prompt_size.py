@@ -0,0 +1,42 @@
+"""
+Compare the coder prompt's file context in the legacy AST-repr format and the
+compact numbered-source format.
+
+Usage:
+    python benchmarks/bench_prompt_size.py [FILE ...] [--budget TOKENS]
+
+Without FILE arguments the synthetic component from bench_parse_file_str is
+used. Reports bytes and estimated tokens for both formats.
+"""
+import argparse
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "multi_tool_agent"))
+
+from prompt_context import PROMPT_CONTEXT_TOKEN_BUDGET, measure_context_formats  # noqa: E402
+from bench_parse_file_str import synthetic_component  # noqa: E402
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument("files", nargs="*", type=Path)
+    arg_parser.add_argument("--budget", type=int, default=PROMPT_CONTEXT_TOKEN_BUDGET)
+    args = arg_parser.parse_args()
+
+    file_contents = [(str(path), path.read_text(encoding="utf-8")) for path in args.files]
+    if not file_contents:
+        file_contents = [("src/Widgets.jsx", synthetic_component())]
+
+    stats = measure_context_formats(file_contents, args.budget)
+    legacy, compact = stats["legacy"], stats["compact"]
+    source_bytes = sum(len(content.encode("utf-8")) for _, content in file_contents)
+    print(f"source:  {source_bytes} bytes")
+    print(f"legacy:  {legacy['bytes']} bytes  ~{legacy['tokens']} tokens")
+    print(f"compact: {compact['bytes']} bytes  ~{compact['tokens']} tokens  (budget {args.budget})")
+    if compact["tokens"]:
+        print(f"reduction: {legacy['tokens'] / compact['tokens']:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""
+A `Model` that answers without a provider, for offline benchmarks.
+
+The response is replayed from a recording or generated from the prompt's
+files, and streamed with the timing of a latency profile: a delay before
+the first token, then chunks at a fixed token rate. The prompt is still
+built and budget-checked exactly as for a real provider.
+"""
+import asyncio
+import json
+import time
+from pathlib import Path
+from typing import List, NamedTuple
+
+from llm_models.model import Model, OnText
+from llm_models.tokens import TokenBudget, estimate_tokens
+from fixtures import coder_response_json
+
+
+class LatencyProfile(NamedTuple):
+    first_token_seconds: float
+    tokens_per_second: float
+    # Tokens per streamed chunk
+    chunk_tokens: int = 20
+
+
+PROFILES = {
+    "instant": LatencyProfile(0.0, float("inf")),
+    "fast": LatencyProfile(0.3, 250.0),
+    "typical": LatencyProfile(1.5, 80.0),
+    "slow": LatencyProfile(4.0, 30.0),
+}
+
+
+class FakeModel(Model):
+    provider = "fake"
+
+    def __init__(self, name: str = "fake-coder", profile: LatencyProfile = PROFILES["instant"],
+                 responses: List[str] | None = None, edits_per_file: int = 5):
+        super().__init__(name)
+        self.profile = profile
+        self.edits_per_file = edits_per_file
+        self._responses = list(responses or [])
+        self.calls = 0
+
+    @classmethod
+    def from_recording(cls, path: Path, **kwargs) -> "FakeModel":
+        """Replay responses (and, if recorded, their timing) from a JSON file:
+        {"profile": {"first_token_seconds": .., "tokens_per_second": ..}, "responses": ["..."]}
+        """
+        recording = json.loads(Path(path).read_text(encoding="utf-8"))
+        if recording.get("profile"):
+            kwargs.setdefault("profile", LatencyProfile(**recording["profile"]))
+        return cls(responses=recording.get("responses", []), **kwargs)
+
+    def _response_for(self, analyst_response) -> str:
+        self.calls += 1
+        if self._responses:
+            return self._responses[(self.calls - 1) % len(self._responses)]
+        return coder_response_json(analyst_response.file_contents, self.edits_per_file)
+
+    def _record(self, budget: TokenBudget, prompt: str, response: str) -> None:
+        budget.record(self.provider, self.name, prompt, estimate_tokens(prompt, self.provider), estimate_tokens(response, self.provider))
+
+    def generate_content(self, user_prompt: str, analyst_response, budget: TokenBudget | None = None) -> str:
+        budget = budget or TokenBudget()
+        prompt = self.get_fix_prompt(user_prompt, analyst_response)
+        self._check_budget(budget, prompt)
+        response = self._response_for(analyst_response)
+        time.sleep(self._duration(response))
+        self._record(budget, prompt, response)
+        return response
+
+    async def agenerate_content(self, user_prompt: str, analyst_response, budget: TokenBudget | None = None,
+                                on_text: OnText | None = None) -> str:
+        budget = budget or TokenBudget()
+        prompt = self.get_fix_prompt(user_prompt, analyst_response)
+        self._check_budget(budget, prompt)
+        response = self._response_for(analyst_response)
+
+        async def chunks():
+            await asyncio.sleep(self.profile.first_token_seconds)
+            chunk_chars = self.profile.chunk_tokens * 4
+            chunk_delay = self.profile.chunk_tokens / self.profile.tokens_per_second
+            for start in range(0, len(response), chunk_chars):
+                if chunk_delay:
+                    await asyncio.sleep(chunk_delay)
+                yield response[start:start + chunk_chars]
+            self._record(budget, prompt, response)
+
+        return await self._collect_stream(chunks(), on_text)
+
+    def _duration(self, response: str) -> float:
+        return self.profile.first_token_seconds + (len(response) / 4) / self.profile.tokens_per_second
@@ -0,0 +1,71 @@
+"""
+Deterministic inputs for the benchmarks: GitHub-style flat trees, repository
+files and coder responses.
+"""
+import hashlib
+import json
+from typing import Dict, List, Tuple
+
+from bench_parse_file_str import synthetic_component
+
+
+def git_sha(content: str) -> str:
+    """The blob SHA git would give `content`."""
+    data = content.encode("utf-8")
+    return hashlib.sha1(b"blob %d\0" % len(data) + data).hexdigest()
+
+
+def synthetic_flat_tree(entries: int = 100_000, fanout: int = 20, base_url: str = "https://api.github.com/repos/bench/repo") -> List[Dict]:
+    """A recursive git tree listing of `entries` items, `fanout` children per directory."""
+    items = []
+    directories = [""]
+    index = 0
+    while len(items) < entries:
+        parent = directories[index]
+        index += 1
+        for child in range(fanout):
+            if len(items) >= entries:
+                break
+            is_dir = child < max(1, fanout // 4)
+            path = f"{parent}/{'dir' if is_dir else 'file'}{child}".lstrip("/")
+            if not is_dir:
+                path += ".jsx"
+            sha = hashlib.sha1(path.encode("utf-8")).hexdigest()
+            items.append({
+                "path": path,
+                "mode": "040000" if is_dir else "100644",
+                "type": "tree" if is_dir else "blob",
+                "sha": sha,
+                "url": f"{base_url}/git/{'trees' if is_dir else 'blobs'}/{sha}",
+                **({} if is_dir else {"size": 1024}),
+            })
+            if is_dir:
+                directories.append(path)
+    return items
+
+
+def synthetic_repo_files(count: int = 4, components: int = 20) -> Dict[str, str]:
+    """`count` React modules of roughly 50 lines per component."""
+    return {f"src/components/Widgets{i}.jsx": synthetic_component(components) for i in range(count)}
+
+
+def coder_response_json(file_contents: List[Tuple[str, str]], edits_per_file: int = 10) -> str:
+    """A coder response with `edits_per_file` non-overlapping, syntax-preserving edits per file."""
+    changes = []
+    for file_path, content in file_contents:
+        line_count = content.count("\n") + 1
+        step = max(1, line_count // (edits_per_file + 1))
+        for edit in range(edits_per_file):
+            line = 1 + step * (edit + 1)
+            if line > line_count:
+                break
+            original = content.split("\n")[line - 1]
+            changes.append({
+                "is_new_file": False,
+                "file_path": file_path,
+                "action": "replace",
+                "start_line": line,
+                "end_line": line,
+                "new_code": f"{original}\n// benchmark edit {edit}",
+            })
+    return json.dumps({"pr_description": "Benchmark change", "changes": changes})
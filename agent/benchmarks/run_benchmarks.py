@@ -0,0 +1,273 @@
+"""
+Offline benchmark suite: micro-benchmarks of the hot functions and an
+end-to-end run of the implement pipeline against a stub GitHub server and a
+fake coder model. No network access or API keys are needed.
+
+Usage:
+    python benchmarks/run_benchmarks.py [--repeat N] [--only NAME ...]
+        [--profile instant|fast|typical|slow] [--github-latency SECONDS]
+        [--output results.json] [--check | --baseline baseline.json]
+        [--tolerance 0.5] [--save-baseline baseline.json]
+
+Benchmarks:
+    parse_file_str             uncached extraction of a 4k-line React module
+    parse_file_str_legacy      the same with the recursive extractor it replaced
+    build_tree_from_flat_list  nesting a 100k-entry flat git tree
+    apply_code_changes         200 edits to a 4k-line file
+    verify_changes_full        full parse of the edited file
+    verify_changes_incremental re-parse of the edited file from its cached base
+    e2e_cold / e2e_warm        get_repo_tree, get_file_content for every file
+                               and ImplementChangesTool.implement_changes up to
+                               the pull request, with empty and warm caches
+
+The ADK planner model of run_agent_with_prompt is not benchmarked: its tool
+calls are replayed in the order the agent makes them. The file cache uses
+Redis when it answers; otherwise its Redis tier is turned off for the run,
+so the e2e results do not time connection retries. Whether Redis was used is
+stored with the results.
+
+Each result is the best of N runs in seconds (e2e_cold runs once; the
+agent modules are imported before it, so it measures empty caches rather
+than the import). With --baseline, results slower than the baseline by more
+than the tolerance (a fraction) are reported and the exit status is 1. A
+result over it is measured once more first, so a one-off stall does not
+fail the run, and single-run results are allowed twice the tolerance.
+Before each benchmark a fixed pure-Python workload is timed. Comparisons
+are relative to it, which cancels out how fast a shared machine happens to
+run at the time.
+--check compares with the committed benchmarks/baseline.json. The tolerance
+is --tolerance, else the one saved in the baseline, else 0.5. The machine,
+Python version and profile are stored with the results; compare like with
+like, and re-save the baseline when the benchmark machine changes, with a
+higher --repeat (e.g. 15) than checks use so it is not taken in a slow spell.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import sys
+import time
+from pathlib import Path
+from typing import Callable, Dict
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "multi_tool_agent"))
+
+from bench_parse_file_str import legacy_parse_file_str, synthetic_component, uncached_parse_file_str  # noqa: E402
+from fixtures import coder_response_json, synthetic_flat_tree, synthetic_repo_files  # noqa: E402
+from stub_github import BRANCH, OWNER, REPO, StubGitHub  # noqa: E402
+
+DEFAULT_BASELINE = Path(__file__).resolve().parent / "baseline.json"
+# Shared CI machines vary by a third between runs; the gains guarded here are 2-10x.
+DEFAULT_TOLERANCE = 0.5
+# Measured once per process, so noisier than the best-of-N results and not re-measurable.
+SINGLE_RUN = {"e2e_cold"}
+
+
+def redis_available() -> bool:
+    from redis.exceptions import RedisError
+    from redis_client import redis_client
+    try:
+        return bool(redis_client.ping())
+    except RedisError:
+        return False
+
+
+def calibration_workload() -> None:
+    sum(i * i for i in range(200_000))
+
+
+def best_of(fn: Callable, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def micro_benchmarks(repeat: int, entries: int) -> Dict[str, Callable[[], float]]:
+    from parse_cache import parse_cache
+    from tools.apply_code_changes import apply_code_changes_with_edits
+    from tools.get_repo_tree import build_tree_from_flat_list
+    from tools.verify_changes import verify_changes
+
+    component = synthetic_component()
+    flat_tree = synthetic_flat_tree(entries)
+    changes_json = coder_response_json([("src/Widgets.jsx", component)], edits_per_file=200)
+
+    def verify_full():
+        _, files, _ = apply_code_changes_with_edits(changes_json, [("src/Widgets.jsx", component)])
+        edited = files[0][1]
+
+        def run():
+            parse_cache.clear()
+            verify_changes(edited, "javascript")
+        return best_of(run, repeat)
+
+    def verify_incremental():
+        _, files, file_edits = apply_code_changes_with_edits(changes_json, [("src/Widgets.jsx", component)])
+        edited, edits = files[0][1], file_edits["src/Widgets.jsx"].edits
+
+        def run():
+            parse_cache.clear()
+            parse_cache.parse(component, "javascript")
+            start = time.perf_counter()
+            verify_changes(edited, "javascript", base=component, edits=edits)
+            return time.perf_counter() - start
+        return min(run() for _ in range(repeat))
+
+    return {
+        "parse_file_str": lambda: best_of(lambda: uncached_parse_file_str(component, "jsx"), repeat),
+        "parse_file_str_legacy": lambda: best_of(lambda: legacy_parse_file_str(component, "jsx"), repeat),
+        "build_tree_from_flat_list": lambda: best_of(lambda: build_tree_from_flat_list(flat_tree), repeat),
+        "apply_code_changes": lambda: best_of(
+            lambda: apply_code_changes_with_edits(changes_json, [("src/Widgets.jsx", component)]), repeat),
+        "verify_changes_full": verify_full,
+        "verify_changes_incremental": verify_incremental,
+    }
+
+
+async def run_pipeline(model, files: Dict[str, str]) -> str:
+    """The tool calls the agent makes for a request, in order."""
+    from main import ImplementChangesTool
+    from models import Repo
+    from tools.get_file_content import get_file_content
+    from tools.get_repo_tree import get_repo_tree
+
+    token = "bench-token"
+    repo = Repo(id=1, name=REPO, full_name=f"{OWNER}/{REPO}", private=False,
+                owner={"login": OWNER, "id": 1}, html_url=f"https://github.com/{OWNER}/{REPO}",
+                default_branch=BRANCH)
+    await get_repo_tree(OWNER, REPO, BRANCH, token)
+    for path in files:
+        await get_file_content(OWNER, REPO, path, token)
+    tool = ImplementChangesTool(model=model, repo=repo, access_token=token,
+                                user_prompt="Add a benchmark comment to every widget.", socket_id=None)
+    return await tool.implement_changes("Add a benchmark comment to every widget.", list(files))
+
+
+def e2e_benchmarks(repeat: int, profile_name: str, file_count: int) -> Dict[str, Callable[[], float]]:
+    from fake_model import PROFILES, FakeModel
+    # Pay for importing the pipeline (ADK, providers) before anything is timed.
+    import main  # noqa: F401
+
+    files = synthetic_repo_files(file_count)
+
+    def run_once() -> float:
+        start = time.perf_counter()
+        pr_url = asyncio.run(run_pipeline(FakeModel(profile=PROFILES[profile_name]), files))
+        elapsed = time.perf_counter() - start
+        if "github.com" not in pr_url:
+            raise SystemExit(f"e2e run did not produce a pull request: {pr_url}")
+        return elapsed
+
+    # Cold first: the caches are empty only for the first run in this process.
+    return {
+        "e2e_cold": run_once,
+        "e2e_warm": lambda: min(run_once() for _ in range(repeat)),
+    }
+
+
+def slowdown(name: str, seconds: float, calibration: float, baseline: dict) -> float | None:
+    """`seconds` over the baseline's result, both relative to their calibration when recorded."""
+    base = baseline.get("results", {}).get(name)
+    if not base:
+        return None
+    base_calibration = baseline.get("calibration", {}).get(name)
+    if base_calibration and calibration:
+        return (seconds / calibration) / (base / base_calibration)
+    return seconds / base
+
+
+def regressed(name: str, seconds: float, calibration: float, baseline: dict, tolerance: float) -> bool:
+    ratio = slowdown(name, seconds, calibration, baseline)
+    allowed = tolerance * 2 if name in SINGLE_RUN else tolerance
+    return ratio is not None and ratio > 1 + allowed
+
+
+def compare(results: Dict[str, float], calibration: Dict[str, float], baseline: dict, tolerance: float) -> list:
+    regressions = []
+    for name, seconds in results.items():
+        ratio = slowdown(name, seconds, calibration.get(name), baseline)
+        if ratio is None:
+            continue
+        marker = ""
+        if regressed(name, seconds, calibration.get(name), baseline, tolerance):
+            marker = "  REGRESSION"
+            regressions.append(name)
+        base = baseline["results"][name]
+        print(f"  {name:<28} {base * 1000:10.2f} ms -> {seconds * 1000:10.2f} ms  ({ratio:.2f}x){marker}")
+    return regressions
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument("--repeat", type=int, default=5)
+    arg_parser.add_argument("--only", nargs="*", default=None)
+    arg_parser.add_argument("--entries", type=int, default=100_000, help="flat tree size for build_tree_from_flat_list")
+    arg_parser.add_argument("--files", type=int, default=4, help="files changed in the e2e run")
+    arg_parser.add_argument("--profile", default="instant", help="fake model latency profile")
+    arg_parser.add_argument("--github-latency", type=float, default=0.0, help="seconds added to each stub GitHub request")
+    arg_parser.add_argument("--output", type=Path)
+    arg_parser.add_argument("--baseline", type=Path)
+    arg_parser.add_argument("--check", action="store_true", help=f"compare with {DEFAULT_BASELINE.name}")
+    arg_parser.add_argument("--tolerance", type=float, default=None,
+                            help=f"allowed slowdown as a fraction (default: the baseline's, else {DEFAULT_TOLERANCE})")
+    arg_parser.add_argument("--save-baseline", type=Path)
+    args = arg_parser.parse_args()
+    if args.check and not args.baseline:
+        args.baseline = DEFAULT_BASELINE
+    baseline = json.loads(args.baseline.read_text(encoding="utf-8")) if args.baseline else {}
+    tolerance = args.tolerance if args.tolerance is not None else baseline.get("tolerance", DEFAULT_TOLERANCE)
+
+    # The stub must be up, and GITHUB_API_BASE set, before any agent module
+    # imports github_client.
+    stub = StubGitHub(synthetic_repo_files(args.files), filler=synthetic_flat_tree(5_000), latency=args.github_latency)
+    stub.start()
+    os.environ["GITHUB_API_BASE"] = stub.base_url
+    redis = redis_available()
+    if not redis:
+        print("Redis unavailable: the file cache runs without its Redis tier")
+        os.environ["FILE_CACHE_REDIS_TTL"] = "0"
+    try:
+        benchmarks = {**micro_benchmarks(args.repeat, args.entries),
+                      **e2e_benchmarks(args.repeat, args.profile, args.files)}
+        results, calibration = {}, {}
+        for name, run in benchmarks.items():
+            if args.only and name not in args.only:
+                continue
+            calibration[name] = best_of(calibration_workload, args.repeat)
+            results[name] = run()
+            if name not in SINGLE_RUN and regressed(name, results[name], calibration[name], baseline, tolerance):
+                calibration[name] = best_of(calibration_workload, args.repeat)
+                results[name] = run()
+            print(f"{name:<28} {results[name] * 1000:10.2f} ms")
+        print(f"stub GitHub requests: {sum(stub.requests.values())}")
+    finally:
+        stub.stop()
+
+    report = {
+        "machine": platform.platform(),
+        "python": platform.python_version(),
+        "profile": args.profile,
+        "repeat": args.repeat,
+        "redis": redis,
+        "tolerance": tolerance,
+        "results": results,
+        "calibration": calibration,
+    }
+    for path in filter(None, (args.output, args.save_baseline)):
+        path.write_text(json.dumps(report, indent=2) + "\n", encoding="utf-8")
+        print(f"wrote {path}")
+
+    if args.baseline:
+        print(f"compared with {args.baseline} ({baseline.get('machine')}, Python {baseline.get('python')}, "
+              f"Redis {'on' if baseline.get('redis') else 'off'}, tolerance {tolerance:.0%}):")
+        regressions = compare(results, calibration, baseline, tolerance)
+        if regressions:
+            raise SystemExit(f"regressions: {', '.join(regressions)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+"""
+Local stand-in for the parts of the GitHub REST API the agent uses.
+
+Serves one repository (`owner/repo`, branch `main`) whose tree is the given
+files plus synthetic filler entries, and accepts the blob/tree/commit/ref/
+pull request writes of submit_pull_request. Every request can be delayed by a
+fixed latency to approximate a real round trip. Point the agent at it with
+GITHUB_API_BASE=stub.base_url before github_client is imported.
+"""
+import base64
+import hashlib
+import json
+import re
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List
+from urllib.parse import unquote, urlsplit
+
+from fixtures import git_sha
+
+OWNER, REPO, BRANCH = "bench", "repo", "main"
+
+
+class StubGitHub:
+    def __init__(self, files: Dict[str, str], filler: List[Dict] | None = None, latency: float = 0.0):
+        self.files = files
+        self.latency = latency
+        self.requests = Counter()
+        self._filler = filler or []
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread = None
+        self._pulls = 0
+        self.commit_sha = hashlib.sha1(b"commit").hexdigest()
+        self.tree_sha = hashlib.sha1(b"tree").hexdigest()
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address
+        return f"http://{host}:{port}"
+
+    def start(self) -> "StubGitHub":
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def tree_items(self) -> List[Dict]:
+        repo_url = f"{self.base_url}/repos/{OWNER}/{REPO}"
+        items = [{"path": path, "mode": "100644", "type": "blob", "sha": git_sha(content),
+                  "size": len(content.encode("utf-8")), "url": f"{repo_url}/git/blobs/{git_sha(content)}"}
+                 for path, content in self.files.items()]
+        return items + self._filler
+
+    def handle(self, method: str, path: str, body: dict | None) -> tuple[int, dict]:
+        repo_url = f"{self.base_url}/repos/{OWNER}/{REPO}"
+        prefix = f"/repos/{OWNER}/{REPO}"
+        if not path.startswith(prefix):
+            return 404, {"message": "Not Found"}
+        route = path[len(prefix):]
+
+        if method == "GET":
+            if route == f"/git/refs/heads/{BRANCH}":
+                return 200, {"ref": f"refs/heads/{BRANCH}", "object": {"sha": self.commit_sha, "url": f"{repo_url}/git/commits/{self.commit_sha}"}}
+            if route == f"/git/commits/{self.commit_sha}":
+                return 200, {"sha": self.commit_sha, "tree": {"sha": self.tree_sha, "url": f"{repo_url}/git/trees/{self.tree_sha}"}}
+            if route == f"/git/trees/{self.tree_sha}":
+                return 200, {"sha": self.tree_sha, "tree": self.tree_items(), "truncated": False}
+            if route == f"/branches/{BRANCH}":
+                return 200, {"name": BRANCH, "commit": {"sha": self.commit_sha, "commit": {"tree": {"sha": self.tree_sha}}}}
+            match = re.fullmatch(r"/contents/(.+)", route)
+            if match:
+                content = self.files.get(unquote(match.group(1)))
+                if content is None:
+                    return 404, {"message": "Not Found"}
+                return 200, {"type": "file", "sha": git_sha(content), "encoding": "base64",
+                             "content": base64.b64encode(content.encode("utf-8")).decode("ascii")}
+            return 404, {"message": "Not Found"}
+
+        if method == "POST":
+            digest = hashlib.sha1(json.dumps(body, sort_keys=True).encode("utf-8")).hexdigest()
+            if route in ("/git/blobs", "/git/trees", "/git/commits"):
+                return 201, {"sha": digest}
+            if route == "/git/refs":
+                return 201, {"ref": body["ref"], "object": {"sha": body["sha"]}}
+            if route == "/pulls":
+                self._pulls += 1
+                return 201, {"number": self._pulls, "html_url": f"https://github.com/{OWNER}/{REPO}/pull/{self._pulls}"}
+        return 404, {"message": "Not Found"}
+
+    def _handler_class(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                self._respond("GET")
+
+            def do_POST(self):
+                self._respond("POST")
+
+            def _respond(self, method):
+                length = int(self.headers.get("Content-Length") or 0)
+                body = json.loads(self.rfile.read(length)) if length else None
+                path = urlsplit(self.path).path
+                stub.requests[f"{method} {re.sub(r'[0-9a-f]{40}', '{sha}', path)}"] += 1
+                if stub.latency:
+                    time.sleep(stub.latency)
+                status, payload = stub.handle(method, path, body)
+                data = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
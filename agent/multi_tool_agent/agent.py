@@ -1,19 +1,26 @@
+import time
+_import_started = time.perf_counter()
+
 from typing import List
 import uuid
-from fastapi import FastAPI
+from fastapi import FastAPI, Response
+from fastapi.responses import JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
-from main import run_agent
 from models import Repo, Chat
 import socketio
 import uvicorn
-from redis_client import redis_client
 from socket_client import sio
-from start_agent_queue import start_agent_queue
-import json
+from start_agent_queue import deliver_error, deliver_result, start_agent_queue
+from job_queue import DEFAULT_LANE, QUEUE_LANES, admit, queue_depths
+from job_dedup import coalesce, finish, job_key
+from tools.get_repo_tree import get_branch_head_sha
+from metrics import QUEUE_ADMISSIONS, QUEUE_DEDUPLICATIONS, QUEUE_DEPTH, render_metrics, report_import_time
 import asyncio
 import os
 
+report_import_time("api", _import_started)
+
 # Create FastAPI app
 app = FastAPI()
 
@@ -42,6 +49,8 @@ class AgentRequest(BaseModel):
     llm_model_type: str
     llm_model_name: str
     socket_id: str
+    # Priority lane: "paid", "interactive" or "batch"
+    lane: str = DEFAULT_LANE
 
 @sio.event
 async def connect(sid, environ):
@@ -67,22 +76,98 @@ async def register(sid, data):
 def test(): 
     return {"message": "Hello, World!"}
 
+@app.get("/metrics")
+async def metrics():
+    try:
+        for lane, depth in (await queue_depths()).items():
+            QUEUE_DEPTH.labels(lane=lane).set(depth)
+    except Exception as e:
+        print(f"Metrics: failed to read queue depth: {e}")
+    body, content_type = render_metrics()
+    return Response(content=body, media_type=content_type)
+
+# Set to false when jobs are consumed by separate worker processes (worker.py).
+AGENT_INLINE_WORKER = os.getenv("AGENT_INLINE_WORKER", "true").lower() == "true"
+
 queue_worker_task: asyncio.Task | None = None
 queue_worker_lock = asyncio.Lock()
 
 async def ensure_queue_worker_running() -> None:
     global queue_worker_task
+    if not AGENT_INLINE_WORKER:
+        return
     async with queue_worker_lock:
         if queue_worker_task is None or queue_worker_task.done():
             queue_worker_task = asyncio.create_task(start_agent_queue())
 
+ADMISSION_ERRORS = {
+    "queue_full": "Agent queue is full please try again in a few seconds",
+    "lane_full": "This queue is full please try again in a few seconds",
+    "owner_limit": "You already have the maximum number of queued requests, please wait for one to finish",
+}
+
+# Deliveries of cached results, referenced until done so they are not garbage collected.
+background_tasks: set[asyncio.Task] = set()
+
+def run_in_background(coro) -> None:
+    task = asyncio.create_task(coro)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+
+# Longest the branch head lookup may hold up a request; past it the job is queued without deduplication.
+DEDUP_HEAD_TIMEOUT = float(os.getenv("DEDUP_HEAD_TIMEOUT", "2"))
+
+async def dedup_key(request: AgentRequest) -> str | None:
+    """The job key of the request at the current head of the repo's default branch; None if unavailable."""
+    try:
+        head_sha = await asyncio.wait_for(
+            get_branch_head_sha(
+                request.repo.owner.login, request.repo.name, request.repo.default_branch, request.access_token
+            ),
+            DEDUP_HEAD_TIMEOUT,
+        )
+    except asyncio.TimeoutError:
+        print(f"Deduplication skipped, the branch head lookup took over {DEDUP_HEAD_TIMEOUT}s")
+        return None
+    except Exception as e:
+        print(f"Deduplication skipped, failed to resolve the branch head: {e}")
+        return None
+    return job_key(request.access_token, request.repo.full_name, head_sha, request.user_prompt,
+                   request.llm_model_type, request.llm_model_name)
+
 @app.post("/agent")
 async def run_agent_endpoint(request: AgentRequest):
-    if redis_client.llen("agent_queue") > 10:
-        return {"error": "Agent queue is full please try again in a few seconds"}
-    redis_client.lpush("agent_queue", json.dumps(request.model_dump()))
+    if request.lane not in QUEUE_LANES:
+        return JSONResponse(status_code=400, content={"error": f"Unknown lane: {request.lane}"})
+    job = request.model_dump(exclude={"lane"})
+
+    # Identical jobs run once: later duplicates get the cached PR, and ones
+    # arriving while it runs are attached to it, both without a queue slot.
+    key = await dedup_key(request)
+    if key is not None:
+        job_id = uuid.uuid4().hex
+        waiter = {"socket_id": request.socket_id, "chat": job["chat"], "project_id": request.project_id}
+        status, result = await coalesce(key, job_id, waiter)
+        QUEUE_DEDUPLICATIONS.labels(result=status).inc()
+        if status == "cached":
+            run_in_background(deliver_result(job, result["pr_url"], result["session"]))
+            return {"message": "Completed", "pr_url": result["pr_url"]}
+        if status == "attached":
+            return {"message": "Queued", "lane": request.lane, "duplicate": True}
+        job.update(dedup_key=key, job_id=job_id)
+
+    admission = await admit(job, request.lane, owner=request.chat.userEmail)
+    QUEUE_ADMISSIONS.labels(lane=admission.lane, status=admission.status).inc()
+    wait = admission.estimated_wait_seconds
+    if not admission.accepted:
+        if key is not None:
+            # Duplicates that attached in the meantime share the rejection.
+            for waiter in await finish(key, job_id, None):
+                run_in_background(deliver_error({**job, **waiter}, RuntimeError(ADMISSION_ERRORS[admission.status])))
+        # Same 200 + "error" shape clients have always handled for a full queue.
+        return {"error": ADMISSION_ERRORS[admission.status], "retry_after_seconds": wait}
     await ensure_queue_worker_running()
-    return {"message": "Queued"}
+    return {"message": "Queued", "lane": admission.lane, "position": admission.position, "estimated_wait_seconds": wait}
 
 if __name__ == "__main__":
     uvicorn.run(
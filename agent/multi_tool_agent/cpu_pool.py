@@ -0,0 +1,122 @@
+"""
+Process pool for the CPU-bound steps of a job: parsing, applying the coder's
+changes and verifying the result.
+
+Those steps are pure Python and tree-sitter work; run on the event loop of a
+queue worker they hold up every other job in the process and its socket
+traffic. Work at least CPU_OFFLOAD_MIN_BYTES in size goes to a shared
+ProcessPoolExecutor instead; anything smaller runs inline, where the round
+trip to another process would cost more than it saves. Functions sent to the
+pool must be module-level and take and return plain picklable values.
+
+Pool processes start from `_init_pool_process`, which loads only the
+parsers; the functions sent to them import just the parse/apply/verify
+modules. Spawn also re-imports the parent's main module in every pool
+process, so entry points (worker.py) keep their imports inside main().
+
+Each pool process has its own parse cache and parsers, so trees cached in
+the worker are not reused by offloaded parses, and the other way round.
+"""
+import asyncio
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import get_context
+from threading import Lock
+from typing import Callable, List, Sequence
+from metrics import CPU_TASKS, STAGE_SECONDS
+
+# 0 disables the pool; everything then runs in process.
+CPU_POOL_WORKERS = int(os.getenv("CPU_POOL_WORKERS", str(min(4, os.cpu_count() or 1))))
+CPU_OFFLOAD_MIN_BYTES = int(os.getenv("CPU_OFFLOAD_MIN_BYTES", str(64 * 1024)))
+
+_pool: ProcessPoolExecutor | None = None
+_pool_lock = Lock()
+
+
+def get_pool() -> ProcessPoolExecutor | None:
+    """The shared pool, started on first use; None when disabled."""
+    global _pool
+    if CPU_POOL_WORKERS <= 0:
+        return None
+    with _pool_lock:
+        if _pool is None:
+            # spawn: forking a process with a running event loop and Redis
+            # connections would copy them into the children.
+            _pool = ProcessPoolExecutor(max_workers=CPU_POOL_WORKERS, mp_context=get_context("spawn"),
+                                        initializer=_init_pool_process)
+        return _pool
+
+
+def shutdown() -> None:
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+async def run_cpu_bound(stage: str, func: Callable, *args, size: int):
+    """`func(*args)`, in the pool when `size` (bytes of input) reaches the offload threshold."""
+    pool = get_pool() if size >= CPU_OFFLOAD_MIN_BYTES else None
+    if pool is None:
+        CPU_TASKS.labels(stage=stage, executor="inline").inc()
+        return func(*args)
+
+    CPU_TASKS.labels(stage=stage, executor="pool").inc()
+    start = time.perf_counter()
+    try:
+        return await asyncio.get_running_loop().run_in_executor(pool, func, *args)
+    except BrokenProcessPool as e:
+        # A pool process died (e.g. killed for memory); start a new pool next time.
+        print(f"CPU pool broken ({e}); running {stage} in process")
+        _discard(pool)
+        return func(*args)
+    finally:
+        # Timers inside func record in the pool process, out of reach of /metrics.
+        STAGE_SECONDS.labels(stage=stage).observe(time.perf_counter() - start)
+
+
+async def map_cpu_bound(stage: str, func: Callable[[List], List], items: Sequence, sizeof: Callable) -> List:
+    """
+    `func` applied to batches of `items`, results in item order. `func` takes
+    a list of items and returns one result per item.
+
+    Items at or above the offload threshold are sent to the pool one per task,
+    so they are processed in parallel; the small ones share one batch, which
+    is offloaded only if together they reach the threshold.
+    """
+    large, small = [], []
+    for index, item in enumerate(items):
+        (large if sizeof(item) >= CPU_OFFLOAD_MIN_BYTES else small).append(index)
+    batches = [[index] for index in large]
+    if small:
+        batches.append(small)
+
+    async def run(batch):
+        batch_items = [items[index] for index in batch]
+        return await run_cpu_bound(stage, func, batch_items, size=sum(sizeof(item) for item in batch_items))
+
+    results = [None] * len(items)
+    for batch, batch_results in zip(batches, await asyncio.gather(*(run(batch) for batch in batches))):
+        for index, result in zip(batch, batch_results):
+            results[index] = result
+    return results
+
+
+def _discard(pool: ProcessPoolExecutor) -> None:
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _init_pool_process() -> None:
+    import sys
+    import parsers
+    parsers.warm_up()
+    if "main" in sys.modules:
+        # Only the parse/apply/verify helpers belong in pool processes.
+        print("CPU pool process imported the agent pipeline; keep the entry point's imports inside main()")
@@ -0,0 +1,105 @@
+"""
+Content-addressed cache for repository file contents.
+
+Files are keyed by their git blob SHA, so a cached entry can never be stale:
+a changed file has a different SHA. Lookups go through an in-process LRU
+first and then a shared Redis tier (async callers use `aget`/`aset`, so a
+miss does not block the event loop on the round-trip), which lets unchanged files be reused
+across jobs and across worker processes.
+
+`get_repo_tree` records the path -> blob SHA mapping it sees for each
+repository (scoped to the access token that listed it), which is what lets
+`get_file_content` find a file in the cache before asking GitHub for it.
+"""
+import os
+from typing import Dict, List
+from redis.exceptions import RedisError
+from cache import LRUCache, token_fingerprint
+from redis_client import async_redis_client, redis_client
+
+FILE_CACHE_MAX_BYTES = int(os.getenv("FILE_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+# 0 disables the Redis tier; files are then cached in process only.
+FILE_CACHE_REDIS_TTL = int(os.getenv("FILE_CACHE_REDIS_TTL", str(24 * 60 * 60)))
+FILE_CACHE_REDIS_MAX_ENTRY_BYTES = int(os.getenv("FILE_CACHE_REDIS_MAX_ENTRY_BYTES", str(1024 * 1024)))
+TREE_INDEX_MAX_REPOS = int(os.getenv("TREE_INDEX_MAX_REPOS", "256"))
+
+REDIS_KEY_PREFIX = "file_blob:"
+
+
+def _utf8_size(value: str) -> int:
+    return len(value.encode("utf-8"))
+
+
+class FileCache:
+    """Two-tier (in-process LRU + Redis) cache of decoded file contents by blob SHA."""
+
+    def __init__(self, max_bytes: int = FILE_CACHE_MAX_BYTES, redis_ttl: int = FILE_CACHE_REDIS_TTL):
+        self._local = LRUCache(max_bytes=max_bytes, sizeof=_utf8_size)
+        self._path_index = LRUCache(max_entries=TREE_INDEX_MAX_REPOS)
+        self._redis_ttl = redis_ttl
+
+    def index_tree(self, owner: str, repo_name: str, access_token: str, flat_items: List[Dict]) -> None:
+        """Remember the blob SHA of every file in a freshly listed repo tree."""
+        shas = {item["path"]: item["sha"] for item in flat_items if item.get("type") == "blob"}
+        self._path_index.set(_index_key(owner, repo_name, access_token), shas)
+
+    def sha_for_path(self, owner: str, repo_name: str, access_token: str, path: str) -> str | None:
+        shas = self._path_index.get(_index_key(owner, repo_name, access_token))
+        return shas.get(path) if shas else None
+
+    def get(self, sha: str) -> str | None:
+        content = self._local.get(sha)
+        if content is not None:
+            return content
+        if not self._redis_ttl:
+            return None
+        try:
+            content = redis_client.get(REDIS_KEY_PREFIX + sha)
+        except RedisError as e:
+            print(f"File cache: Redis lookup failed: {e}")
+            return None
+        if content is not None:
+            self._local.set(sha, content)
+        return content
+
+    def set(self, sha: str, content: str) -> None:
+        self._local.set(sha, content)
+        if not self._redis_ttl or _utf8_size(content) > FILE_CACHE_REDIS_MAX_ENTRY_BYTES:
+            return
+        try:
+            redis_client.set(REDIS_KEY_PREFIX + sha, content, ex=self._redis_ttl)
+        except RedisError as e:
+            print(f"File cache: Redis write failed: {e}")
+
+    async def aget(self, sha: str) -> str | None:
+        content = self._local.get(sha)
+        if content is not None:
+            return content
+        if not self._redis_ttl:
+            return None
+        try:
+            content = await async_redis_client.get(REDIS_KEY_PREFIX + sha)
+        except RedisError as e:
+            print(f"File cache: Redis lookup failed: {e}")
+            return None
+        if content is not None:
+            self._local.set(sha, content)
+        return content
+
+    async def aset(self, sha: str, content: str) -> None:
+        self._local.set(sha, content)
+        if not self._redis_ttl or _utf8_size(content) > FILE_CACHE_REDIS_MAX_ENTRY_BYTES:
+            return
+        try:
+            await async_redis_client.set(REDIS_KEY_PREFIX + sha, content, ex=self._redis_ttl)
+        except RedisError as e:
+            print(f"File cache: Redis write failed: {e}")
+
+
+def _index_key(owner: str, repo_name: str, access_token: str) -> tuple:
+    # Scope the path index to the token so a caller can only hit the cache for
+    # repositories it was itself able to list.
+    return (owner.lower(), repo_name.lower(), token_fingerprint(access_token))
+
+
+file_cache = FileCache()
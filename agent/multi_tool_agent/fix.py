@@ -1,12 +1,21 @@
+import asyncio
 import json
+import os
+import posixpath
+import time
 from typing import List, Tuple
-from pydantic import BaseModel
-from llm_models.model import Model
+# AgentResponse is the Pydantic model for the structured output of the Analyst agent.
+from llm_models.model import AgentResponse, Model
+from llm_models.tokens import TokenBudget, estimate_tokens
+from metrics import LLM_ERRORS, LLM_REQUEST_SECONDS
+from progress import GenerationProgress
+from prompt_context import format_interface_summary, prepare_outlines
+from tools.apply_code_changes import CoderResponse
 
-# This is the Pydantic model for the structured output of the Analyst agent.
-class AgentResponse(BaseModel):
-    plan: str
-    file_contents: List[Tuple[str, str]]
+# Fan-out mode: generate the changes for each group of related files in its
+# own concurrent LLM call instead of one call for every file.
+CODER_FANOUT = os.getenv("CODER_FANOUT", "false").lower() == "true"
+CODER_FANOUT_CONCURRENCY = int(os.getenv("CODER_FANOUT_CONCURRENCY", "4"))
 
 def parse_agent_response(raw_response_string: str) -> AgentResponse:
     """
@@ -35,7 +44,8 @@ def parse_agent_response(raw_response_string: str) -> AgentResponse:
     # Create and return a validated Pydantic model instance.
     return AgentResponse(**inner_data)
 
-def get_code_changes(user_prompt: str, raw_analyst_output: str, llm_model: Model):
+async def get_code_changes(user_prompt: str, raw_analyst_output: str, llm_model: Model, budget: TokenBudget | None = None,
+                           progress: GenerationProgress | None = None):
     """
     Takes the raw output from the Analyst agent, parses it,
     and then prepares the prompt for the Coder LLM to get the code changes.
@@ -47,7 +57,99 @@ def get_code_changes(user_prompt: str, raw_analyst_output: str, llm_model: Model
         print(f"Error parsing analyst response: {e}")
         return None, None
 
-    response = llm_model.generate_content(user_prompt, analyst_response)
+    # Parse large files in the CPU pool before the (synchronous) prompt building needs them.
+    await prepare_outlines(analyst_response.file_contents + analyst_response.context_files)
+
+    groups = group_related_files(analyst_response.file_contents) if CODER_FANOUT else []
+    if len(groups) > 1:
+        response = await _generate_fanned_out(user_prompt, analyst_response, groups, llm_model, budget, progress)
+    else:
+        response = await _agenerate(llm_model, user_prompt, analyst_response, budget, progress)
     
     print('LLM Response: ', response)
     return response, analyst_response.file_contents
+
+async def _agenerate(llm_model: Model, user_prompt: str, analyst_response: AgentResponse,
+                     budget: TokenBudget | None, progress: GenerationProgress | None) -> str:
+    labels = {"provider": llm_model.provider, "model": llm_model.name}
+    start = time.perf_counter()
+    try:
+        return await llm_model.agenerate_content(user_prompt, analyst_response, budget,
+                                                 progress.stream() if progress else None)
+    except Exception as e:
+        LLM_ERRORS.labels(error=type(e).__name__, **labels).inc()
+        raise
+    finally:
+        LLM_REQUEST_SECONDS.labels(**labels).observe(time.perf_counter() - start)
+
+def group_related_files(file_contents: List[Tuple[str, str]]) -> List[List[Tuple[str, str]]]:
+    """
+    Groups files that are usually changed together: same directory and same
+    base name, e.g. `Button.jsx`, `Button.test.jsx` and `Button.module.css`.
+    Groups keep the order in which their first file was given.
+    """
+    groups = {}
+    for file_path, content in file_contents:
+        directory, file_name = posixpath.split(file_path)
+        groups.setdefault((directory, file_name.split(".")[0]), []).append((file_path, content))
+    return list(groups.values())
+
+async def _generate_fanned_out(user_prompt: str, analyst_response: AgentResponse, groups: List[List[Tuple[str, str]]],
+                               llm_model: Model, budget: TokenBudget | None,
+                               progress: GenerationProgress | None = None) -> str | None:
+    """
+    Generates each group's changes concurrently, every call sharing the plan
+    and an interface summary of the other groups, and merges the results into
+    one CoderResponse JSON string for apply_code_changes.
+
+    Each call gets a share of the job's token budget in proportion to its
+    prompt, since none of them sees the others' usage until they finish.
+    """
+    semaphore = asyncio.Semaphore(CODER_FANOUT_CONCURRENCY)
+    group_responses = []
+    for group in groups:
+        paths = {file_path for file_path, _ in group}
+        others = [(file_path, content) for file_path, content in analyst_response.file_contents if file_path not in paths]
+        group_responses.append(analyst_response.model_copy(update={
+            "file_contents": group,
+            "related_files_summary": format_interface_summary(others),
+        }))
+    shares = (budget or TokenBudget()).split([
+        estimate_tokens(llm_model.get_fix_prompt(user_prompt, group_response), llm_model.provider)
+        for group_response in group_responses
+    ])
+
+    async def generate(group_response, share):
+        async with semaphore:
+            return await _agenerate(llm_model, user_prompt, group_response, share, progress)
+
+    print(f"Generating changes for {len(groups)} file groups concurrently")
+    tasks = [asyncio.create_task(generate(group_response, share)) for group_response, share in zip(group_responses, shares)]
+    try:
+        responses = await asyncio.gather(*tasks)
+    except BaseException:
+        # One group failed (budget, stall, API error): stop the others instead
+        # of letting them spend tokens on a response that will be discarded.
+        for task in tasks:
+            task.cancel()
+        raise
+
+    merged = None
+    for group, response in zip(groups, responses):
+        try:
+            coder_response = CoderResponse(**json.loads(response.strip().strip('```json').strip()))
+        except Exception as e:
+            # A partial merge would submit the plan half-implemented; let the caller retry.
+            print(f"Error parsing coder response for {[file_path for file_path, _ in group]}: {e}")
+            return None
+        # Edits to another group's files would collide with that group's own.
+        paths = {file_path for file_path, _ in group}
+        coder_response.changes = [change for change in coder_response.changes
+                                  if change.is_new_file or change.file_path in paths]
+        if merged is None:
+            merged = coder_response
+        else:
+            merged.changes.extend(coder_response.changes)
+            if coder_response.pr_description and coder_response.pr_description not in merged.pr_description:
+                merged.pr_description = f"{merged.pr_description} {coder_response.pr_description}".strip()
+    return merged.model_dump_json() if merged is not None else None
@@ -0,0 +1,177 @@
+"""
+Shared, connection-pooled client for the GitHub REST API.
+
+Every tool talks to GitHub through the `github` instance below so that TLS
+connections are kept alive and reused across calls and jobs, and so that
+headers, timeouts and the retry/backoff policy live in one place.
+
+Both a sync (`request`) and an async (`arequest`) entry point are provided.
+The async client is created lazily per event loop, since httpx async clients
+cannot be shared across loops.
+"""
+import asyncio
+import os
+import random
+import threading
+import time
+import weakref
+import httpx
+
+GITHUB_API_BASE = os.getenv("GITHUB_API_BASE", "https://api.github.com")
+GITHUB_TIMEOUT = float(os.getenv("GITHUB_TIMEOUT", "30"))
+GITHUB_MAX_RETRIES = int(os.getenv("GITHUB_MAX_RETRIES", "3"))
+GITHUB_MAX_CONNECTIONS = int(os.getenv("GITHUB_MAX_CONNECTIONS", "20"))
+# Never sleep longer than this waiting for a rate limit to reset; past it the
+# error response is returned to the caller instead.
+GITHUB_MAX_BACKOFF = float(os.getenv("GITHUB_MAX_BACKOFF", "30"))
+
+RETRYABLE_STATUS = {500, 502, 503, 504}
+IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS", "PUT", "DELETE"}
+
+
+def github_headers(access_token: str | None, accept: str = "application/vnd.github+json") -> dict:
+    headers = {"Accept": accept, "X-GitHub-Api-Version": "2022-11-28"}
+    if access_token:
+        headers["Authorization"] = f"Bearer {access_token}"
+    return headers
+
+
+class GitHubClient:
+    def __init__(self, base_url: str = GITHUB_API_BASE, timeout: float = GITHUB_TIMEOUT,
+                 max_retries: int = GITHUB_MAX_RETRIES, max_connections: int = GITHUB_MAX_CONNECTIONS):
+        self.base_url = base_url
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self._limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+        self._sync_client: httpx.Client | None = None
+        self._async_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, httpx.AsyncClient]" = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+
+    def request(self, method: str, url: str, access_token: str | None = None, *,
+                headers: dict | None = None, timeout: float | None = None, **kwargs) -> httpx.Response:
+        """Send a request, retrying transient failures. Returns the final response."""
+        client = self._get_sync_client()
+        request_headers = {**github_headers(access_token), **(headers or {})}
+        attempt = 0
+        while True:
+            try:
+                response = client.request(method, url, headers=request_headers, timeout=timeout or self.timeout, **kwargs)
+            except httpx.TransportError as e:
+                delay = self._transport_retry_delay(method, e, attempt)
+                if delay is None:
+                    raise
+            else:
+                delay = self._response_retry_delay(method, response, attempt)
+                if delay is None:
+                    return response
+            attempt += 1
+            time.sleep(delay)
+
+    async def arequest(self, method: str, url: str, access_token: str | None = None, *,
+                       headers: dict | None = None, timeout: float | None = None, **kwargs) -> httpx.Response:
+        """Async counterpart of `request`."""
+        client = self._get_async_client()
+        request_headers = {**github_headers(access_token), **(headers or {})}
+        attempt = 0
+        while True:
+            try:
+                response = await client.request(method, url, headers=request_headers, timeout=timeout or self.timeout, **kwargs)
+            except httpx.TransportError as e:
+                delay = self._transport_retry_delay(method, e, attempt)
+                if delay is None:
+                    raise
+            else:
+                delay = self._response_retry_delay(method, response, attempt)
+                if delay is None:
+                    return response
+            attempt += 1
+            await asyncio.sleep(delay)
+
+    def get(self, url: str, access_token: str | None = None, **kwargs) -> httpx.Response:
+        return self.request("GET", url, access_token, **kwargs)
+
+    def post(self, url: str, access_token: str | None = None, **kwargs) -> httpx.Response:
+        return self.request("POST", url, access_token, **kwargs)
+
+    def patch(self, url: str, access_token: str | None = None, **kwargs) -> httpx.Response:
+        return self.request("PATCH", url, access_token, **kwargs)
+
+    async def aget(self, url: str, access_token: str | None = None, **kwargs) -> httpx.Response:
+        return await self.arequest("GET", url, access_token, **kwargs)
+
+    async def apost(self, url: str, access_token: str | None = None, **kwargs) -> httpx.Response:
+        return await self.arequest("POST", url, access_token, **kwargs)
+
+    async def apatch(self, url: str, access_token: str | None = None, **kwargs) -> httpx.Response:
+        return await self.arequest("PATCH", url, access_token, **kwargs)
+
+    def close(self) -> None:
+        with self._lock:
+            if self._sync_client is not None:
+                self._sync_client.close()
+                self._sync_client = None
+
+    async def aclose(self) -> None:
+        client = self._async_clients.pop(asyncio.get_running_loop(), None)
+        if client is not None:
+            await client.aclose()
+
+    def _get_sync_client(self) -> httpx.Client:
+        with self._lock:
+            if self._sync_client is None:
+                self._sync_client = httpx.Client(base_url=self.base_url, limits=self._limits, timeout=self.timeout)
+            return self._sync_client
+
+    def _get_async_client(self) -> httpx.AsyncClient:
+        loop = asyncio.get_running_loop()
+        client = self._async_clients.get(loop)
+        if client is None:
+            client = httpx.AsyncClient(base_url=self.base_url, limits=self._limits, timeout=self.timeout)
+            self._async_clients[loop] = client
+        return client
+
+    def _transport_retry_delay(self, method: str, error: httpx.TransportError, attempt: int) -> float | None:
+        if attempt >= self.max_retries:
+            return None
+        # A request that never reached GitHub is always safe to resend.
+        never_sent = isinstance(error, (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout))
+        if not never_sent and method.upper() not in IDEMPOTENT_METHODS:
+            return None
+        return _backoff(attempt)
+
+    def _response_retry_delay(self, method: str, response: httpx.Response, attempt: int) -> float | None:
+        if attempt >= self.max_retries:
+            return None
+        if _is_rate_limited(response):
+            # Rate-limited requests were rejected before being processed, so
+            # they can be retried regardless of method.
+            delay = _rate_limit_delay(response, attempt)
+            return delay if delay <= GITHUB_MAX_BACKOFF else None
+        if response.status_code in RETRYABLE_STATUS and method.upper() in IDEMPOTENT_METHODS:
+            return _backoff(attempt)
+        return None
+
+
+def _backoff(attempt: int) -> float:
+    return min(GITHUB_MAX_BACKOFF, 0.5 * (2 ** attempt)) + random.uniform(0, 0.25)
+
+
+def _is_rate_limited(response: httpx.Response) -> bool:
+    if response.status_code == 429:
+        return True
+    return response.status_code == 403 and (
+        response.headers.get("x-ratelimit-remaining") == "0" or "retry-after" in response.headers
+    )
+
+
+def _rate_limit_delay(response: httpx.Response, attempt: int) -> float:
+    retry_after = response.headers.get("retry-after")
+    if retry_after and retry_after.isdigit():
+        return float(retry_after)
+    reset = response.headers.get("x-ratelimit-reset")
+    if reset and reset.isdigit():
+        return max(0.0, int(reset) - time.time()) + 1
+    return _backoff(attempt)
+
+
+github = GitHubClient()
@@ -0,0 +1,91 @@
+"""
+Coalescing of identical jobs and a cache of their results.
+
+A job is identified by its requester, its repo, the head commit of the
+branch it changes, its prompt and the model type and name (`job_key`). The
+requester is a fingerprint of their access token, so a cached PR or a job in
+flight is only shared with the user (and token) that asked for it. For each
+key Redis holds:
+
+- `agent_job:result:{key}`: the PR URL and session of a job that submitted a
+  pull request, kept for JOB_RESULT_TTL, so a resubmission is answered
+  without running anything;
+- `agent_job:inflight:{key}`: the id of the job that is queued or running for
+  the key, claimed with SET NX at enqueue; and
+- `agent_job:waiters:{key}`: the duplicate requests that arrived while it was
+  in flight. They are attached instead of queued, and get its result when it
+  finishes.
+
+Attaching checks the claim and pushes the waiter atomically, and finishing
+drains the waiters and drops the claim atomically, so a duplicate is never
+left waiting on a job that has already finished.
+"""
+import hashlib
+import json
+import os
+from typing import Literal
+from cache import token_fingerprint
+from redis_client import async_redis_client
+
+JOB_RESULT_TTL = int(os.getenv("JOB_RESULT_TTL", str(60 * 60)))
+# Longer than a job waits and runs; a claim left by a lost job expires after it.
+JOB_INFLIGHT_TTL = int(os.getenv("JOB_INFLIGHT_TTL", str(30 * 60)))
+
+RESULT_KEY_PREFIX = "agent_job:result:"
+INFLIGHT_KEY_PREFIX = "agent_job:inflight:"
+WAITERS_KEY_PREFIX = "agent_job:waiters:"
+
+# KEYS: inflight, waiters. ARGV: waiter, ttl.
+_ATTACH_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 0 then return 0 end
+redis.call('RPUSH', KEYS[2], ARGV[1])
+redis.call('EXPIRE', KEYS[2], ARGV[2])
+return 1
+"""
+
+# KEYS: inflight, waiters, result. ARGV: job id, result ('' for none), result ttl.
+_FINISH_SCRIPT = """
+if ARGV[2] ~= '' then redis.call('SET', KEYS[3], ARGV[2], 'EX', ARGV[3]) end
+local waiters = redis.call('LRANGE', KEYS[2], 0, -1)
+redis.call('DEL', KEYS[2])
+if redis.call('GET', KEYS[1]) == ARGV[1] then redis.call('DEL', KEYS[1]) end
+return waiters
+"""
+
+_attach = async_redis_client.register_script(_ATTACH_SCRIPT)
+_finish = async_redis_client.register_script(_FINISH_SCRIPT)
+
+
+def job_key(access_token: str, repo_full_name: str, head_sha: str, user_prompt: str,
+            model_type: str, model_name: str) -> str:
+    prompt_digest = hashlib.sha256(user_prompt.strip().encode("utf-8")).hexdigest()[:32]
+    return f"{token_fingerprint(access_token)}:{repo_full_name.lower()}:{head_sha}:{model_type}:{model_name}:{prompt_digest}"
+
+
+async def coalesce(key: str, job_id: str, waiter: dict) -> tuple[Literal["cached", "attached", "claimed"], dict | None]:
+    """
+    Decide how a new request for `key` is served:
+
+    - ("cached", result) when a previous job's result is still cached,
+    - ("attached", None) when `waiter` was attached to the job in flight, or
+    - ("claimed", None) when `job_id` now owns the key and must be queued.
+    """
+    while True:
+        result = await async_redis_client.get(RESULT_KEY_PREFIX + key)
+        if result is not None:
+            return "cached", json.loads(result)
+        if await async_redis_client.set(INFLIGHT_KEY_PREFIX + key, job_id, nx=True, ex=JOB_INFLIGHT_TTL):
+            return "claimed", None
+        if await _attach(keys=[INFLIGHT_KEY_PREFIX + key, WAITERS_KEY_PREFIX + key],
+                         args=[json.dumps(waiter), JOB_INFLIGHT_TTL]):
+            return "attached", None
+        # The job in flight finished between the two checks; look again.
+
+
+async def finish(key: str, job_id: str, result: dict | None) -> list[dict]:
+    """Release `job_id`'s claim on `key`, caching `result` if given; returns the attached waiters."""
+    waiters = await _finish(
+        keys=[INFLIGHT_KEY_PREFIX + key, WAITERS_KEY_PREFIX + key, RESULT_KEY_PREFIX + key],
+        args=[job_id, json.dumps(result) if result is not None else "", JOB_RESULT_TTL],
+    )
+    return [json.loads(waiter) for waiter in waiters]
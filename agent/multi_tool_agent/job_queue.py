@@ -0,0 +1,283 @@
+"""
+Redis job queue with priority lanes, atomic admission and wait estimates.
+
+Each lane is a list `agent_queue:{lane}`, jobs pushed on the left and taken
+from the right. Admission is one Lua script, so the capacity checks and the
+push cannot interleave with other requests:
+
+- the queue as a whole and each lane have a limit on queued jobs, and each
+  owner (the user's email) one on jobs queued or running, so one user's
+  burst cannot fill the queue, and
+- the number of jobs ahead of the new one is returned with it, for the
+  position and estimated wait shown to the client.
+
+Workers take jobs with another script that moves the job onto their
+processing list. Lanes are served by weighted round robin rather than
+strict priority, so with the default weights batch jobs still get one
+turn in ten while paid and interactive work is queued. A turn whose lane
+is empty falls through to the others in priority order.
+
+An owner's count goes up on admission and down once, when the worker
+acknowledges the job (`ack_job`); a job requeued from a dead worker keeps
+its count. Each count expires QUEUE_OWNER_COUNT_TTL after the owner's last
+admission, so a count left behind by a lost job does not lock them out.
+"""
+import json
+import os
+import time
+from typing import NamedTuple
+from redis_client import async_redis_client
+
+AGENT_QUEUE = "agent_queue"
+# Highest priority first.
+QUEUE_LANES = ("paid", "interactive", "batch")
+DEFAULT_LANE = "interactive"
+
+
+def _lane_setting(name: str, default: str) -> dict[str, int]:
+    """Parse a `lane:value,...` setting; lanes not listed get 0."""
+    values = dict.fromkeys(QUEUE_LANES, 0)
+    for item in os.getenv(name, default).split(","):
+        lane, _, value = item.partition(":")
+        if lane.strip() in values and value.strip():
+            values[lane.strip()] = int(value)
+    return values
+
+
+QUEUE_LANE_WEIGHTS = _lane_setting("QUEUE_LANE_WEIGHTS", "paid:6,interactive:3,batch:1")
+# Queued jobs allowed per lane; 0 means only the overall limit applies.
+QUEUE_LANE_LIMITS = _lane_setting("QUEUE_LANE_LIMITS", "batch:20")
+QUEUE_MAX_JOBS = int(os.getenv("QUEUE_MAX_JOBS", "50"))
+QUEUE_MAX_JOBS_PER_OWNER = int(os.getenv("QUEUE_MAX_JOBS_PER_OWNER", "3"))
+# Longer than a job waits and runs.
+QUEUE_OWNER_COUNT_TTL = int(os.getenv("QUEUE_OWNER_COUNT_TTL", str(30 * 60)))
+# How long an idle worker waits for a wake-up before looking at the lanes again.
+QUEUE_POLL_TIMEOUT = int(os.getenv("QUEUE_POLL_TIMEOUT", "1"))
+# Recent job durations kept for wait estimates, and the estimate used before there are any.
+QUEUE_DURATION_SAMPLES = int(os.getenv("QUEUE_DURATION_SAMPLES", "50"))
+QUEUE_DEFAULT_JOB_SECONDS = float(os.getenv("QUEUE_DEFAULT_JOB_SECONDS", "120"))
+QUEUE_STATS_TTL = float(os.getenv("QUEUE_STATS_TTL", "5"))
+
+OWNER_COUNT_KEY_PREFIX = AGENT_QUEUE + ":owner:"
+WAKE_KEY = AGENT_QUEUE + ":wake"
+TURN_KEY = AGENT_QUEUE + ":turn"
+DURATIONS_KEY = AGENT_QUEUE + ":durations"
+# Shared with start_agent_queue, which owns the processing lists and heartbeats.
+PROCESSING_KEY_PREFIX = AGENT_QUEUE + ":processing:"
+WORKER_HEARTBEAT_PREFIX = "agent_worker:alive:"
+
+# KEYS: lane, owner count, wake list, then every lane by priority.
+# ARGV: payload, max queued, max queued in the lane, whether the job has an
+# owner, max per owner, owner count ttl.
+_ADMIT_SCRIPT = """
+local total = 0
+local ahead = 0
+local reached = false
+for i = 4, #KEYS do
+  local length = redis.call('LLEN', KEYS[i])
+  total = total + length
+  if not reached then ahead = ahead + length end
+  if KEYS[i] == KEYS[1] then reached = true end
+end
+if tonumber(ARGV[2]) > 0 and total >= tonumber(ARGV[2]) then return {'queue_full', total} end
+local lane_length = redis.call('LLEN', KEYS[1])
+if tonumber(ARGV[3]) > 0 and lane_length >= tonumber(ARGV[3]) then return {'lane_full', lane_length} end
+if ARGV[4] == '1' then
+  local owned = tonumber(redis.call('GET', KEYS[2]) or '0')
+  if tonumber(ARGV[5]) > 0 and owned >= tonumber(ARGV[5]) then return {'owner_limit', owned} end
+  redis.call('INCR', KEYS[2])
+  redis.call('EXPIRE', KEYS[2], ARGV[6])
+end
+redis.call('LPUSH', KEYS[1], ARGV[1])
+redis.call('LPUSH', KEYS[3], '1')
+redis.call('LTRIM', KEYS[3], 0, 999)
+return {'ok', ahead}
+"""
+
+# KEYS: processing list, turn counter, then every lane by priority.
+# ARGV: the lanes' weights.
+_POP_SCRIPT = """
+local lanes = #KEYS - 2
+local order = {}
+local total = 0
+for i = 1, #ARGV do total = total + tonumber(ARGV[i]) end
+if total > 0 then
+  local slot = redis.call('INCR', KEYS[2]) % total
+  for i = 1, #ARGV do
+    slot = slot - tonumber(ARGV[i])
+    if slot < 0 then table.insert(order, i); break end
+  end
+end
+for i = 1, lanes do table.insert(order, i) end
+for _, i in ipairs(order) do
+  local payload = redis.call('LMOVE', KEYS[2 + i], KEYS[1], 'RIGHT', 'LEFT')
+  if payload then return payload end
+end
+return false
+"""
+
+# KEYS: processing list, then every lane. ARGV: the lanes' names, then the default lane.
+# Moves the jobs back to the consuming end of their lane, so they run next.
+_REQUEUE_SCRIPT = """
+local lanes = {}
+for i = 2, #KEYS do lanes[ARGV[i - 1]] = KEYS[i] end
+local fallback = lanes[ARGV[#ARGV]]
+local moved = 0
+while true do
+  local payload = redis.call('LPOP', KEYS[1])
+  if not payload then break end
+  local lane = fallback
+  local ok, job = pcall(cjson.decode, payload)
+  if ok and type(job) == 'table' and lanes[job.lane] then lane = lanes[job.lane] end
+  redis.call('RPUSH', lane, payload)
+  moved = moved + 1
+end
+return moved
+"""
+
+# KEYS: processing list, owner count (or none). ARGV: payload.
+# Only the call that removes the job releases its owner's count, at most to 0.
+_ACK_SCRIPT = """
+if redis.call('LREM', KEYS[1], 1, ARGV[1]) == 0 then return 0 end
+if KEYS[2] and redis.call('DECR', KEYS[2]) <= 0 then redis.call('DEL', KEYS[2]) end
+return 1
+"""
+
+_admit = async_redis_client.register_script(_ADMIT_SCRIPT)
+_pop = async_redis_client.register_script(_POP_SCRIPT)
+_requeue = async_redis_client.register_script(_REQUEUE_SCRIPT)
+_ack = async_redis_client.register_script(_ACK_SCRIPT)
+
+
+class Admission(NamedTuple):
+    accepted: bool
+    # "ok", "queue_full", "lane_full" or "owner_limit"
+    status: str
+    lane: str
+    # 1-based position among the jobs that will run before it; None when rejected
+    position: int | None
+    # Until the job starts when accepted, until a retry may succeed otherwise; None when no worker is alive
+    estimated_wait_seconds: float | None
+
+
+class QueueStats(NamedTuple):
+    avg_job_seconds: float
+    # Jobs the live workers can run at once
+    slots: int
+    in_flight: int
+
+    def estimate_wait(self, ahead: int) -> float | None:
+        """Seconds until a job with `ahead` queued jobs before it starts."""
+        if self.slots <= 0:
+            return None
+        waiting = self.in_flight + ahead - self.slots + 1
+        if waiting <= 0:
+            return 0.0
+        return round(-(-waiting // self.slots) * self.avg_job_seconds, 1)
+
+
+def lane_key(lane: str) -> str:
+    return f"{AGENT_QUEUE}:{lane}"
+
+
+def owner_count_key(owner: str) -> str:
+    return OWNER_COUNT_KEY_PREFIX + owner
+
+
+# Consumed in priority order; the unlaned legacy list last, so jobs queued
+# before lanes existed still run.
+_LANE_KEYS = [lane_key(lane) for lane in QUEUE_LANES]
+_CONSUMED_KEYS = _LANE_KEYS + [AGENT_QUEUE]
+
+
+async def admit(job: dict, lane: str = DEFAULT_LANE, owner: str = "") -> Admission:
+    """Queue `job` in `lane` unless the queue, the lane or the owner is at its limit."""
+    payload = json.dumps({**job, "lane": lane, "owner": owner, "enqueued_at": time.time()})
+    status, count = await _admit(
+        keys=[lane_key(lane), owner_count_key(owner), WAKE_KEY, *_LANE_KEYS],
+        args=[payload, QUEUE_MAX_JOBS, QUEUE_LANE_LIMITS[lane], "1" if owner else "",
+              QUEUE_MAX_JOBS_PER_OWNER, QUEUE_OWNER_COUNT_TTL],
+    )
+    stats = await queue_stats()
+    if status == "ok":
+        return Admission(True, status, lane, count + 1, stats.estimate_wait(count))
+    if status == "owner_limit":
+        # The owner's slot frees up when their oldest job finishes.
+        start = stats.estimate_wait(0)
+        return Admission(False, status, lane, None, None if start is None else start + stats.avg_job_seconds)
+    # A queue slot frees up when the oldest queued job starts.
+    return Admission(False, status, lane, None, stats.estimate_wait(count))
+
+
+async def pop_job(processing_key: str) -> str | None:
+    """Move the next job onto `processing_key` and return it; None after waiting QUEUE_POLL_TIMEOUT for one."""
+    payload = await _pop(
+        keys=[processing_key, TURN_KEY, *_CONSUMED_KEYS],
+        args=[QUEUE_LANE_WEIGHTS[lane] for lane in QUEUE_LANES],
+    )
+    if payload:
+        return payload
+    # Admissions push a wake-up token, so an idle worker starts within
+    # milliseconds of a job arriving instead of at the next poll.
+    await async_redis_client.blpop(WAKE_KEY, timeout=QUEUE_POLL_TIMEOUT)
+    return None
+
+
+async def ack_job(processing_key: str, payload: str) -> None:
+    """Remove a finished or dropped job from `processing_key` and release its owner's count."""
+    try:
+        owner = json.loads(payload).get("owner")
+    except (ValueError, AttributeError):
+        owner = None
+    keys = [processing_key] + ([owner_count_key(owner)] if isinstance(owner, str) and owner else [])
+    await _ack(keys=keys, args=[payload])
+
+
+async def requeue(processing_key: str) -> int:
+    """Move every job on `processing_key` back to its lane; returns how many."""
+    return await _requeue(keys=[processing_key, *_LANE_KEYS], args=[*QUEUE_LANES, DEFAULT_LANE])
+
+
+async def queue_depths() -> dict[str, int]:
+    async with async_redis_client.pipeline(transaction=False) as pipe:
+        for key in _LANE_KEYS:
+            pipe.llen(key)
+        depths = await pipe.execute()
+    return dict(zip(QUEUE_LANES, depths))
+
+
+async def record_job_duration(seconds: float) -> None:
+    async with async_redis_client.pipeline(transaction=False) as pipe:
+        pipe.lpush(DURATIONS_KEY, round(seconds, 3))
+        pipe.ltrim(DURATIONS_KEY, 0, QUEUE_DURATION_SAMPLES - 1)
+        await pipe.execute()
+
+
+_stats: tuple[float, QueueStats] | None = None
+
+
+async def queue_stats() -> QueueStats:
+    """Recent average job duration, worker slots and jobs in flight, refreshed every QUEUE_STATS_TTL seconds."""
+    global _stats
+    if _stats is not None and time.monotonic() - _stats[0] < QUEUE_STATS_TTL:
+        return _stats[1]
+
+    durations = [float(value) for value in await async_redis_client.lrange(DURATIONS_KEY, 0, -1)]
+    heartbeat_keys = [key async for key in async_redis_client.scan_iter(match=WORKER_HEARTBEAT_PREFIX + "*")]
+    slots = in_flight = 0
+    if heartbeat_keys:
+        async with async_redis_client.pipeline(transaction=False) as pipe:
+            pipe.mget(heartbeat_keys)
+            for key in heartbeat_keys:
+                pipe.llen(PROCESSING_KEY_PREFIX + key[len(WORKER_HEARTBEAT_PREFIX):])
+            concurrencies, *processing = await pipe.execute()
+        # Heartbeats hold the worker's concurrency (older workers wrote "1").
+        slots = sum(int(value) for value in concurrencies if value and value.isdigit())
+        in_flight = sum(processing)
+    stats = QueueStats(
+        avg_job_seconds=sum(durations) / len(durations) if durations else QUEUE_DEFAULT_JOB_SECONDS,
+        slots=slots,
+        in_flight=in_flight,
+    )
+    _stats = (time.monotonic(), stats)
+    return stats
@@ -1,34 +1,87 @@
-from .model import Model
-from anthropic import Anthropic
+from .model import Model, OnText, PromptParts
+from .tokens import TokenBudget
+from anthropic import Anthropic, AsyncAnthropic
 import os
 from dotenv import load_dotenv
 load_dotenv()
 
 class Claude(Model):
+    provider = "claude"
+
     def __init__(self, name: str):
         super().__init__(name)
-        self.client = Anthropic(api_key=os.getenv("API_KEY_ANTHROPIC"))
-    
-    def generate_content(self, user_prompt: str, analyst_response) -> str:
-        fix_prompt = self.get_fix_prompt(user_prompt, analyst_response)
+        self._client = None
+        self._async_client = None
+
+    @property
+    def client(self) -> Anthropic:
+        if self._client is None:
+            self._client = Anthropic(api_key=os.getenv("API_KEY_ANTHROPIC"))
+        return self._client
+
+    @property
+    def async_client(self) -> AsyncAnthropic:
+        if self._async_client is None:
+            self._async_client = AsyncAnthropic(api_key=os.getenv("API_KEY_ANTHROPIC"))
+        return self._async_client
+
+    def _build_prompt(self, user_prompt: str, analyst_response) -> PromptParts:
+        parts = self.get_fix_prompt_parts(user_prompt, analyst_response)
         
         # Add JSON formatting instruction to the prompt
-        enhanced_prompt = f"{fix_prompt}\n\nIMPORTANT: Return ONLY a valid JSON object. Do not include any other text, explanations, or markdown formatting. The response must start with {{ and end with }}."
+        parts = parts._replace(task=f"{parts.task}\n\nIMPORTANT: Return ONLY a valid JSON object. Do not include any other text, explanations, or markdown formatting. The response must start with {{ and end with }}.")
         
-        print(enhanced_prompt)
-        token_count = self.client.messages.count_tokens(
-            model="claude-opus-4-1-20250805",
-            system="You are a scientist",
-            messages=[{"role": "user", "content": enhanced_prompt}],
-        )
-        print(token_count)
-        
-        response = self.client.messages.create(
+        print(parts.as_text())
+        return parts
+
+    def _message_request(self, parts: PromptParts, budget: TokenBudget) -> dict:
+        # Cache breakpoints after the static instructions and after the file
+        # context: retries reuse both, other jobs reuse at least the first.
+        content = []
+        for text, cacheable in ((parts.instructions, True), (parts.context, True), (parts.task, False)):
+            if not text:
+                continue
+            block = {"type": "text", "text": text}
+            if cacheable:
+                block["cache_control"] = {"type": "ephemeral"}
+            content.append(block)
+        return dict(
             model=self.name,
-            max_tokens=8192,  # Increased for comprehensive responses
+            max_tokens=budget.output_limit(8192),  # Increased for comprehensive responses
             temperature=0.1,  # Lower temperature for more consistent JSON output
-            messages=[{"role": "user", "content": enhanced_prompt}]
+            messages=[{"role": "user", "content": content}]
         )
 
+    def _record_usage(self, budget: TokenBudget, prompt: str, response) -> None:
+        usage = response.usage
+        cache_read = usage.cache_read_input_tokens or 0
+        cache_write = usage.cache_creation_input_tokens or 0
+        if cache_read or cache_write:
+            print(f"Prompt cache ({self.name}): {cache_read} tokens read, {cache_write} tokens written")
+        budget.record(self.provider, self.name, prompt, usage.input_tokens + cache_read + cache_write, usage.output_tokens)
+
+    def generate_content(self, user_prompt: str, analyst_response, budget: TokenBudget | None = None) -> str:
+        budget = budget or TokenBudget()
+        parts = self._build_prompt(user_prompt, analyst_response)
+        enhanced_prompt = parts.as_text()
+        self._check_budget(budget, enhanced_prompt)
+        
+        response = self.client.messages.create(**self._message_request(parts, budget))
+        self._record_usage(budget, enhanced_prompt, response)
+
         return response.content[0].text
-    
\ No newline at end of file
+
+    async def agenerate_content(self, user_prompt: str, analyst_response, budget: TokenBudget | None = None,
+                                on_text: OnText | None = None) -> str:
+        budget = budget or TokenBudget()
+        parts = self._build_prompt(user_prompt, analyst_response)
+        enhanced_prompt = parts.as_text()
+        self._check_budget(budget, enhanced_prompt)
+
+        async def chunks():
+            async with self.async_client.messages.stream(**self._message_request(parts, budget)) as stream:
+                async for text in stream.text_stream:
+                    yield text
+                self._record_usage(budget, enhanced_prompt, await stream.get_final_message())
+
+        return await self._collect_stream(chunks(), on_text)
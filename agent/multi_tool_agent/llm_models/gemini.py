@@ -1,21 +1,63 @@
-from .model import Model
+from .model import Model, OnText
+from .tokens import TokenBudget
 from google import genai
+from google.genai import types
 from dotenv import load_dotenv
 import os
 load_dotenv()
 
 class Gemini(Model):
+    provider = "gemini"
     models = {"gemini-1.5-flash", "gemini-2.0-flash", "gemini-2.5-pro", "gemini-2.5-flash"}
     def __init__(self, name: str):
         if name not in self.models:
             raise ValueError(f"Gemini: {name} is not a valid model")
         super().__init__(name)
-        self.client = genai.Client()
+        self._client = None
+
+    @property
+    def client(self) -> genai.Client:
+        if self._client is None:
+            self._client = genai.Client()
+        return self._client
+
+    def _record_usage(self, budget: TokenBudget, fix_prompt: str, response) -> None:
+        usage = response.usage_metadata
+        budget.record(self.provider, self.name, fix_prompt,
+                      usage.prompt_token_count if usage else None,
+                      usage.candidates_token_count if usage else None)
     
-    def generate_content(self, user_prompt: str, analyst_response) -> str:
-        fix_prompt = self.get_fix_prompt(user_prompt, analyst_response)
+    def generate_content(self, user_prompt: str, analyst_response, budget: TokenBudget | None = None) -> str:
+        budget = budget or TokenBudget()
+        parts = self.get_fix_prompt_parts(user_prompt, analyst_response)
+        fix_prompt = parts.as_text()
+        self._check_budget(budget, fix_prompt)
         response = self.client.models.generate_content(
             model=self.name,
-            contents=[fix_prompt]
+            contents=[part for part in parts if part],
+            config=types.GenerateContentConfig(max_output_tokens=budget.output_cap())
         )
+        self._record_usage(budget, fix_prompt, response)
         return response.text    
+
+    async def agenerate_content(self, user_prompt: str, analyst_response, budget: TokenBudget | None = None,
+                                on_text: OnText | None = None) -> str:
+        budget = budget or TokenBudget()
+        parts = self.get_fix_prompt_parts(user_prompt, analyst_response)
+        fix_prompt = parts.as_text()
+        self._check_budget(budget, fix_prompt)
+
+        async def chunks():
+            last = None
+            async for response in await self.client.aio.models.generate_content_stream(
+                model=self.name,
+                contents=[part for part in parts if part],
+                config=types.GenerateContentConfig(max_output_tokens=budget.output_cap())
+            ):
+                last = response
+                yield response.text
+            # Usage totals arrive with the last chunk.
+            if last is not None:
+                self._record_usage(budget, fix_prompt, last)
+
+        return await self._collect_stream(chunks(), on_text)
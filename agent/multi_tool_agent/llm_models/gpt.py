@@ -1,5 +1,6 @@
-from .model import Model
-from openai import OpenAI
+from .model import Model, OnText
+from .tokens import TokenBudget
+from openai import OpenAI, AsyncOpenAI
 from pydantic import BaseModel
 from typing import List
 import os
@@ -19,17 +20,65 @@ class GPTResponse(BaseModel):
     changes: List[Change]
 
 class GPT(Model):
+    provider = "gpt"
+
     def __init__(self, name: str):
         super().__init__(name)
-        self.client = OpenAI(api_key=os.getenv("API_KEY_OPENAI"))
+        self._client = None
+        self._async_client = None
+
+    @property
+    def client(self) -> OpenAI:
+        if self._client is None:
+            self._client = OpenAI(api_key=os.getenv("API_KEY_OPENAI"))
+        return self._client
+
+    @property
+    def async_client(self) -> AsyncOpenAI:
+        if self._async_client is None:
+            self._async_client = AsyncOpenAI(api_key=os.getenv("API_KEY_OPENAI"))
+        return self._async_client
     
-    def generate_content(self, user_prompt: str, analyst_response) -> str:
+    def _output_limit_kwargs(self, budget: TokenBudget) -> dict:
+        cap = budget.output_cap()
+        return {"max_completion_tokens": cap} if cap else {}
+
+    def _record_usage(self, budget: TokenBudget, fix_prompt: str, response) -> None:
+        usage = response.usage
+        budget.record(self.provider, self.name, fix_prompt,
+                      usage.prompt_tokens if usage else None,
+                      usage.completion_tokens if usage else None)
+
+    def generate_content(self, user_prompt: str, analyst_response, budget: TokenBudget | None = None) -> str:
+        budget = budget or TokenBudget()
         fix_prompt = self.get_fix_prompt(user_prompt, analyst_response)
+        self._check_budget(budget, fix_prompt)
         response = self.client.chat.completions.parse(
             model=self.name,
             messages=[{"role": "user", "content": fix_prompt}],
-            response_format=GPTResponse
+            response_format=GPTResponse,
+            **self._output_limit_kwargs(budget)
         )
+        self._record_usage(budget, fix_prompt, response)
         return response.choices[0].message.content
 
-    
\ No newline at end of file
+    async def agenerate_content(self, user_prompt: str, analyst_response, budget: TokenBudget | None = None,
+                                on_text: OnText | None = None) -> str:
+        budget = budget or TokenBudget()
+        fix_prompt = self.get_fix_prompt(user_prompt, analyst_response)
+        self._check_budget(budget, fix_prompt)
+
+        async def chunks():
+            async with self.async_client.chat.completions.stream(
+                model=self.name,
+                messages=[{"role": "user", "content": fix_prompt}],
+                response_format=GPTResponse,
+                stream_options={"include_usage": True},
+                **self._output_limit_kwargs(budget)
+            ) as stream:
+                async for event in stream:
+                    if event.type == "content.delta":
+                        yield event.delta
+                self._record_usage(budget, fix_prompt, await stream.get_final_completion())
+
+        return await self._collect_stream(chunks(), on_text)
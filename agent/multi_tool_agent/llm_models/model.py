@@ -1,50 +1,67 @@
-from parse_file_str import parse_file_str
+from prompt_context import PROMPT_CONTEXT_TOKEN_BUDGET, format_files_context
+from .tokens import TokenBudget
 from pydantic import BaseModel
-from typing import List, Tuple
+from typing import AsyncGenerator, Awaitable, Callable, List, NamedTuple, Tuple
+import asyncio
+import os
+
+# Longest wait for the next chunk of a streamed generation before giving up.
+LLM_STALL_TIMEOUT = float(os.getenv("LLM_STALL_TIMEOUT", "90"))
+
+# Called with each chunk of streamed text.
+OnText = Callable[[str], Awaitable[None]]
+
+class GenerationStalled(RuntimeError):
+    """Raised when a streamed generation produces nothing for LLM_STALL_TIMEOUT seconds."""
 
 class AgentResponse(BaseModel):
     plan: str
     file_contents: List[Tuple[str, str]]
+    # Feedback from earlier attempts in the same job (verification errors etc.)
+    notes: List[str] = []
+    # Files whose edits already verified; shown for reference, not to be changed
+    context_files: List[Tuple[str, str]] = []
+    # Interfaces of files that are being changed by parallel generations
+    related_files_summary: str = ""
 
-class Model:
-    def __init__(self, name: str):
-        self.name = name
-    
-    def get_fix_prompt(self, user_prompt: str, analyst_response: AgentResponse) -> str:
-        coder_prompt_parts = [
-            "You are an expert software engineer. Your task is to implement the following plan by modifying the provided files.",
-            f"\nUser's Original Request: {user_prompt}",
-            f"\nAnalyst's Issue or Plan: {analyst_response.plan}",
-            "\n---",
-            "**Important Style Guide:**",
-            "When implementing the changes, you must carefully analyze the existing code in the provided files.",
-            "1.  **Styling:** Your generated code *must* match the styling conventions of the existing file (e.g., Tailwind CSS, standard CSS classes, inline styles). Do not introduce a new styling methodology.",
-            "2.  **Libraries:** You may introduce new, small libraries if they are necessary to implement the requested feature. However, you must not introduce new core frameworks (e.g., do not add Vue if the project uses React).",
-            "3.  **Conventions:** Match the existing variable naming conventions and general code structure.",
-            "4.  **Syntax and Placement:** Ensure that your code is syntactically correct and placed correctly within the existing code. Pay close attention to surrounding elements, like HTML tags and JSX elements, to avoid breaking the structure. For example, ensure that elements like `</div>` are not misplaced.",
-            "\n---",
-            "Here are the parsed AST structures for each file showing all function, class, and variable declarations:",
-            "**Note:** You are receiving structured AST data (not raw file content) that includes:",
-            "- Function declarations, arrow functions, and method definitions",
-            "- Class declarations and variable declarations", 
-            "- JSX elements (for React components)",
-            "- Each declaration includes: type, name, start_line, end_line, and the actual code",
-            "- Line numbers are accurate and can be used for precise modifications"
-
-            "**IMPORTANT:**",
-            "Make sure your code changes are only related to the plan and the files provided. Do not change anything else."
-            "Do not change any imports, exports, or any other code that is not directly related to the user's request. I.E. default exports, etc"
-            "You must only return the JSON object, no other text, explanation, or markdown formatting."
-            "Double check the syntax of the code changes provided before returning the JSON object."
-            "Do not return changes that contain syntax errors check parentheses, brackets, tags, etc."
-        ]
+class PromptParts(NamedTuple):
+    """The coder prompt, ordered from most to least stable.
 
-        # Parse the files
-        for file_path, file_content in analyst_response.file_contents:
-            declarations = parse_file_str(file_content, file_path.split(".")[-1])
-            coder_prompt_parts.append(f"\nFile: `{file_path}` (AST Declarations):\n```json\n{declarations}\n```")
+    `instructions` never changes and `context` only changes with the files,
+    so together they form a prefix that providers can cache across retries
+    and jobs; only `task` differs between attempts.
+    """
+    instructions: str
+    context: str
+    task: str
 
-        coder_prompt_parts.append("""
+    def as_text(self) -> str:
+        return "\n".join(part for part in self if part)
+
+CODER_INSTRUCTIONS = "\n".join([
+    "You are an expert software engineer. Your task is to implement the plan given at the end of this prompt by modifying the provided files.",
+    "\n---",
+    "**Important Style Guide:**",
+    "When implementing the changes, you must carefully analyze the existing code in the provided files.",
+    "1.  **Styling:** Your generated code *must* match the styling conventions of the existing file (e.g., Tailwind CSS, standard CSS classes, inline styles). Do not introduce a new styling methodology.",
+    "2.  **Libraries:** You may introduce new, small libraries if they are necessary to implement the requested feature. However, you must not introduce new core frameworks (e.g., do not add Vue if the project uses React).",
+    "3.  **Conventions:** Match the existing variable naming conventions and general code structure.",
+    "4.  **Syntax and Placement:** Ensure that your code is syntactically correct and placed correctly within the existing code. Pay close attention to surrounding elements, like HTML tags and JSX elements, to avoid breaking the structure. For example, ensure that elements like `</div>` are not misplaced.",
+    "\n---",
+    "The content of each file follows these instructions.",
+    "**Note:** Each file is given once, in this format:",
+    "- An outline of its function, class, method, variable declarations and top-level JSX elements, as line ranges (`L<start>-<end> <type> <name>`)",
+    "- The source, one line per entry, prefixed with its line number (`<line>| <code>`). The prefix is not part of the code",
+    "- Lines marked `...|` were elided to keep the prompt short; do not modify elided lines",
+    "- Line numbers are accurate and can be used for precise modifications"
+
+    "**IMPORTANT:**",
+    "Make sure your code changes are only related to the plan and the files provided. Do not change anything else."
+    "Do not change any imports, exports, or any other code that is not directly related to the user's request. I.E. default exports, etc"
+    "You must only return the JSON object, no other text, explanation, or markdown formatting."
+    "Double check the syntax of the code changes provided before returning the JSON object."
+    "Do not return changes that contain syntax errors check parentheses, brackets, tags, etc.",
+"""
         ---
         Your task is to generate the specific code changes required to implement the plan. This may involve modifying existing files or creating new ones.
 
@@ -101,9 +118,78 @@ class Model:
             }
         ]
         }
-        """)
-        return "\n".join(coder_prompt_parts)
+        """,
+])
+
+class Model:
+    provider = ""
+
+    def __init__(self, name: str):
+        self.name = name
+    
+    def get_fix_prompt(self, user_prompt: str, analyst_response: AgentResponse,
+                       context_token_budget: int | None = PROMPT_CONTEXT_TOKEN_BUDGET) -> str:
+        return self.get_fix_prompt_parts(user_prompt, analyst_response, context_token_budget).as_text()
+
+    def get_fix_prompt_parts(self, user_prompt: str, analyst_response: AgentResponse,
+                             context_token_budget: int | None = PROMPT_CONTEXT_TOKEN_BUDGET) -> PromptParts:
+        # Numbered source plus declaration outline, each line included once
+        context = format_files_context(analyst_response.file_contents, context_token_budget)
+        if analyst_response.context_files:
+            context = "\n\n".join([
+                context,
+                "**Read-only files** (already changed and verified; for reference only, do not return changes for them):",
+                format_files_context(analyst_response.context_files, context_token_budget),
+            ])
+        if analyst_response.related_files_summary:
+            context = "\n\n".join([
+                context,
+                "**Other files in this change** (changed separately at the same time; keep your changes consistent with these interfaces, do not return changes for them):",
+                analyst_response.related_files_summary,
+            ])
+
+        task_parts = [
+            "\n---",
+            f"User's Original Request: {user_prompt}",
+            f"\nAnalyst's Issue or Plan: {analyst_response.plan}",
+        ]
+        if analyst_response.notes:
+            task_parts.append("\nNotes from previous attempts:")
+            task_parts.extend(f"- {note}" for note in analyst_response.notes)
+        task_parts.append("\nGenerate the code changes for this plan now, as the JSON object described above.")
+        return PromptParts(CODER_INSTRUCTIONS, context, "\n".join(task_parts))
+
+    def generate_content(self, user_prompt: str, analyst_response: AgentResponse, budget: TokenBudget | None = None) -> str:
+        """Blocking generation, kept for callers outside the event loop."""
+        raise NotImplementedError
+
+    async def agenerate_content(self, user_prompt: str, analyst_response: AgentResponse, budget: TokenBudget | None = None,
+                                on_text: OnText | None = None) -> str:
+        """Generate the code changes without blocking the event loop, streaming each chunk to `on_text`."""
+        raise NotImplementedError
+
+    async def _collect_stream(self, chunks: AsyncGenerator[str, None], on_text: OnText | None) -> str:
+        """Assemble streamed text, forwarding chunks and failing if the stream stalls."""
+        collected = []
+        try:
+            while True:
+                try:
+                    chunk = await asyncio.wait_for(chunks.__anext__(), LLM_STALL_TIMEOUT)
+                except StopAsyncIteration:
+                    break
+                except asyncio.TimeoutError:
+                    raise GenerationStalled(
+                        f"{self.provider}/{self.name} produced no output for {LLM_STALL_TIMEOUT:.0f}s"
+                    ) from None
+                if not chunk:
+                    continue
+                collected.append(chunk)
+                if on_text is not None:
+                    await on_text(chunk)
+        finally:
+            await chunks.aclose()
+        return "".join(collected)
 
-        
-    def generate_content(self,user_prompt: str) -> str:
-        pass
\ No newline at end of file
+    def _check_budget(self, budget: TokenBudget, prompt: str) -> None:
+        estimated = budget.check_input(self.provider, prompt)
+        print(f"Estimated prompt size ({self.provider}/{self.name}): ~{estimated} tokens")
@@ -0,0 +1,50 @@
+"""
+Process-wide registry of coder models.
+
+Model instances own their SDK clients (and so their HTTP connection pools),
+so jobs that use the same provider, model and credentials share one instance
+instead of building and warming a new client per job. Models hold no per-job
+state; the job's budget and progress are passed on each call.
+"""
+import os
+from threading import Lock
+from cache import token_fingerprint
+from .model import Model
+from .gpt import GPT
+from .gemini import Gemini
+from .claude import Claude
+
+MODEL_CLASSES = {"gpt": GPT, "gemini": Gemini, "claude": Claude}
+# Environment variables holding each provider's credentials; a change of key
+# yields a new instance rather than reusing a client built with the old one.
+CREDENTIAL_ENV = {
+    "gpt": ("API_KEY_OPENAI",),
+    "gemini": ("GOOGLE_API_KEY", "GEMINI_API_KEY"),
+    "claude": ("API_KEY_ANTHROPIC",),
+}
+
+_models: dict[tuple, Model] = {}
+_lock = Lock()
+
+
+def get_model(model_type: str | None, model_name: str | None) -> Model:
+    """Return the shared model instance for this provider, model and current credentials."""
+    model_class = MODEL_CLASSES.get(model_type)
+    if model_class is None:
+        raise ValueError(f"Invalid LLM model type: {model_type}")
+    key = (model_type, model_name, _credentials_fingerprint(model_type))
+    with _lock:
+        model = _models.get(key)
+        if model is None:
+            model = _models[key] = model_class(model_name)
+        return model
+
+
+def clear() -> None:
+    with _lock:
+        _models.clear()
+
+
+def _credentials_fingerprint(model_type: str) -> str:
+    values = "\0".join(os.getenv(name, "") for name in CREDENTIAL_ENV.get(model_type, ()))
+    return token_fingerprint(values)
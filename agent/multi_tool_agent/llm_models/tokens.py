@@ -0,0 +1,130 @@
+"""
+Token estimation and per-job budget accounting shared by the LLM providers.
+
+Prompt sizes are estimated locally from a characters-per-token ratio per
+provider instead of asking the provider to count them. The ratios start from
+typical values for source code and are calibrated from the usage each
+provider reports on its responses.
+"""
+import os
+from threading import Lock
+from metrics import LLM_TOKENS
+
+# Starting characters-per-token ratios, refined from reported usage.
+DEFAULT_CHARS_PER_TOKEN = {"claude": 3.5, "gpt": 4.0, "gemini": 4.0}
+FALLBACK_CHARS_PER_TOKEN = 4.0
+# Weight of each new observation in the calibrated ratio.
+CALIBRATION_WEIGHT = 0.2
+
+JOB_MAX_INPUT_TOKENS = int(os.getenv("JOB_MAX_INPUT_TOKENS", "400000"))
+JOB_MAX_OUTPUT_TOKENS = int(os.getenv("JOB_MAX_OUTPUT_TOKENS", "64000"))
+
+
+class TokenBudgetExceeded(RuntimeError):
+    """Raised when a generation would exceed the job's token budget."""
+
+
+class TokenEstimator:
+    def __init__(self):
+        self._chars_per_token = dict(DEFAULT_CHARS_PER_TOKEN)
+        self._lock = Lock()
+
+    def estimate(self, text: str, provider: str | None = None) -> int:
+        ratio = self._chars_per_token.get(provider, FALLBACK_CHARS_PER_TOKEN)
+        return int(len(text) / ratio) + 1
+
+    def calibrate(self, provider: str, chars: int, actual_tokens: int) -> None:
+        if not chars or not actual_tokens:
+            return
+        observed = chars / actual_tokens
+        with self._lock:
+            current = self._chars_per_token.get(provider, FALLBACK_CHARS_PER_TOKEN)
+            self._chars_per_token[provider] = current + CALIBRATION_WEIGHT * (observed - current)
+
+
+estimator = TokenEstimator()
+
+
+def estimate_tokens(text: str, provider: str | None = None) -> int:
+    return estimator.estimate(text, provider)
+
+
+class TokenBudget:
+    """Input/output token allowance for one job, plus the usage recorded against it.
+
+    Usage is only known once a call returns, so calls made at the same time
+    each take a share of the budget (`split`) instead of checking it directly.
+    """
+
+    def __init__(self, max_input_tokens: int = JOB_MAX_INPUT_TOKENS, max_output_tokens: int = JOB_MAX_OUTPUT_TOKENS,
+                 parent: "TokenBudget | None" = None):
+        self.max_input_tokens = max_input_tokens
+        self.max_output_tokens = max_output_tokens
+        self.input_tokens = 0
+        self.output_tokens = 0
+        self.calls = []
+        # The budget this is a share of; usage is recorded against both.
+        self.parent = parent
+
+    @property
+    def remaining_output_tokens(self) -> int:
+        return self.max_output_tokens - self.output_tokens
+
+    def check_input(self, provider: str, prompt: str) -> int:
+        """Estimate the prompt and fail before the call if it cannot fit the budget."""
+        estimated = estimate_tokens(prompt, provider)
+        if self.input_tokens + estimated > self.max_input_tokens:
+            raise TokenBudgetExceeded(
+                f"Prompt of ~{estimated} tokens exceeds the job's remaining input budget "
+                f"({self.max_input_tokens - self.input_tokens} of {self.max_input_tokens})."
+            )
+        if self.remaining_output_tokens <= 0:
+            raise TokenBudgetExceeded(f"The job's output budget of {self.max_output_tokens} tokens is used up.")
+        return estimated
+
+    def split(self, weights: list[float]) -> list["TokenBudget"]:
+        """Shares of the remaining allowance for concurrent calls, in proportion to `weights`.
+
+        Together the shares never exceed what is left, whatever each call uses.
+        """
+        total = sum(weights)
+        remaining_input = max(0, self.max_input_tokens - self.input_tokens)
+        remaining_output = max(0, self.remaining_output_tokens)
+        return [
+            TokenBudget(int(remaining_input * weight / total) if total else remaining_input // len(weights),
+                        int(remaining_output * weight / total) if total else remaining_output // len(weights),
+                        parent=self)
+            for weight in weights
+        ]
+
+    def output_limit(self, default: int) -> int:
+        return max(1, min(default, self.remaining_output_tokens))
+
+    def output_cap(self, safe_limit: int = 8192) -> int | None:
+        """Output cap to send to providers without a required max_tokens.
+
+        None while the remaining budget is above `safe_limit`, so that no cap
+        larger than a model's own maximum (which providers reject) is sent.
+        A share of a split budget is always capped, so an uncapped call cannot
+        run past it.
+        """
+        remaining = self.remaining_output_tokens
+        if self.parent is not None:
+            return max(1, min(remaining, safe_limit))
+        return max(1, remaining) if remaining < safe_limit else None
+
+    def record(self, provider: str, model: str, prompt: str, input_tokens: int | None, output_tokens: int | None) -> None:
+        """Record actual usage reported by the provider and refine the estimator with it."""
+        input_tokens = input_tokens or 0
+        output_tokens = output_tokens or 0
+        self.input_tokens += input_tokens
+        self.output_tokens += output_tokens
+        if self.parent is not None:
+            self.parent.record(provider, model, prompt, input_tokens, output_tokens)
+            return
+        self.calls.append({"provider": provider, "model": model, "input_tokens": input_tokens, "output_tokens": output_tokens})
+        estimator.calibrate(provider, len(prompt), input_tokens)
+        LLM_TOKENS.labels(provider=provider, model=model, direction="input").inc(input_tokens)
+        LLM_TOKENS.labels(provider=provider, model=model, direction="output").inc(output_tokens)
+        print(f"Token usage ({provider}/{model}): {input_tokens} in, {output_tokens} out; "
+              f"job total {self.input_tokens}/{self.max_input_tokens} in, {self.output_tokens}/{self.max_output_tokens} out")
@@ -5,27 +5,39 @@ from dotenv import load_dotenv
 from pydantic import BaseModel
 from google.adk.agents import Agent, SequentialAgent
 from google.adk.runners import Runner
-from google.adk.sessions import InMemorySessionService, Session
+from google.adk.sessions import Session
 from google.genai import types
 from prompt import agent_instructions
 from tools.get_repo_tree import get_repo_tree
 from tools.get_file_content import get_file_content
 from models import Repo, TreeNode
-from tools.apply_code_changes import apply_code_changes
+from tools.apply_code_changes import aapply_code_changes_with_edits
 from fix import get_code_changes
-from tools.verify_changes import verify_changes
+from tools.verify_changes import averify_files
 from tools.submit_pull_request import submit_pull_request
-from llm_models.gpt import GPT
-from llm_models.gemini import Gemini
-from llm_models.claude import Claude
-from socket_client import sio
+from llm_models.registry import get_model
+from llm_models.model import GenerationStalled
+from llm_models.tokens import TokenBudget, TokenBudgetExceeded
+from progress import GenerationProgress
+from metrics import IMPLEMENT_ATTEMPTS
+from socket_client import emit
+from session_service import RedisSessionService
 import json
+import asyncio
+import os
+from contextvars import ContextVar
 
 load_dotenv()
 
 LANG = {"js": "javascript", "jsx": "javascript", "ts": "typescript", "tsx": "tsx"}
 
-session_service = InMemorySessionService()
+FILE_FETCH_CONCURRENCY = int(os.getenv("FILE_FETCH_CONCURRENCY", "8"))
+
+# Sessions of finished jobs are deleted unless kept for resuming; either way
+# they expire after SESSION_TTL.
+SESSION_RETAIN_AFTER_JOB = os.getenv("SESSION_RETAIN_AFTER_JOB", "false").lower() == "true"
+
+session_service = RedisSessionService()
 
 class AgentResponse(BaseModel):
     plan: str
@@ -38,85 +50,220 @@ class ImplementChangesTool:
         self._access_token = access_token
         self._user_prompt = user_prompt
         self._socket_id = socket_id
+        self._token_budget = TokenBudget()
+        self._progress = GenerationProgress(socket_id)
 
-    @property
-    def __name__(self):
-        return "implement_changes"
-
-    def __call__(self, plan: str, file_paths: List[str]) -> str:
+    async def implement_changes(self, plan: str, file_paths: List[str]) -> str:
+        """Implements the plan in the given files, verifies the result and submits a pull request."""
         print(f"Model: {self._model}")
-        file_contents = []
-        for path in file_paths:
-            try:
-                content = get_file_content(
+        await self._progress.set_stage("reading_files")
+        semaphore = asyncio.Semaphore(FILE_FETCH_CONCURRENCY)
+
+        async def fetch(path: str) -> str:
+            async with semaphore:
+                return await get_file_content(
                     owner=self._repo.owner.login,
                     repo_name=self._repo.name,
                     path=path,
                     access_token=self._access_token
                 )
-                file_contents.append((path, content))
-            except Exception as e:
-                return f"Error reading file {path}: {e}"
 
+        # Fetch concurrently but report the first failure in request order,
+        # as the sequential loop did.
+        results = await asyncio.gather(*(fetch(path) for path in file_paths), return_exceptions=True)
+        file_contents = []
+        for path, content in zip(file_paths, results):
+            if isinstance(content, Exception):
+                return f"Error reading file {path}: {content}"
+            file_contents.append((path, content))
+
+        # Per-file state: files still to get right (with the content the next
+        # attempt starts from), files whose edits verified, and how many
+        # attempts each file has taken. Retries only regenerate `pending`.
+        pending = dict(file_contents)
+        verified = {}
+        file_attempts = {}
+        # Files whose last change was rejected or failed verification. They
+        # only count as verified again once a change for them is applied.
+        needs_change = set()
+        pr_description = None
+        # Feedback from failed attempts goes after the file context, so the
+        # plan and files stay a stable (cacheable) prompt prefix across retries.
+        notes = []
         for attempt in range(3):
-            raw_analyst_output = json.dumps({"plan": plan, "file_contents": file_contents})
-            print(f"Implementation attempt {attempt + 1}...\n {raw_analyst_output}")
+            raw_analyst_output = json.dumps({
+                "plan": plan,
+                "file_contents": list(pending.items()),
+                "notes": notes,
+                "context_files": list(verified.items()),
+            })
+            print(f"Implementation attempt {attempt + 1} for {len(pending)} file(s)...\n {raw_analyst_output}")
+            await self._progress.set_stage("generating")
             
-            code_changes_json, _ = get_code_changes(
-                user_prompt=self._user_prompt,
-                raw_analyst_output=raw_analyst_output,
-                llm_model=self._model,
-            )
+            try:
+                code_changes_json, _ = await get_code_changes(
+                    user_prompt=self._user_prompt,
+                    raw_analyst_output=raw_analyst_output,
+                    llm_model=self._model,
+                    budget=self._token_budget,
+                    progress=self._progress,
+                )
+            except TokenBudgetExceeded as e:
+                print(f"Stopping: {e}")
+                self._count_attempt("budget_exceeded")
+                return f"Failed to implement the changes: {e}"
+            except GenerationStalled as e:
+                print(f"Generation stalled: {e}")
+                self._count_attempt("stalled")
+                continue
             print(f"Code changes: {code_changes_json}")
 
             if not code_changes_json:
-                plan = f"{plan}\n\nThe last attempt failed to generate any code changes. Please try again."
+                notes.append("The last attempt failed to generate any code changes. Please try again.")
+                self._count_attempt("empty")
                 continue
 
-            pr_description, new_file_contents = apply_code_changes(
+            # Changes to files outside `pending` are dropped by apply_code_changes.
+            description, new_file_contents, file_edits = await aapply_code_changes_with_edits(
                 code_changes_json=code_changes_json,
-                original_file_contents=file_contents
+                original_file_contents=list(pending.items())
             )
+            # The first attempt covers the whole plan; retries only fix files.
+            pr_description = pr_description or description
 
             print(f"Verifying")
-            verification_passed = True
+            await self._progress.set_stage("verifying")
             error_messages = []
+            base_contents = pending
+            pending = {}
+            to_verify = []
             for file_path, file_content in new_file_contents:
-                is_valid, error_message = verify_changes(file_content, LANG[file_path.split(".")[-1]])
-                if not is_valid:
-                    verification_passed = False
+                if file_path in verified and file_path not in base_contents:
+                    # A new-file change replacing a verified file: it is verified
+                    # again like any other change rather than overwriting it.
+                    verified.pop(file_path)
+                file_attempts[file_path] = file_attempts.get(file_path, 0) + 1
+                edits = file_edits.get(file_path)
+                if edits and edits.rejected:
+                    # Regenerate from the content the model's line numbers referred to.
+                    pending[file_path] = base_contents.get(file_path, file_content)
+                    needs_change.add(file_path)
+                    print(f"Changes rejected for {file_path}: {edits.rejected}")
+                    error_messages.append(f"Some changes for {file_path} were not applied: " + "; ".join(edits.rejected) + ".")
+                    continue
+                if file_path in needs_change and edits is None:
+                    pending[file_path] = file_content
+                    print(f"No changes returned for {file_path}, which still needs them.")
+                    error_messages.append(f"No changes were returned for {file_path}; it still needs the changes from the plan.")
+                    continue
+                lang_name = LANG.get(file_path.split(".")[-1].lower())
+                if lang_name is None:
+                    # No parser for this file type (CSS, JSON, ...); it is accepted unverified.
+                    print(f"Not verifying {file_path}: unsupported file type.")
+                    verified[file_path] = file_content
+                    needs_change.discard(file_path)
+                    continue
+                to_verify.append((file_path, file_content, lang_name, edits))
+            # Verified together, so large change sets are parsed in the CPU pool in parallel.
+            results = await averify_files([
+                (file_content, lang_name, base_contents.get(file_path), edits.edits if edits else None)
+                for file_path, file_content, lang_name, edits in to_verify
+            ])
+            for (file_path, file_content, _, _), (is_valid, error_message) in zip(to_verify, results):
+                if is_valid:
+                    verified[file_path] = file_content
+                    needs_change.discard(file_path)
+                else:
+                    # Retry from the edited content, as the error refers to it.
+                    pending[file_path] = file_content
+                    needs_change.add(file_path)
                     print(f"Verification failed for {file_path} with error: {error_message}.")
                     error_messages.append(f"Verification failed for {file_path} with error: {error_message}.")
             
-            if verification_passed:
-                print("Verification successful. Submitting pull request.")
-                pr_url = submit_pull_request(
+            self._count_attempt("failed_verification" if pending else "verified")
+            if not pending:
+                print(f"Verification successful (attempts per file: {file_attempts}). Submitting pull request.")
+                await self._progress.set_stage("submitting")
+                # Original files first, in request order, then any new files.
+                merged = [(path, verified[path]) for path in file_paths if path in verified]
+                merged.extend((path, content) for path, content in verified.items() if path not in file_paths)
+                pr_url = await submit_pull_request(
                     repo=self._repo,
                     access_token=self._access_token,
-                    new_file_contents=new_file_contents,
+                    new_file_contents=merged,
                     pr_description=pr_description
                 )
                 return pr_url
             else:
-                plan = f"{plan}\n\nVerification failed with the following errors:\n" + "\n".join(error_messages) + "\nPlease fix them."
-                file_contents = new_file_contents
+                notes.append("Verification failed with the following errors:\n" + "\n".join(error_messages) + "\nPlease fix them.")
 
         return "Failed to implement and verify the changes after 3 attempts."
 
+    def _count_attempt(self, result: str) -> None:
+        IMPLEMENT_ATTEMPTS.labels(provider=self._model.provider, model=self._model.name, result=result).inc()
+
+# The job an `implement_changes` call belongs to. Set per job in
+# run_agent_with_prompt; asyncio tasks inherit it, so concurrent jobs sharing
+# the agent below each see their own.
+_current_job: ContextVar[ImplementChangesTool] = ContextVar("current_job")
+
+async def implement_changes(plan: str, file_paths: List[str]) -> str:
+    """Implements the plan in the given files, verifies the result and submits a pull request."""
+    return await _current_job.get().implement_changes(plan, file_paths)
+
+AGENT_INSTRUCTION = """You are an expert software engineer. Your goal is to translate a user's request into a concrete plan, execute it, and submit a pull request.
+
+Your workflow is as follows:
+1.  **Analyze the Request:** Carefully read the user's prompt to understand their specific goal.
+2.  **Explore the Codebase:** Use the `get_repo_tree` and `get_file_content` tools to find and read only the files that are directly relevant to implementing the user's request. Verify that the file paths exist inside the repo tree before calling `get_file_content`.
+3.  **Formulate the Plan:** Create a concise plan that is a direct translation of the user's request into engineering steps and identify the full paths of the files to be modified.
+4.  **Execute the Plan:** Call the `implement_changes` tool. This tool will handle the rest of the process, including retries.
+
+**Important:**
+- When calling `get_file_content`, you must always make sure that the file path being passed in is a valid file path in the repo tree.
+- When formulating the plan, do not change any imports, exports, or any other code that is not directly related to the user's request.
+
+**When calling `implement_changes`, you must provide arguments matching this schema:**
+- `plan` (string): Your concise, high-level plan.
+- `file_paths` (list of strings): The full paths to the files that need to be modified.
+
+Your final output must be the pull request URL returned by the `implement_changes` tool.
+"""
+
+APP_NAME = 'multi_tool_agent'
+
+# Built once per process and shared by every job; the per-job state lives in
+# _current_job and the session.
+root_agent = Agent(
+    name="Software_Engineer_Agent",
+    model="gemini-2.5-pro",
+    description=(
+        "An agent that can analyze a repository, plan and execute code changes, and submit a pull request."
+    ),
+    instruction=AGENT_INSTRUCTION,
+    tools=[get_repo_tree, get_file_content, implement_changes],
+)
+
+runner = Runner(
+    agent=root_agent,
+    session_service=session_service,
+    app_name=APP_NAME,
+)
+
 async def send_message_to_socket(socket_id: str, function_name: str, message: str = None):
     if not socket_id:
         return
         
     if function_name == 'get_repo_tree':
-        await sio.emit('agent_response', {
+        await emit('agent_response', {
             'message': message or 'Analyzing repository file structure...'
         }, room=socket_id)
     elif function_name == 'get_file_content':
-        await sio.emit('agent_response', {
+        await emit('agent_response', {
             'message': message or 'Reading file contents...'
         }, room=socket_id)
     elif function_name == 'implement_changes':
-        await sio.emit('agent_response', {
+        await emit('agent_response', {
             'message': message or 'Generating code changes...'
         }, room=socket_id)
     else:
@@ -135,53 +282,22 @@ async def run_agent_with_prompt(
     Runs the simple ADK agent with a given user prompt and manages the session.
     """
 
-    model = None
-    if llm_model_type == "gpt":
-        model = GPT(llm_model_name)
-    elif llm_model_type == "gemini":
-        model = Gemini(llm_model_name)
-    elif llm_model_type == "claude":
-        model = Claude(llm_model_name)
-    else:
-        raise ValueError(f"Invalid LLM model type: {llm_model_type}")
-
-    implement_changes_tool = ImplementChangesTool(
+    model = get_model(llm_model_type, llm_model_name)
+    job_token = _current_job.set(ImplementChangesTool(
         model=model,
         repo=repo,
         access_token=access_token,
         user_prompt=user_prompt,
         socket_id=socket_id
-    )
-    
-    root_agent = Agent(
-        name="Software_Engineer_Agent",
-        model="gemini-2.5-pro",
-        description=(
-            "An agent that can analyze a repository, plan and execute code changes, and submit a pull request."
-        ),
-        instruction="""You are an expert software engineer. Your goal is to translate a user's request into a concrete plan, execute it, and submit a pull request.
-
-Your workflow is as follows:
-1.  **Analyze the Request:** Carefully read the user's prompt to understand their specific goal.
-2.  **Explore the Codebase:** Use the `get_repo_tree` and `get_file_content` tools to find and read only the files that are directly relevant to implementing the user's request. Verify that the file paths exist inside the repo tree before calling `get_file_content`.
-3.  **Formulate the Plan:** Create a concise plan that is a direct translation of the user's request into engineering steps and identify the full paths of the files to be modified.
-4.  **Execute the Plan:** Call the `implement_changes` tool. This tool will handle the rest of the process, including retries.
-
-**Important:**
-- When calling `get_file_content`, you must always make sure that the file path being passed in is a valid file path in the repo tree.
-- When formulating the plan, do not change any imports, exports, or any other code that is not directly related to the user's request.
-
-**When calling `implement_changes`, you must provide arguments matching this schema:**
-- `plan` (string): Your concise, high-level plan.
-- `file_paths` (list of strings): The full paths to the files that need to be modified.
-
-Your final output must be the pull request URL returned by the `implement_changes` tool.
-""",
-        tools=[get_repo_tree, get_file_content, implement_changes_tool],
-    )
+    ))
+    try:
+        return await _run_in_session(user_prompt, repo, access_token, socket_id, session_id)
+    finally:
+        _current_job.reset(job_token)
 
+async def _run_in_session(user_prompt: str, repo: Repo, access_token: str, socket_id: str, session_id: str | None):
     current_user_id = "test-user-001" 
-    app_name = 'multi_tool_agent'
+    app_name = APP_NAME
 
     if session_id is None:
         new_session_id = str(uuid.uuid4())
@@ -189,23 +305,24 @@ Your final output must be the pull request URL returned by the `implement_change
         current_session_id = new_session_id
         print(f"Created new session: {current_session_id}")
     else:
-        try:
-            # Attempt to retrieve an existing session
-            session = await session_service.get_session(user_id=current_user_id, session_id=session_id, app_name=app_name)
-            current_session_id = session_id
+        # Attempt to retrieve an existing session
+        session = await session_service.get_session(user_id=current_user_id, session_id=session_id, app_name=app_name)
+        current_session_id = session_id
+        if session is not None:
             print(f"Resuming session: {current_session_id}")
-        except Exception:
-            # If the session_id doesn't exist (e.g., first run with a specified ID, or old session), create a new one.
+        else:
+            # If the session_id doesn't exist (e.g., first run with a specified ID, or expired session), create a new one.
             session = await session_service.create_session(user_id=current_user_id, session_id=session_id, app_name=app_name)
-            current_session_id = session_id
             print(f"Session {session_id} not found, creating new one with this ID.")
 
-    runner = Runner(
-        agent=root_agent,
-        session_service=session_service,
-        app_name=app_name,
-    )
+    try:
+        return await _stream_agent_events(app_name, current_user_id, current_session_id, user_prompt, repo, access_token, socket_id)
+    finally:
+        if not SESSION_RETAIN_AFTER_JOB:
+            await session_service.delete_session(app_name=app_name, user_id=current_user_id, session_id=current_session_id)
 
+async def _stream_agent_events(app_name: str, current_user_id: str, current_session_id: str,
+                       user_prompt: str, repo: Repo, access_token: str, socket_id: str):
     agent_responses = []
     pr_url = None
 
@@ -0,0 +1,97 @@
+"""
+Prometheus metrics for the agent pipeline, exposed on /metrics by agent.py.
+
+Stage timings share one histogram labelled by stage; LLM calls and token
+counts are labelled by provider and model.
+"""
+import functools
+import inspect
+import time
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
+
+# Jobs and LLM calls run for minutes; the default buckets stop at 10s.
+LATENCY_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300, 600, 1200)
+
+QUEUE_WAIT_SECONDS = Histogram(
+    "agent_queue_wait_seconds", "Time a job spent queued before a worker took it.",
+    ["lane"], buckets=LATENCY_BUCKETS,
+)
+JOB_SECONDS = Histogram(
+    "agent_job_seconds", "End-to-end time of a job in the worker.",
+    ["provider", "model", "outcome"], buckets=LATENCY_BUCKETS,
+)
+STAGE_SECONDS = Histogram(
+    "agent_stage_seconds", "Time spent in one pipeline stage.",
+    ["stage"], buckets=LATENCY_BUCKETS,
+)
+LLM_REQUEST_SECONDS = Histogram(
+    "agent_llm_request_seconds", "Latency of one code generation call.",
+    ["provider", "model"], buckets=LATENCY_BUCKETS,
+)
+LLM_TOKENS = Counter(
+    "agent_llm_tokens_total", "Tokens reported by the providers.",
+    ["provider", "model", "direction"],
+)
+LLM_ERRORS = Counter(
+    "agent_llm_errors_total", "Code generation calls that raised.",
+    ["provider", "model", "error"],
+)
+IMPLEMENT_ATTEMPTS = Counter(
+    "agent_implement_attempts_total", "Code generation attempts of the implement loop (first tries and retries).",
+    ["provider", "model", "result"],
+)
+QUEUE_DEPTH = Gauge("agent_queue_depth", "Jobs waiting in each queue lane, sampled on scrape.", ["lane"])
+QUEUE_ADMISSIONS = Counter(
+    "agent_queue_admissions_total", "Requests to /agent by lane and admission result.",
+    ["lane", "status"],
+)
+JOBS_IN_FLIGHT = Gauge("agent_jobs_in_flight", "Jobs being processed by this process.")
+CPU_TASKS = Counter(
+    "agent_cpu_tasks_total", "CPU-bound tasks by where they ran (inline on the event loop or in the process pool).",
+    ["stage", "executor"],
+)
+QUEUE_DEDUPLICATIONS = Counter(
+    "agent_queue_deduplications_total", "Requests to /agent with a job key, by how they were served (cached, attached or claimed).",
+    ["result"],
+)
+PROCESS_IMPORT_SECONDS = Gauge("agent_process_import_seconds", "Time the entry point took to import its modules.", ["process"])
+
+
+def timed(stage: str):
+    """Decorator recording the wrapped (sync or async) function's duration under `stage`."""
+    histogram = STAGE_SECONDS.labels(stage=stage)
+
+    def decorator(func):
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return await func(*args, **kwargs)
+                finally:
+                    histogram.observe(time.perf_counter() - start)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                histogram.observe(time.perf_counter() - start)
+        return wrapper
+
+    return decorator
+
+
+def report_import_time(process: str, started: float) -> float:
+    """Record and print the time since `started` (a perf_counter value taken before the imports)."""
+    elapsed = time.perf_counter() - started
+    PROCESS_IMPORT_SECONDS.labels(process=process).set(elapsed)
+    print(f"{process} imports took {elapsed * 1000:.0f} ms")
+    return elapsed
+
+
+def render_metrics() -> tuple[bytes, str]:
+    """The exposition body and its content type."""
+    return generate_latest(), CONTENT_TYPE_LATEST
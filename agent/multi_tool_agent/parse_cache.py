@@ -0,0 +1,123 @@
+"""
+Cache of tree-sitter parse trees keyed by (language, content hash).
+
+The same file content is parsed for the prompt (parse_file_str), again for
+verification after an edit, and again on every retry attempt. Going through
+`parse_cache.parse` makes each distinct content parse at most once while it
+stays in the cache.
+
+When the source an edited file was derived from is passed as `base` and its
+tree is still cached, the new content is parsed incrementally: the cached
+tree is copied, told about the changed byte ranges with `Tree.edit`, and
+handed to the parser as the old tree, so only the edited regions are
+re-parsed. The ranges are the edit map from apply_code_changes when given,
+otherwise the single range covering every difference.
+"""
+import hashlib
+import os
+from typing import Sequence
+from tree_sitter import Tree
+from cache import LRUCache
+from parsers import get_parser
+
+# Bounded by the size of the parsed sources; tree memory scales with it.
+PARSE_CACHE_MAX_SOURCE_BYTES = int(os.getenv("PARSE_CACHE_MAX_SOURCE_BYTES", str(32 * 1024 * 1024)))
+
+class ParseCache:
+    def __init__(self, max_source_bytes: int = PARSE_CACHE_MAX_SOURCE_BYTES):
+        # (language, digest) -> (tree, source size in bytes)
+        self._trees = LRUCache(max_bytes=max_source_bytes, sizeof=lambda entry: entry[1])
+
+    def parse(self, code: str, lang_name: str, base: str | None = None, edits: Sequence | None = None) -> Tree:
+        """Return the parse tree of `code`, reusing a cached or incremental parse when possible.
+
+        Trees are not thread-safe, so callers get their own (cheap) copy of
+        the cached tree where py-tree-sitter has `Tree.copy`. Without it they
+        get the shared tree and must only read it.
+        """
+        code_bytes = code.encode("utf8")
+        key = _cache_key(lang_name, code_bytes)
+        cached = self._trees.get(key)
+        if cached is not None:
+            return _reader_copy(cached[0])
+
+        old_tree = self._edited_base_tree(lang_name, base.encode("utf8"), code_bytes, edits) if base is not None else None
+        parser = get_parser(lang_name)
+        tree = parser.parse(code_bytes, old_tree) if old_tree is not None else parser.parse(code_bytes)
+        self._trees.set(key, (tree, len(code_bytes)))
+        return _reader_copy(tree)
+
+    def clear(self) -> None:
+        self._trees.clear()
+
+    def _edited_base_tree(self, lang_name: str, base_bytes: bytes, code_bytes: bytes, edits: Sequence | None) -> Tree | None:
+        cached = self._trees.get(_cache_key(lang_name, base_bytes))
+        if cached is None:
+            return None
+        # Cached trees are shared, so edit a copy.
+        tree = _private_copy(cached[0], lang_name, base_bytes)
+        if edits is not None:
+            # TextEdit tuples, bottom-up, so each applies to the result of the previous.
+            for edit in edits:
+                tree.edit(**edit._asdict())
+            return tree
+        start, old_end, new_end = _changed_range(base_bytes, code_bytes)
+        tree.edit(
+            start_byte=start,
+            old_end_byte=old_end,
+            new_end_byte=new_end,
+            start_point=_point_at(base_bytes, start),
+            old_end_point=_point_at(base_bytes, old_end),
+            new_end_point=_point_at(code_bytes, new_end),
+        )
+        return tree
+
+def _reader_copy(tree: Tree) -> Tree:
+    return tree.copy() if hasattr(tree, "copy") else tree
+
+def _private_copy(tree: Tree, lang_name: str, source_bytes: bytes) -> Tree:
+    """A copy of `tree` that can be edited without affecting the original.
+
+    py-tree-sitter 0.23 (the version tree-sitter-language-pack 0.9 pins) has
+    no `Tree.copy`; there the copy is an incremental parse of the unchanged
+    source, which reuses every node of the old tree.
+    """
+    if hasattr(tree, "copy"):
+        return _reader_copy(tree)
+    return get_parser(lang_name).parse(source_bytes, tree)
+
+def _cache_key(lang_name: str, code_bytes: bytes) -> tuple:
+    return (lang_name, hashlib.blake2b(code_bytes, digest_size=16).digest())
+
+def _changed_range(old: bytes, new: bytes) -> tuple[int, int, int]:
+    """Smallest single byte range covering every difference between `old` and `new`.
+
+    Returns (start, old_end, new_end). Prefix and suffix lengths are found by
+    binary search over slice comparisons, which run in C.
+    """
+    limit = min(len(old), len(new))
+    lo, hi = 0, limit
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if old[:mid] == new[:mid]:
+            lo = mid
+        else:
+            hi = mid - 1
+    prefix = lo
+
+    lo, hi = 0, limit - prefix
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if old[len(old) - mid:] == new[len(new) - mid:]:
+            lo = mid
+        else:
+            hi = mid - 1
+    suffix = lo
+    return prefix, len(old) - suffix, len(new) - suffix
+
+def _point_at(code_bytes: bytes, offset: int) -> tuple[int, int]:
+    row = code_bytes.count(b"\n", 0, offset)
+    column = offset - (code_bytes.rfind(b"\n", 0, offset) + 1)
+    return (row, column)
+
+parse_cache = ParseCache()
@@ -1,99 +1,90 @@
-from tree_sitter_language_pack import get_parser
-# These return fully initialized Parser instances
-JS_PARSER = get_parser("javascript")
-TS_PARSER = get_parser("typescript")
-TSX_PARSER = get_parser("tsx")
+from parse_cache import parse_cache
 
-EXT_PARSER_MAP = {
-    "js": JS_PARSER,
-    "jsx": JS_PARSER,
-    "ts": TS_PARSER,
-    "tsx": TSX_PARSER,
+EXT_LANGUAGE_MAP = {
+    "js": "javascript",
+    "jsx": "javascript",
+    "ts": "typescript",
+    "tsx": "tsx",
 }
 
-def parse_file_str(code_str: str, file_extension: str):
-    print(f"Parsing file with extension: {file_extension}")
+def _jsx_element_name(node) -> str:
+    opening = node.child_by_field_name("opening_element")
+    if opening and opening.named_child_count:
+        tag_node = opening.named_children[0]
+        if tag_node:
+            return tag_node.text.decode()
+    return ""
+
+def _no_name(node) -> str:
+    return ""
+
+def _name_field(node) -> str:
+    id_node = node.child_by_field_name("name")
+    return id_node.text.decode() if id_node else ""
+
+def _declarator_name(node) -> str:
+    declarator = node.child_by_field_name("declarator")
+    if declarator is None and node.named_children:
+        declarator = node.named_children[0]
+    if not declarator:
+        return ""
+    name_node = declarator.child_by_field_name("name")
+    return name_node.text.decode() if name_node else declarator.text.decode()
+
+def _arrow_function_name(node) -> str:
+    parent = node.parent
+    if parent and parent.type == "variable_declarator":
+        return _name_field(parent)
+    return ""
+
+# Declaration node types we report, mapped to how their name is extracted.
+DECLARATION_NAME_EXTRACTORS = {
+    "jsx_element": _jsx_element_name,
+    "jsx_self_closing_element": _no_name,
+    "function_declaration": _name_field,
+    "arrow_function": _arrow_function_name,
+    "method_definition": _name_field,
+    "class_declaration": _name_field,
+    "variable_declaration": _declarator_name,
+    "lexical_declaration": _declarator_name,
+}
+
+def parse_file_str(code_str: str, file_extension: str, include_code: bool = True):
     """
     Parse code from a string and extract all function, class, and variable declarations recursively.
     Returns a list of declarations with their metadata.
+    With include_code=False the "code" field is left out, for callers that only need the outline.
     """
-    parser = EXT_PARSER_MAP.get(file_extension.lower())
-    if not parser:
+    print(f"Parsing file with extension: {file_extension}")
+    lang_name = EXT_LANGUAGE_MAP.get(file_extension.lower())
+    if not lang_name:
         raise ValueError(f"Unsupported file extension: {file_extension}")
 
     code_bytes = code_str.encode("utf8")
-    tree = parser.parse(code_bytes)
-
-    # Map byte offsets to line numbers
-    line_offsets = [0]
-    for i, c in enumerate(code_bytes):
-        if c == ord(b'\n'):
-            line_offsets.append(i + 1)
-
-    def byte_to_line(byte_offset):
-        for idx, offset in enumerate(line_offsets):
-            if offset > byte_offset:
-                return idx
-        return len(line_offsets)
+    tree = parse_cache.parse(code_str, lang_name)
 
     declarations = []
 
-    def walk(node):
-        if node.type in (
-            "jsx_element",
-            "jsx_self_closing_element",
-            "function_declaration",
-            "arrow_function",
-            "method_definition",
-            "class_declaration",
-            "variable_declaration",
-            "lexical_declaration"
-        ):
-            name = ""
-            if node.type in ("jsx_element", "jsx_self_closing_element"):
-                if node.type == "jsx_element":
-                    opening = node.child_by_field_name("opening_element")
-                    if opening and opening.named_child_count:
-                        tag_node = opening.named_children[0]
-                        if tag_node:
-                            name = tag_node.text.decode()
-            if node.type in ("function_declaration", "class_declaration"):
-                id_node = node.child_by_field_name("name")
-                if id_node:
-                    name = id_node.text.decode()
-            elif node.type in ("variable_declaration", "lexical_declaration"):
-                declarator = node.child_by_field_name("declarator")
-                if declarator is None and node.named_children:
-                    declarator = node.named_children[0]
-                if declarator:
-                    name_node = declarator.child_by_field_name("name")
-                    if name_node:
-                        name = name_node.text.decode()
-                    else:
-                        name = declarator.text.decode()
-            elif node.type == "method_definition":
-                name_node = node.child_by_field_name("name")
-                if name_node:
-                    name = name_node.text.decode()
-            elif node.type == "arrow_function":
-                parent = node.parent
-                if parent and parent.type == "variable_declarator":
-                    id_node = parent.child_by_field_name("name")
-                    if id_node:
-                        name = id_node.text.decode()
-
-            declarations.append({
+    # Pre-order walk with a TreeCursor instead of recursion, so deeply nested
+    # JSX cannot hit the interpreter's recursion limit.
+    cursor = tree.walk()
+    while True:
+        node = cursor.node
+        extract_name = DECLARATION_NAME_EXTRACTORS.get(node.type)
+        if extract_name is not None:
+            declaration = {
                 "type": node.type,
-                "name": name,
-                "start_line": byte_to_line(node.start_byte),
-                "end_line": byte_to_line(node.end_byte),
-                "code": code_bytes[node.start_byte:node.end_byte].decode("utf8", errors="ignore")
-            })
-
-        # Recursively process children
-        for child in node.children:
-            walk(child)
-
-    walk(tree.root_node)
-    return declarations
+                "name": extract_name(node),
+                # Rows are 0-based and count "\n" bytes, same as the line numbers shown to the LLM.
+                "start_line": node.start_point[0] + 1,
+                "end_line": node.end_point[0] + 1,
+            }
+            if include_code:
+                declaration["code"] = code_bytes[node.start_byte:node.end_byte].decode("utf8", errors="ignore")
+            declarations.append(declaration)
 
+        if cursor.goto_first_child():
+            continue
+        while not cursor.goto_next_sibling():
+            if not cursor.goto_parent():
+                return declarations
@@ -0,0 +1,53 @@
+"""
+Lazily loaded tree-sitter languages and per-thread parsers.
+
+Nothing is loaded at import, so processes that never parse (the API tier)
+do not pay for the grammars. A language is loaded on first use and shared;
+`Parser` objects are not thread-safe, so each thread gets its own parser per
+language. Workers can call `warm_up` at startup to move the loading cost out
+of the first job.
+"""
+import os
+import threading
+import time
+
+PARSER_WARM_UP_LANGUAGES = tuple(
+    name.strip() for name in os.getenv("PARSER_WARM_UP_LANGUAGES", "javascript,typescript,tsx").split(",") if name.strip()
+)
+
+_languages = {}
+_languages_lock = threading.Lock()
+_thread_parsers = threading.local()
+
+
+def get_language(lang_name: str):
+    language = _languages.get(lang_name)
+    if language is None:
+        with _languages_lock:
+            language = _languages.get(lang_name)
+            if language is None:
+                from tree_sitter_language_pack import get_language as load_language
+                language = _languages[lang_name] = load_language(lang_name)
+    return language
+
+
+def get_parser(lang_name: str):
+    """The calling thread's parser for `lang_name`."""
+    parsers = getattr(_thread_parsers, "parsers", None)
+    if parsers is None:
+        parsers = _thread_parsers.parsers = {}
+    parser = parsers.get(lang_name)
+    if parser is None:
+        from tree_sitter import Parser
+        parser = parsers[lang_name] = Parser(get_language(lang_name))
+    return parser
+
+
+def warm_up(languages=PARSER_WARM_UP_LANGUAGES) -> float:
+    """Load `languages` and this thread's parsers for them; returns the seconds taken."""
+    start = time.perf_counter()
+    for lang_name in languages:
+        get_parser(lang_name)
+    elapsed = time.perf_counter() - start
+    print(f"Parsers warmed up for {', '.join(languages)} in {elapsed * 1000:.1f} ms")
+    return elapsed
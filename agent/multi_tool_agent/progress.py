@@ -0,0 +1,66 @@
+"""
+Generation progress forwarded to the client's socket room.
+
+Streamed LLM chunks are counted and scanned for the files they touch, and
+sent as `agent_progress` events ({"stage", "tokens", "files"}) at most once
+per PROGRESS_EMIT_INTERVAL seconds, so a fast stream does not turn into one
+socket message per chunk. Stage changes are sent immediately.
+"""
+import os
+import re
+import time
+from socket_client import emit
+from llm_models.model import OnText
+from llm_models.tokens import FALLBACK_CHARS_PER_TOKEN
+
+PROGRESS_EMIT_INTERVAL = float(os.getenv("PROGRESS_EMIT_INTERVAL", "0.5"))
+
+# "file_path": "src/App.jsx" inside the coder's JSON output
+FILE_PATH_PATTERN = re.compile(r'"file_path"\s*:\s*"((?:[^"\\]|\\.)*)"')
+# Text kept from the previous chunk to catch a match split across chunks
+_SCAN_OVERLAP = 512
+
+
+class GenerationProgress:
+    def __init__(self, socket_id: str | None):
+        self._socket_id = socket_id
+        self.stage = None
+        self.chars = 0
+        self.files = []
+        self._last_emit = 0.0
+
+    @property
+    def tokens(self) -> int:
+        return int(self.chars / FALLBACK_CHARS_PER_TOKEN)
+
+    async def set_stage(self, stage: str) -> None:
+        self.stage = stage
+        await self.flush()
+
+    def stream(self) -> OnText:
+        """Callback for one streamed generation; concurrent streams each get their own."""
+        tail = ""
+
+        async def on_text(chunk: str) -> None:
+            nonlocal tail
+            window = tail + chunk
+            for match in FILE_PATH_PATTERN.finditer(window):
+                if match.group(1) not in self.files:
+                    self.files.append(match.group(1))
+            tail = window[-_SCAN_OVERLAP:]
+            self.chars += len(chunk)
+            now = time.monotonic()
+            if now - self._last_emit >= PROGRESS_EMIT_INTERVAL:
+                await self.flush(now)
+
+        return on_text
+
+    async def flush(self, now: float | None = None) -> None:
+        self._last_emit = now if now is not None else time.monotonic()
+        if not self._socket_id:
+            return
+        await emit('agent_progress', {
+            'stage': self.stage,
+            'tokens': self.tokens,
+            'files': list(self.files),
+        }, room=self._socket_id)
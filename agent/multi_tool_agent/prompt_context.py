@@ -0,0 +1,221 @@
+"""
+Compact file context for the coder prompt.
+
+The previous format embedded the Python repr of parse_file_str's output,
+where every nested declaration carries its own copy of the source, so a
+component's JSX appeared several times. Here each file is rendered as:
+
+- an outline of its declarations given only as line ranges, and
+- the numbered source, where every line appears exactly once.
+
+When the files do not fit the token budget, the interiors of the largest
+top-level declarations are elided (their first and last lines are kept and
+the outline still lists what is inside them).
+"""
+import hashlib
+import os
+from typing import List, Tuple
+from cache import LRUCache
+from cpu_pool import map_cpu_bound
+from parse_file_str import EXT_LANGUAGE_MAP, parse_file_str
+from llm_models.tokens import estimate_tokens
+
+PROMPT_CONTEXT_TOKEN_BUDGET = int(os.getenv("PROMPT_CONTEXT_TOKEN_BUDGET", "60000"))
+# Characters-per-token ratio used to turn the token budget into a size limit.
+CHARS_PER_TOKEN = 4
+
+# Rendered contexts, so retries and repeat jobs on the same files skip the work.
+_context_cache = LRUCache(max_bytes=int(os.getenv("PROMPT_CONTEXT_CACHE_MAX_BYTES", str(16 * 1024 * 1024))))
+# Declaration outlines by (extension, content digest); filled ahead of prompt
+# building by prepare_outlines so large files are parsed off the event loop.
+_outline_cache = LRUCache(max_entries=int(os.getenv("PROMPT_OUTLINE_CACHE_MAX_ENTRIES", "2048")))
+
+
+def prompt_stats(text: str) -> dict:
+    return {"bytes": len(text.encode("utf-8")), "tokens": estimate_tokens(text)}
+
+
+def format_files_context(file_contents: List[Tuple[str, str]], token_budget: int | None = PROMPT_CONTEXT_TOKEN_BUDGET) -> str:
+    """Render every file in the compact format, sharing `token_budget` between them by size."""
+    if not file_contents:
+        return ""
+    cache_key = (token_budget, tuple(
+        (path, hashlib.blake2b(content.encode("utf-8"), digest_size=16).digest()) for path, content in file_contents
+    ))
+    cached = _context_cache.get(cache_key)
+    if cached is not None:
+        return cached
+
+    # A fixed ratio (not the calibrated estimator) keeps the output, and so
+    # the cacheable prompt prefix, stable for the same files.
+    total = sum(len(content) for _, content in file_contents) // CHARS_PER_TOKEN or 1
+    sections = []
+    for file_path, content in file_contents:
+        file_budget = None
+        if token_budget is not None and total > token_budget:
+            file_budget = max(1, token_budget * (len(content) // CHARS_PER_TOKEN) // total)
+        sections.append(format_file_context(file_path, content, file_budget))
+    context = "\n\n".join(sections)
+    _context_cache.set(cache_key, context)
+    return context
+
+
+def format_file_context(file_path: str, content: str, token_budget: int | None = None) -> str:
+    lines = _split_lines(content)
+    outline = _outline(file_path, content)
+
+    header = [f"File: `{file_path}` ({len(lines)} lines)"]
+    if outline:
+        header.append("Outline (declarations as line ranges):")
+        header.extend(f"{'  ' * (depth + 1)}L{start}-{end} {kind}{' ' + name if name else ''}"
+                      for depth, start, end, kind, name in outline)
+    header.append("Source:")
+
+    rendered = [f"{number}| {line}" for number, line in enumerate(lines, start=1)]
+    if token_budget is not None:
+        budget_chars = token_budget * CHARS_PER_TOKEN - sum(len(line) + 1 for line in header)
+        rendered = _fit_to_budget(rendered, outline, budget_chars)
+    return "\n".join(header + rendered)
+
+
+def format_interface_summary(file_contents: List[Tuple[str, str]]) -> str:
+    """Imports, exports and top-level declarations of each file, without bodies."""
+    sections = []
+    for file_path, content in file_contents:
+        lines = _split_lines(content)
+        entries = [f"  {number}| {line}" for number, line in enumerate(lines, start=1)
+                   if line.startswith(("import ", "export "))]
+        entries.extend(f"  L{start}-{end} {kind}{' ' + name if name else ''}"
+                       for depth, start, end, kind, name in _outline(file_path, content) if depth == 0)
+        sections.append("\n".join([f"File: `{file_path}` ({len(lines)} lines)"] + entries))
+    return "\n\n".join(sections)
+
+
+def legacy_file_context(file_path: str, content: str) -> str:
+    """The previous per-file prompt section, kept for measuring the difference."""
+    declarations = parse_file_str(content, file_path.split(".")[-1])
+    return f"\nFile: `{file_path}` (AST Declarations):\n```json\n{declarations}\n```"
+
+
+def measure_context_formats(file_contents: List[Tuple[str, str]], token_budget: int | None = PROMPT_CONTEXT_TOKEN_BUDGET) -> dict:
+    """Bytes and estimated tokens of the legacy and compact context for the same files."""
+    legacy = "\n".join(legacy_file_context(path, content) for path, content in file_contents
+                       if path.split(".")[-1].lower() in EXT_LANGUAGE_MAP)
+    compact = format_files_context(file_contents, token_budget)
+    return {"legacy": prompt_stats(legacy), "compact": prompt_stats(compact)}
+
+
+def _split_lines(content: str) -> List[str]:
+    # Split on "\n" only so numbering matches tree-sitter rows.
+    lines = content.split("\n")
+    if lines and lines[-1] == "":
+        lines.pop()
+    return [line.rstrip("\r") for line in lines]
+
+
+async def prepare_outlines(file_contents: List[Tuple[str, str]]) -> None:
+    """Compute the outlines of the given files not yet cached, large ones in the CPU pool."""
+    missing = {}
+    for file_path, content in file_contents:
+        key = _outline_key(file_path, content)
+        if key is not None and _outline_cache.get(key) is None:
+            missing[key] = (file_path, content)
+    if not missing:
+        return
+    results = await map_cpu_bound("parse_file_str", compute_outlines, list(missing.values()),
+                                  sizeof=lambda file: len(file[1]))
+    for key, outline in zip(missing, results):
+        _outline_cache.set(key, outline)
+
+
+def compute_outlines(file_contents: List[Tuple[str, str]]) -> List[List[tuple]]:
+    """_compute_outline for each file; module-level so the CPU pool can run it."""
+    return [_compute_outline(file_path, content) for file_path, content in file_contents]
+
+
+def _outline_key(file_path: str, content: str) -> tuple | None:
+    extension = file_path.split(".")[-1].lower()
+    if extension not in EXT_LANGUAGE_MAP:
+        return None
+    return (extension, hashlib.blake2b(content.encode("utf-8"), digest_size=16).digest())
+
+
+def _outline(file_path: str, content: str) -> List[tuple]:
+    key = _outline_key(file_path, content)
+    if key is None:
+        return []
+    outline = _outline_cache.get(key)
+    if outline is None:
+        outline = _compute_outline(file_path, content)
+        _outline_cache.set(key, outline)
+    return outline
+
+
+def _compute_outline(file_path: str, content: str) -> List[tuple]:
+    """(depth, start_line, end_line, type, name) for the declarations worth listing."""
+    extension = file_path.split(".")[-1].lower()
+    if extension not in EXT_LANGUAGE_MAP:
+        return []
+    declarations = parse_file_str(content, extension, include_code=False)
+
+    outline = []
+    stack = []  # enclosing declarations as (start_line, end_line, type, name, listed), innermost last
+    for decl in declarations:
+        start, end, kind, name = decl["start_line"], decl["end_line"], decl["type"], decl["name"]
+        while stack and not (stack[-1][0] <= start and end <= stack[-1][1]):
+            stack.pop()
+        parent = stack[-1] if stack else None
+        # Skip anonymous callbacks, JSX nested inside other JSX, and the
+        # arrow function that merely repeats its enclosing declaration.
+        listed = not (
+            (kind == "arrow_function" and not name)
+            or (kind.startswith("jsx_") and parent is not None and parent[2].startswith("jsx_"))
+            or (parent is not None and (parent[0], parent[1], parent[3]) == (start, end, name))
+        )
+        if listed:
+            depth = sum(1 for entry in stack if entry[4])
+            outline.append((depth, start, end, kind, name))
+        stack.append((start, end, kind, name, listed))
+    return outline
+
+
+def _fit_to_budget(rendered: List[str], outline: List[tuple], budget_chars: int) -> List[str]:
+    def size(lines):
+        return sum(len(line) + 1 for line in lines)
+
+    if size(rendered) <= budget_chars:
+        return rendered
+
+    # Elide the interiors of top-level declarations, largest first.
+    elided = {}  # first elided line -> (last elided line, description)
+    remaining = size(rendered)
+    spans = sorted((entry for entry in outline if entry[0] == 0 and entry[2] - entry[1] > 1),
+                   key=lambda entry: entry[2] - entry[1], reverse=True)
+    for _, start, end, kind, name in spans:
+        if remaining <= budget_chars:
+            break
+        first, last = start + 1, end - 1
+        remaining -= size(rendered[first - 1:last])
+        elided[first] = (last, f"{kind}{' ' + name if name else ''}")
+
+    result = []
+    number = 1
+    while number <= len(rendered):
+        if number in elided:
+            last, description = elided[number]
+            result.append(f"...| (lines {number}-{last} of {description} elided)")
+            number = last + 1
+        else:
+            result.append(rendered[number - 1])
+            number += 1
+
+    # Still too large: keep the head of the file and say what was dropped.
+    if size(result) > budget_chars:
+        kept, used = [], 0
+        for line in result:
+            if used + len(line) + 1 > budget_chars:
+                break
+            kept.append(line)
+            used += len(line) + 1
+        result = kept + [f"...| (remaining {len(result) - len(kept)} lines omitted to fit the context budget)"]
+    return result
@@ -1,4 +1,5 @@
 from redis import Redis, from_url
+from redis import asyncio as aioredis
 import os
 
 def _create_redis_client() -> Redis:
@@ -9,5 +10,14 @@ def _create_redis_client() -> Redis:
     port = int(os.getenv("REDIS_PORT", "6379"))
     return Redis(host=host, port=port, decode_responses=True)
 
+def _create_async_redis_client() -> aioredis.Redis:
+    url = os.getenv("REDIS_URL")
+    if url:
+        return aioredis.from_url(url, decode_responses=True)
+    host = os.getenv("REDIS_HOST", "localhost")
+    port = int(os.getenv("REDIS_PORT", "6379"))
+    return aioredis.Redis(host=host, port=port, decode_responses=True)
+
 
 redis_client = _create_redis_client()
+async_redis_client = _create_async_redis_client()
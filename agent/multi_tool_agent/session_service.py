@@ -0,0 +1,202 @@
+"""
+ADK session service that keeps sessions in Redis instead of worker memory.
+
+Each session is stored as two keys with a sliding TTL:
+
+- `adk_session:{app}:{user}:{id}` holds the session's id, state and last
+  update time as JSON, and
+- `adk_session:{app}:{user}:{id}:events` is a list of its events as JSON.
+
+Events are compacted before they are stored: long strings (file contents,
+generated code) and long lists (repo trees) inside function calls and
+responses are cut down, so a stored session is a readable transcript rather
+than a copy of the repository. Credentials are redacted, in events and in
+the stored state: the GitHub access token travels in the user message and
+in tool call arguments, and must not outlive the job in Redis. The Session
+object of a running invocation keeps the full events; only what is
+persisted is compacted.
+"""
+import json
+import os
+import re
+import time
+import uuid
+from typing import Any, Optional
+from google.adk.events import Event
+from google.adk.sessions import BaseSessionService, Session
+from google.adk.sessions.base_session_service import GetSessionConfig, ListSessionsResponse
+from redis_client import async_redis_client
+
+SESSION_KEY_PREFIX = "adk_session:"
+SESSION_TTL = int(os.getenv("SESSION_TTL", str(24 * 60 * 60)))
+# Stored events per session; older ones are dropped.
+SESSION_MAX_EVENTS = int(os.getenv("SESSION_MAX_EVENTS", "200"))
+SESSION_EVENT_MAX_STRING = int(os.getenv("SESSION_EVENT_MAX_STRING", "1024"))
+SESSION_EVENT_MAX_ITEMS = int(os.getenv("SESSION_EVENT_MAX_ITEMS", "50"))
+
+REDACTED = "[redacted]"
+# Arguments whose value is replaced wholesale.
+SECRET_KEYS = {"access_token", "authorization"}
+# "access_token: ..." as the agent prompt writes it, and GitHub token formats anywhere.
+_SECRET_PATTERN = re.compile(
+    r"""(access_token["']?\s*[:=]\s*["']?)[^\s"',}]+|\bgh[pousr]_[A-Za-z0-9]{20,}|\bgithub_pat_[A-Za-z0-9_]{20,}"""
+)
+
+
+class SessionAlreadyExistsError(RuntimeError):
+    """Raised when creating a session with an id that is already stored."""
+
+
+class RedisSessionService(BaseSessionService):
+    def __init__(self, redis=async_redis_client, ttl: int = SESSION_TTL):
+        self._redis = redis
+        self._ttl = ttl
+
+    async def create_session(
+        self,
+        *,
+        app_name: str,
+        user_id: str,
+        state: Optional[dict[str, Any]] = None,
+        session_id: Optional[str] = None,
+    ) -> Session:
+        session = Session(
+            id=(session_id or "").strip() or str(uuid.uuid4()),
+            app_name=app_name,
+            user_id=user_id,
+            state=dict(state or {}),
+            events=[],
+            last_update_time=time.time(),
+        )
+        key = _session_key(app_name, user_id, session.id)
+        if not await self._redis.set(key, _session_meta(session), ex=self._ttl, nx=True):
+            raise SessionAlreadyExistsError(f"Session {session.id} already exists.")
+        return session
+
+    async def get_session(
+        self,
+        *,
+        app_name: str,
+        user_id: str,
+        session_id: str,
+        config: Optional[GetSessionConfig] = None,
+    ) -> Optional[Session]:
+        key = _session_key(app_name, user_id, session_id)
+        start = 0
+        if config and config.num_recent_events is not None:
+            if config.num_recent_events == 0:
+                start = None
+            else:
+                start = -config.num_recent_events
+        async with self._redis.pipeline(transaction=False) as pipe:
+            pipe.get(key)
+            pipe.lrange(key + ":events", start if start is not None else 0, -1)
+            meta, raw_events = await pipe.execute()
+        if meta is None:
+            return None
+
+        events = [Event.model_validate_json(raw) for raw in raw_events] if start is not None else []
+        if config and config.after_timestamp is not None:
+            events = [event for event in events if event.timestamp >= config.after_timestamp]
+        data = json.loads(meta)
+        return Session(
+            id=session_id,
+            app_name=app_name,
+            user_id=user_id,
+            state=data.get("state", {}),
+            events=events,
+            last_update_time=data.get("last_update_time", 0.0),
+        )
+
+    async def list_sessions(self, *, app_name: str, user_id: Optional[str] = None) -> ListSessionsResponse:
+        pattern = _session_key(app_name, user_id or "*", "*")
+        sessions = []
+        async for key in self._redis.scan_iter(match=pattern):
+            if key.endswith(":events"):
+                continue
+            meta = await self._redis.get(key)
+            if meta is None:
+                continue
+            data = json.loads(meta)
+            sessions.append(Session(
+                id=data["id"],
+                app_name=app_name,
+                user_id=data["user_id"],
+                state={},
+                events=[],
+                last_update_time=data.get("last_update_time", 0.0),
+            ))
+        sessions.sort(key=lambda session: session.last_update_time)
+        return ListSessionsResponse(sessions=sessions)
+
+    async def delete_session(self, *, app_name: str, user_id: str, session_id: str) -> None:
+        key = _session_key(app_name, user_id, session_id)
+        await self._redis.delete(key, key + ":events")
+
+    async def append_event(self, session: Session, event: Event) -> Event:
+        event = await super().append_event(session=session, event=event)
+        if event.partial:
+            return event
+        session.last_update_time = event.timestamp
+
+        key = _session_key(session.app_name, session.user_id, session.id)
+        async with self._redis.pipeline(transaction=False) as pipe:
+            pipe.set(key, _session_meta(session), ex=self._ttl)
+            pipe.rpush(key + ":events", compact_event(event))
+            pipe.ltrim(key + ":events", -SESSION_MAX_EVENTS, -1)
+            pipe.expire(key + ":events", self._ttl)
+            await pipe.execute()
+        return event
+
+
+def compact_event(event: Event) -> str:
+    """The event as JSON, with function call arguments and responses shrunk."""
+    data = redact_secrets(event.model_dump(mode="json", exclude_none=True))
+    for part in (data.get("content") or {}).get("parts") or []:
+        if "function_call" in part and "args" in part["function_call"]:
+            part["function_call"]["args"] = _shrink(part["function_call"]["args"])
+        if "function_response" in part and "response" in part["function_response"]:
+            part["function_response"]["response"] = _shrink(part["function_response"]["response"])
+    return json.dumps(data, separators=(",", ":"))
+
+
+def redact_secrets(value, key: str | None = None):
+    """`value` with access tokens replaced by REDACTED, in nested dicts and lists too."""
+    if isinstance(value, str):
+        if key in SECRET_KEYS:
+            return REDACTED
+        return _SECRET_PATTERN.sub(lambda match: (match.group(1) or "") + REDACTED, value)
+    if isinstance(value, dict):
+        return {item_key: redact_secrets(item, item_key) for item_key, item in value.items()}
+    if isinstance(value, list):
+        return [redact_secrets(item) for item in value]
+    return value
+
+
+def _shrink(value):
+    if isinstance(value, str):
+        if len(value) <= SESSION_EVENT_MAX_STRING:
+            return value
+        return f"{value[:SESSION_EVENT_MAX_STRING]}... [{len(value) - SESSION_EVENT_MAX_STRING} chars not stored]"
+    if isinstance(value, dict):
+        return {key: _shrink(item) for key, item in value.items()}
+    if isinstance(value, list):
+        shrunk = [_shrink(item) for item in value[:SESSION_EVENT_MAX_ITEMS]]
+        if len(value) > SESSION_EVENT_MAX_ITEMS:
+            shrunk.append(f"... [{len(value) - SESSION_EVENT_MAX_ITEMS} items not stored]")
+        return shrunk
+    return value
+
+
+def _session_key(app_name: str, user_id: str, session_id: str) -> str:
+    return f"{SESSION_KEY_PREFIX}{app_name}:{user_id}:{session_id}"
+
+
+def _session_meta(session: Session) -> str:
+    return json.dumps({
+        "id": session.id,
+        "user_id": session.user_id,
+        # temp: keys live for one invocation only
+        "state": redact_secrets({key: value for key, value in session.state.items() if not key.startswith("temp:")}),
+        "last_update_time": session.last_update_time,
+    }, default=str)
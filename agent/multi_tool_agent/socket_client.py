@@ -1,10 +1,46 @@
-from socketio import AsyncServer
+"""
+Socket.IO server and the emit path used by the agent pipeline.
+
+API processes share socket.io state through Redis pub/sub (AsyncRedisManager),
+so an event emitted in any process reaches clients connected to any other.
+A standalone worker (worker.py) has no server; it switches `emit` to a
+write-only Redis manager that only publishes. Code that sends events to
+clients calls `emit` rather than `sio.emit`, so it works in both tiers.
+"""
+import os
+from socketio import AsyncRedisManager, AsyncServer
+
+# Set to false to keep socket.io state in process (single-process setups without Redis pub/sub).
+SOCKETIO_USE_REDIS = os.getenv("SOCKETIO_USE_REDIS", "true").lower() == "true"
+SOCKETIO_CHANNEL = os.getenv("SOCKETIO_CHANNEL", "socketio")
+
+
+def socketio_redis_url() -> str:
+    url = os.getenv("SOCKETIO_REDIS_URL") or os.getenv("REDIS_URL")
+    if url:
+        return url
+    return f"redis://{os.getenv('REDIS_HOST', 'localhost')}:{os.getenv('REDIS_PORT', '6379')}/0"
+
 
 sio = AsyncServer(
     async_mode='asgi',
+    client_manager=AsyncRedisManager(socketio_redis_url(), channel=SOCKETIO_CHANNEL) if SOCKETIO_USE_REDIS else None,
     cors_allowed_origins=['http://localhost:5173'],
     logger=True,
     engineio_logger=True,
     ping_timeout=120,
     ping_interval=25,
 )
+
+# Where `emit` sends events: the server, or a write-only manager in workers.
+_emitter = sio
+
+
+def use_write_only_emitter() -> None:
+    """Publish events through Redis without running a socket.io server (worker processes)."""
+    global _emitter
+    _emitter = AsyncRedisManager(socketio_redis_url(), channel=SOCKETIO_CHANNEL, write_only=True)
+
+
+async def emit(event: str, data, room: str | None = None) -> None:
+    await _emitter.emit(event, data, room=room)
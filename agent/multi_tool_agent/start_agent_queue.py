@@ -1,73 +1,206 @@
-from redis_client import redis_client
+from redis_client import async_redis_client
+from redis.exceptions import RedisError
 import json
-from main import run_agent
-from socket_client import sio
+from socket_client import emit
 import requests
 import os
+import socket
+import uuid
 import asyncio
+import importlib
+import time
 from models import Repo
+from metrics import JOB_SECONDS, JOBS_IN_FLIGHT, QUEUE_WAIT_SECONDS
+from job_queue import (
+    DEFAULT_LANE, PROCESSING_KEY_PREFIX, WORKER_HEARTBEAT_PREFIX, ack_job, pop_job, record_job_duration, requeue,
+)
+from job_dedup import finish
 
-async def start_agent_queue():
+# Jobs being worked on are parked in a per-worker processing list
+# (PROCESSING_KEY_PREFIX + worker id) until they finish, so a worker that
+# dies mid-job does not lose them.
+
+AGENT_WORKER_CONCURRENCY = int(os.getenv("AGENT_WORKER_CONCURRENCY", "4"))
+WORKER_HEARTBEAT_TTL = int(os.getenv("WORKER_HEARTBEAT_TTL", "30"))
+
+async def start_agent_queue(concurrency: int = AGENT_WORKER_CONCURRENCY):
+    """Consume the queue lanes with up to `concurrency` jobs in flight in this process."""
+    worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+    processing_key = PROCESSING_KEY_PREFIX + worker_id
+    print(f"Starting queue worker {worker_id} with concurrency {concurrency}")
+    # The pipeline (ADK, providers, parsers) is imported here rather than at
+    # module import, so the API process only loads it when it consumes jobs,
+    # and in a thread so the loop keeps serving requests meanwhile.
+    await asyncio.to_thread(importlib.import_module, "main")
+
+    heartbeat_key = WORKER_HEARTBEAT_PREFIX + worker_id
+    # Register before taking any job so other workers never see our
+    # processing list as orphaned.
+    # The heartbeat holds our concurrency, for the API's wait estimates.
+    await async_redis_client.set(heartbeat_key, concurrency, ex=WORKER_HEARTBEAT_TTL)
+    tasks = [asyncio.create_task(_heartbeat(heartbeat_key, concurrency))]
+    tasks += [asyncio.create_task(_job_slot(processing_key)) for _ in range(concurrency)]
+    try:
+        await asyncio.gather(*tasks)
+    finally:
+        for task in tasks:
+            task.cancel()
+
+async def _job_slot(processing_key: str):
+    while True:
+        try:
+            # Atomically move the next job, by lane, onto our processing list;
+            # it stays there until acknowledged below.
+            payload = await pop_job(processing_key)
+        except RedisError as e:
+            print(f"Queue worker: failed to fetch job: {e}")
+            await asyncio.sleep(1)
+            continue
+        if not payload:
+            continue
+        try:
+            with JOBS_IN_FLIGHT.track_inprogress():
+                await process_job(payload)
+        except asyncio.CancelledError:
+            # Shutting down mid-job: leave it on the processing list, where it
+            # is requeued once our heartbeat expires.
+            raise
+        except Exception as e:
+            print(f"Queue worker: job failed: {e}")
+        try:
+            await ack_job(processing_key, payload)
+        except RedisError as e:
+            print(f"Queue worker: failed to acknowledge job: {e}")
+
+async def _heartbeat(heartbeat_key: str, concurrency: int):
     while True:
         try:
-            # Run blocking Redis call in a thread to avoid freezing the event loop
-            raw = await asyncio.to_thread(redis_client.brpop, "agent_queue", 1)
-            if not raw:
-                continue
-            _, payload = raw
-            req = json.loads(payload)
-            # Normalize repo to Repo model to ensure attribute access works downstream
-            repo_obj = Repo(**req["repo"]) if isinstance(req.get("repo"), dict) else req["repo"]
-            pr_url, session_id = await run_agent(
-                req["user_prompt"], repo_obj, req["access_token"],
-                req["socket_id"], None, req["llm_model_type"], req["llm_model_name"]
+            await async_redis_client.set(heartbeat_key, concurrency, ex=WORKER_HEARTBEAT_TTL)
+            await reclaim_orphaned_jobs()
+        except RedisError as e:
+            print(f"Queue worker: heartbeat failed: {e}")
+        await asyncio.sleep(WORKER_HEARTBEAT_TTL / 3)
+
+async def reclaim_orphaned_jobs() -> int:
+    """Requeue jobs left on the processing list of workers whose heartbeat expired."""
+    reclaimed = 0
+    async for key in async_redis_client.scan_iter(match=PROCESSING_KEY_PREFIX + "*"):
+        worker_id = key[len(PROCESSING_KEY_PREFIX):]
+        if await async_redis_client.exists(WORKER_HEARTBEAT_PREFIX + worker_id):
+            continue
+        # Back to the consuming end of their lanes, so orphaned jobs run next.
+        reclaimed += await requeue(key)
+    if reclaimed:
+        print(f"Queue worker: reclaimed {reclaimed} orphaned job(s)")
+    return reclaimed
+
+async def process_job(payload: str):
+    started = time.time()
+    outcome = "error"
+    req = None
+    pr_url = session_id = error = None
+    try:
+        req = json.loads(payload)
+        if req.get("enqueued_at"):
+            QUEUE_WAIT_SECONDS.labels(lane=req.get("lane", DEFAULT_LANE)).observe(max(0.0, started - req["enqueued_at"]))
+        # Normalize repo to Repo model to ensure attribute access works downstream
+        repo_obj = Repo(**req["repo"]) if isinstance(req.get("repo"), dict) else req["repo"]
+        from main import run_agent
+        pr_url, session_id = await run_agent(
+            req["user_prompt"], repo_obj, req["access_token"],
+            req["socket_id"], None, req["llm_model_type"], req["llm_model_name"]
+        )
+        outcome = await deliver_result(req, pr_url, session_id)
+    except Exception as e:
+        error = e
+        await deliver_error(req, e)
+        await asyncio.sleep(0.5)
+
+    # Not reached when the worker is cancelled mid-job: the job stays on the
+    # processing list and is requeued, and the run that finishes it records
+    # it and resolves its duplicates, which keep waiting on its claim.
+    job = req if isinstance(req, dict) else {}
+    JOB_SECONDS.labels(
+        provider=job.get("llm_model_type") or "unknown",
+        model=job.get("llm_model_name") or "unknown",
+        outcome=outcome,
+    ).observe(time.time() - started)
+    if job:
+        try:
+            await record_job_duration(time.time() - started)
+        except RedisError as e:
+            print(f"Queue worker: failed to record job duration: {e}")
+    if job.get("dedup_key"):
+        await _resolve_duplicates(job, pr_url, session_id, error)
+
+async def deliver_result(req: dict, pr_url: str, session_id: str | None) -> str:
+    """Attach the PR URL to the request's chat and emit the outcome to its client; returns the event sent."""
+    event = "pr_submitted" if 'github.com' in pr_url else "agent_error"
+    # Attach PR URL to chat before persisting and emitting
+    if event == 'pr_submitted':
+        req["chat"]["pullRequestUrl"] = pr_url
+        try:
+            # Run blocking HTTP call in a thread to avoid freezing the event loop
+            res = await asyncio.to_thread(
+                requests.put,
+                f"{os.getenv('BACKEND_API')}/project/{req['project_id']}/chat/{req['chat']['id']}",
+                json={"chat": req["chat"]},
+                timeout=15
             )
-            event = "pr_submitted" if 'github.com' in pr_url else "agent_error"
-            # Attach PR URL to chat before persisting and emitting
-            if event == 'pr_submitted':
-                req["chat"]["pullRequestUrl"] = pr_url
+
+            if res.status_code != 200:
+                error_msg = None
                 try:
-                    # Run blocking HTTP call in a thread to avoid freezing the event loop
-                    res = await asyncio.to_thread(
-                        requests.put,
-                        f"{os.getenv('BACKEND_API')}/project/{req['project_id']}/chat/{req['chat']['id']}",
-                        json={"chat": req["chat"]},
-                        timeout=15
-                    )
-                    
-                    if res.status_code != 200:
-                        error_msg = None
-                        try:
-                            error_msg = res.json().get('error')
-                        except Exception:
-                            error_msg = res.text
-                        event = "agent_error"
-                except Exception as e:
-                    event = "agent_error"
-            else:
+                    error_msg = res.json().get('error')
+                except Exception:
+                    error_msg = res.text
                 event = "agent_error"
-                # Fallback emit to socket id and email room
-                await sio.emit(event, {"pr_url": pr_url, "session": session_id, "chat": req["chat"]}, room=req["socket_id"]) 
-                if req.get("chat") and req["chat"].get("userEmail"):
-                    await sio.emit(event, {"pr_url": pr_url, "session": session_id, "chat": req["chat"]}, room=req["chat"]["userEmail"])                
-            
-            print(f'Emitting event: {event}')
-            # Emit final event to the specific client socket and the user's email room
-            await sio.emit(event, {"pr_url": pr_url, "session": session_id, "chat": req["chat"]}, room=req["socket_id"])
-            if req.get("chat") and req["chat"].get("userEmail"):
-                await sio.emit(event, {"pr_url": pr_url, "session": session_id, "chat": req["chat"]}, room=req["chat"]["userEmail"])            
         except Exception as e:
-            # Try to notify client about the failure, then keep the worker alive
-            try:
-                error_payload = {"pr_url": str(e), "session": None}
-                if 'req' in locals() and isinstance(req, dict):
-                    if req.get("chat"):
-                        error_payload["chat"] = req["chat"]
-                    if req.get("socket_id"):
-                        await sio.emit("agent_error", error_payload, room=req["socket_id"])
-                    user_email = req.get("chat", {}).get("userEmail") if req.get("chat") else None
-                    if user_email:
-                        await sio.emit("agent_error", error_payload, room=user_email)
-            except Exception:
-                pass
-            await asyncio.sleep(0.5)
+            event = "agent_error"
+    else:
+        event = "agent_error"
+        # Fallback emit to socket id and email room
+        await emit(event, {"pr_url": pr_url, "session": session_id, "chat": req["chat"]}, room=req["socket_id"])
+        if req.get("chat") and req["chat"].get("userEmail"):
+            await emit(event, {"pr_url": pr_url, "session": session_id, "chat": req["chat"]}, room=req["chat"]["userEmail"])
+
+    print(f'Emitting event: {event}')
+    # Emit final event to the specific client socket and the user's email room
+    await emit(event, {"pr_url": pr_url, "session": session_id, "chat": req["chat"]}, room=req["socket_id"])
+    if req.get("chat") and req["chat"].get("userEmail"):
+        await emit(event, {"pr_url": pr_url, "session": session_id, "chat": req["chat"]}, room=req["chat"]["userEmail"])
+    return event
+
+async def deliver_error(req: dict | None, error: Exception) -> None:
+    """Try to notify the request's client about the failure."""
+    try:
+        error_payload = {"pr_url": str(error), "session": None}
+        if isinstance(req, dict):
+            if req.get("chat"):
+                error_payload["chat"] = req["chat"]
+            if req.get("socket_id"):
+                await emit("agent_error", error_payload, room=req["socket_id"])
+            user_email = req.get("chat", {}).get("userEmail") if req.get("chat") else None
+            if user_email:
+                await emit("agent_error", error_payload, room=user_email)
+    except Exception:
+        pass
+
+async def _resolve_duplicates(job: dict, pr_url: str | None, session_id: str | None, error: Exception | None):
+    """Cache a submitted PR for later duplicates and hand this job's outcome to the ones attached to it."""
+    submitted = error is None and pr_url is not None and 'github.com' in pr_url
+    try:
+        waiters = await finish(job["dedup_key"], job.get("job_id", ""),
+                               {"pr_url": pr_url, "session": session_id} if submitted else None)
+    except RedisError as e:
+        print(f"Queue worker: failed to resolve duplicates of {job.get('job_id')}: {e}")
+        return
+    if waiters:
+        print(f"Delivering the result of {job.get('job_id')} to {len(waiters)} duplicate request(s)")
+    for waiter in waiters:
+        # Each duplicate has its own chat and client; the rest of the job is shared.
+        waiter_req = {**job, **waiter}
+        if error is not None or pr_url is None:
+            await deliver_error(waiter_req, error or RuntimeError("The agent did not return a result"))
+        else:
+            await deliver_result(waiter_req, pr_url, session_id)
@@ -1,6 +1,8 @@
 import json
-from typing import List, Tuple
+from typing import Dict, List, NamedTuple, Tuple
 from pydantic import BaseModel
+from metrics import timed
+from cpu_pool import run_cpu_bound
 
 # Pydantic models for the structured output of the Coder LLM.
 class CoderChange(BaseModel):
@@ -15,22 +17,52 @@ class CoderResponse(BaseModel):
     pr_description: str
     changes: List[CoderChange]
 
+class TextEdit(NamedTuple):
+    """One applied edit, in the byte/point form `tree_sitter.Tree.edit` takes.
+
+    Coordinates refer to the original file. A file's edits are listed
+    bottom-up, so they can be passed to `Tree.edit` one after another.
+    """
+    start_byte: int
+    old_end_byte: int
+    new_end_byte: int
+    start_point: Tuple[int, int]
+    old_end_point: Tuple[int, int]
+    new_end_point: Tuple[int, int]
+
+class FileEdits(NamedTuple):
+    # None when the file was (re)created, so there is no edit map against its original
+    edits: List[TextEdit] | None
+    # Why each change that could not be applied was rejected
+    rejected: List[str]
+
 def apply_code_changes(code_changes_json: str, original_file_contents: List[Tuple[str, str]]) -> Tuple[str, List[Tuple[str, str]]]:
     """
     Applies the code changes from the Coder LLM to the original file contents.
     Returns a tuple of (pr_description, modified_file_contents).
-    Applies changes from bottom up to avoid line shifting issues.
+    """
+    pr_description, file_contents, _ = apply_code_changes_with_edits(code_changes_json, original_file_contents)
+    return pr_description, file_contents
+
+@timed("apply_code_changes")
+def apply_code_changes_with_edits(
+    code_changes_json: str, original_file_contents: List[Tuple[str, str]]
+) -> Tuple[str, List[Tuple[str, str]], Dict[str, FileEdits]]:
+    """
+    Like apply_code_changes, and also returns, per changed file, the applied
+    edits (for incremental re-parsing) and the changes that were rejected.
     """
     cleaned_coder_json = code_changes_json.strip().strip('```json').strip()
     
     if not cleaned_coder_json or cleaned_coder_json == "":
-        return None, original_file_contents
+        return None, original_file_contents, {}
     
     coder_data = json.loads(cleaned_coder_json)
 
     coder_response = CoderResponse(**coder_data)
 
     working_files = dict(original_file_contents)
+    file_edits = {}
     
     # Group changes by file
     file_to_changes = {}
@@ -42,26 +74,118 @@ def apply_code_changes(code_changes_json: str, original_file_contents: List[Tupl
         new_file_changes = [c for c in changes if c.is_new_file]
         for change in new_file_changes:
             working_files[change.file_path] = change.new_code
-        # Only apply non-new-file changes bottom-up
         mod_changes = [c for c in changes if not c.is_new_file]
-        # Sort by start_line descending
-        mod_changes.sort(key=lambda c: c.start_line if c.start_line is not None else -1, reverse=True)
-        for change in mod_changes:
-            if change.file_path not in working_files:
-                print(f"Warning: Coder attempted to modify a file not provided by the analyst: {change.file_path}")
-                continue
-            original_content_lines = working_files[change.file_path].splitlines()
-            start_index = change.start_line - 1 if change.start_line is not None else 0
-            end_index = change.end_line if change.end_line is not None else 0
-            if not (0 <= start_index < len(original_content_lines) and start_index < end_index <= len(original_content_lines)):
-                print(f"Warning: Invalid line numbers ({change.start_line}-{change.end_line}) provided for {change.file_path}. Skipping change.")
-                continue
-            new_code_lines = change.new_code.splitlines()
-            new_content_list = (
-                original_content_lines[:start_index] +
-                new_code_lines +
-                original_content_lines[end_index:]
-            )
-            working_files[change.file_path] = "\n".join(new_content_list)
+        if not mod_changes:
+            file_edits[file_path] = FileEdits(None, [])
+            continue
+        if file_path not in working_files:
+            print(f"Warning: Coder attempted to modify a file not provided by the analyst: {file_path}")
+            continue
+        content, edits, rejected = edit_lines(working_files[file_path], mod_changes)
+        working_files[file_path] = content
+        file_edits[file_path] = FileEdits(None if new_file_changes else edits, rejected)
     
-    return coder_response.pr_description, list(working_files.items())
+    return coder_response.pr_description, list(working_files.items()), file_edits
+
+async def aapply_code_changes_with_edits(
+    code_changes_json: str, original_file_contents: List[Tuple[str, str]]
+) -> Tuple[str, List[Tuple[str, str]], Dict[str, FileEdits]]:
+    """apply_code_changes_with_edits, in the CPU pool for large change sets."""
+    size = len(code_changes_json) + sum(len(content) for _, content in original_file_contents)
+    return await run_cpu_bound("apply_code_changes", apply_code_changes_with_edits,
+                               code_changes_json, original_file_contents, size=size)
+
+def edit_lines(content: str, changes: List[CoderChange]) -> Tuple[str, List[TextEdit] | None, List[str]]:
+    """
+    Applies line-range replacements to `content` in one pass.
+
+    Lines are numbered as in the prompt (split on "\n"). Every range is
+    validated against the original lines before anything is applied, and
+    ranges that are out of bounds or overlap an earlier change are rejected
+    rather than applied on top of each other. The file's line ending (CRLF
+    or LF) is used for the new lines and a trailing newline is preserved.
+    Returns (new content, applied edits bottom-up or None, rejection messages).
+    """
+    lines = content.split("\n")
+    terminated = lines[-1] == ""
+    if terminated:
+        lines.pop()
+    line_count = len(lines)
+    newline = "\r\n" if "\r\n" in content else "\n"
+
+    # Validate every range against the original lines, in the order given.
+    accepted = []
+    rejected = []
+    for change in changes:
+        start, end = change.start_line, change.end_line
+        if start is None or end is None or not (1 <= start <= end <= line_count):
+            print(f"Warning: Invalid line numbers ({start}-{end}) provided for {change.file_path}. Skipping change.")
+            rejected.append(f"lines {start}-{end} are outside the file's 1-{line_count}")
+            continue
+        overlapping = next((other for other in accepted if start <= other.end_line and other.start_line <= end), None)
+        if overlapping is not None:
+            print(f"Warning: Lines {start}-{end} overlap lines {overlapping.start_line}-{overlapping.end_line} in {change.file_path}. Skipping change.")
+            rejected.append(f"lines {start}-{end} overlap the change to lines {overlapping.start_line}-{overlapping.end_line}")
+            continue
+        accepted.append(change)
+    accepted.sort(key=lambda c: c.start_line)
+
+    # Byte offset of each line start in the original, for the edit map.
+    line_bytes = [0]
+    for number, line in enumerate(lines):
+        ends_with_newline = number < line_count - 1 or terminated
+        line_bytes.append(line_bytes[-1] + len(line.encode("utf8")) + (1 if ends_with_newline else 0))
+
+    pieces = []
+    edits = []
+    copied_to = 0  # lines before this index are already in `pieces`
+    for change in accepted:
+        start_index, end_index = change.start_line - 1, change.end_line
+        # Unchanged lines keep their own endings.
+        pieces.append("\n".join(lines[copied_to:start_index]))
+        if start_index > copied_to:
+            pieces.append("\n")
+
+        new_code = change.new_code[:-1] if change.new_code.endswith("\n") else change.new_code
+        new_lines = [line.rstrip("\r") for line in new_code.split("\n")] if new_code else []
+        # The replaced block ends with a line break unless it was the file's unterminated last line.
+        block_terminated = end_index < line_count or terminated
+        block = newline.join(new_lines)
+        if new_lines and block_terminated:
+            block += newline
+        pieces.append(block)
+        copied_to = end_index
+
+        edits.append(_text_edit(lines, line_bytes, start_index, end_index, block, terminated))
+
+    rest = lines[copied_to:]
+    pieces.append("\n".join(rest))
+    if terminated and rest:
+        pieces.append("\n")
+    new_content = "".join(pieces)
+    if not terminated and copied_to == line_count and new_content.endswith("\n"):
+        # The unterminated last lines were deleted; drop the line break left
+        # before them. No edit map for this rare case (callers diff instead).
+        return new_content[:-len(newline)] if new_content.endswith(newline) else new_content[:-1], None, rejected
+    edits.reverse()
+    return new_content, edits, rejected
+
+def _text_edit(lines: List[str], line_bytes: List[int], start_index: int, end_index: int, block: str,
+               terminated: bool) -> TextEdit:
+    block_bytes = block.encode("utf8")
+    start_byte, old_end_byte = line_bytes[start_index], line_bytes[end_index]
+    if end_index == len(lines) and not terminated:
+        # Replaced through the unterminated last line.
+        old_end_point = (end_index - 1, len(lines[-1].encode("utf8")))
+    else:
+        old_end_point = (end_index, 0)
+    rows = block_bytes.count(b"\n")
+    column = len(block_bytes) - (block_bytes.rfind(b"\n") + 1)
+    return TextEdit(
+        start_byte=start_byte,
+        old_end_byte=old_end_byte,
+        new_end_byte=start_byte + len(block_bytes),
+        start_point=(start_index, 0),
+        old_end_point=old_end_point,
+        new_end_point=(start_index + rows, column),
+    )
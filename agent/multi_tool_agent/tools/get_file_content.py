@@ -1,24 +1,25 @@
-import requests
 import base64
-
-GITHUB_API_BASE = "https://api.github.com"
+from file_cache import file_cache
+from github_client import github
+from metrics import timed
 
 class FileContentError(RuntimeError):
     """Custom exception for file content retrieval errors."""
 
-def get_file_content(owner: str, repo_name: str, path: str, access_token: str) -> str:
+@timed("get_file_content")
+async def get_file_content(owner: str, repo_name: str, path: str, access_token: str) -> str:
     """
     Fetches and decodes the content of a file from a GitHub repository.
     Returns an error message if the file doesn't exist instead of raising an exception.
     """
     print(f"Getting file content for {owner}/{repo_name}/{path}")
-    url = f"{GITHUB_API_BASE}/repos/{owner}/{repo_name}/contents/{path}"
-    headers = {
-        "Authorization": f"token {access_token}",
-        "Accept": "application/vnd.github+json"
-    }
-    
-    response = requests.get(url, headers=headers, timeout=30)
+    known_sha = file_cache.sha_for_path(owner, repo_name, access_token, path)
+    if known_sha:
+        cached = await file_cache.aget(known_sha)
+        if cached is not None:
+            return cached
+
+    response = await github.aget(f"/repos/{owner}/{repo_name}/contents/{path}", access_token)
     
     # Handle 404 specifically - file doesn't exist
     if response.status_code == 404:
@@ -44,6 +45,9 @@ def get_file_content(owner: str, repo_name: str, path: str, access_token: str) -
     except (TypeError, ValueError) as e:
         # Return error message instead of raising
         return f"ERROR: File '{path}' exists but couldn't be decoded as text. It might be a binary file."
-    
+
+    if data.get('sha'):
+        await file_cache.aset(data['sha'], decoded_content)
+
     return decoded_content
 
@@ -1,52 +1,131 @@
 from typing import List, Dict
-import requests
-
-GITHUB_API_BASE = "https://api.github.com"
+import os
+import time
+from cache import LRUCache, token_fingerprint
+from file_cache import file_cache
+from github_client import github
+from metrics import timed
+
+REPO_TREE_CACHE_MAX_BYTES = int(os.getenv("REPO_TREE_CACHE_MAX_BYTES", str(128 * 1024 * 1024)))
+BUILT_TREE_CACHE_MAX_ENTRIES = int(os.getenv("BUILT_TREE_CACHE_MAX_ENTRIES", "64"))
+# How long a branch head observed by get_repo_tree may be reused as the PR base.
+BRANCH_HEAD_MAX_AGE = float(os.getenv("BRANCH_HEAD_MAX_AGE", "300"))
+
+# (url, token fingerprint) -> (etag, parsed json, response size in bytes)
+_response_cache = LRUCache(max_bytes=REPO_TREE_CACHE_MAX_BYTES, sizeof=lambda entry: entry[2])
+# tree sha -> nested tree built by build_tree_from_flat_list; never handed out
+# itself, callers get a copy (see _copy_tree)
+_built_tree_cache = LRUCache(max_entries=BUILT_TREE_CACHE_MAX_ENTRIES)
+# (owner, repo, branch, token fingerprint) -> (commit sha, tree sha, observed at)
+_branch_heads = LRUCache(max_entries=1024)
 
 class GitHubTreeRetrievalError(RuntimeError):
     """Raised when we fail to retrieve the tree for a repo."""
 
-def get_repo_tree(owner: str, repo_name: str, branch: str, access_token: str) -> List[Dict]:
+@timed("get_repo_tree")
+async def get_repo_tree(owner: str, repo_name: str, branch: str, access_token: str) -> List[Dict]:
     """Return the full file tree for the given GitHub repository branch.
 
     Parameters are primitives (str) so the Google ADK LLM can auto-generate
     the function-call.
     """
 
-    headers = {"Authorization": f"Bearer {access_token}", "Accept": "application/vnd.github+json"}
-    #1) resolve the branch ref to get the commit object URL
-    
-    ref_url = f"{GITHUB_API_BASE}/repos/{owner}/{repo_name}/git/refs/heads/{branch}"
+    #1) resolve the branch ref to get the commit object URL.
+    try:
+        object_url = (await _get_branch_ref(owner, repo_name, branch, access_token))["url"]
+    except KeyError as exc:
+        raise GitHubTreeRetrievalError("Branch ref JSON missing object URL") from exc
+
+    # 2) get the tree URL from the commit object (addressed by SHA, so immutable)
+    commit_json = await _get_json(object_url, access_token, what="commit object", immutable=True)
+    try:
+        tree_url = commit_json["tree"]["url"]
+        tree_sha = commit_json["tree"]["sha"]
+    except KeyError as exc:
+        raise GitHubTreeRetrievalError("Commit JSON missing tree URL") from exc
+    if commit_json.get("sha"):
+        _branch_heads.set(_head_key(owner, repo_name, branch, access_token),
+                          (commit_json["sha"], tree_sha, time.monotonic()))
+
+    # 3) fetch the full tree recursively (also addressed by SHA)
+    tree_json = await _get_json(f"{tree_url}?recursive=1", access_token, what="tree", immutable=True, timeout=60)
+    flat_items = tree_json.get("tree", [])
+    file_cache.index_tree(owner, repo_name, access_token, flat_items)
+
+    tree = _built_tree_cache.get(tree_sha)
+    if tree is None:
+        tree = build_tree_from_flat_list(flat_items)
+        _built_tree_cache.set(tree_sha, tree)
+    return _copy_tree(tree)
+
+async def get_branch_head_sha(owner: str, repo_name: str, branch: str, access_token: str) -> str:
+    """Return the commit sha the branch currently points at."""
+    try:
+        return (await _get_branch_ref(owner, repo_name, branch, access_token))["sha"]
+    except KeyError as exc:
+        raise GitHubTreeRetrievalError("Branch ref JSON missing object sha") from exc
 
-    ref_resp = requests.get(ref_url, headers=headers, timeout=30)
-    if ref_resp.status_code != 200:
-        raise GitHubTreeRetrievalError(f"Failed to fetch branch ref: {ref_resp.status_code} {ref_resp.text}")
+async def _get_branch_ref(owner: str, repo_name: str, branch: str, access_token: str) -> dict:
+    """The `object` of the branch ref.
 
-    ref_json = ref_resp.json()
+    The ref is the only mutable response; it is revalidated with its ETag so
+    an unchanged branch costs a single 304 that does not count against the
+    rate limit.
+    """
+    ref_url = f"/repos/{owner}/{repo_name}/git/refs/heads/{branch}"
+    ref_json = await _get_json(ref_url, access_token, what="branch ref")
     if isinstance(ref_json, list):  # GitHub can return an array if wildcard used
         ref_json = ref_json[0]
     try:
-        object_url = ref_json["object"]["url"]
+        return ref_json["object"]
     except KeyError as exc:
         raise GitHubTreeRetrievalError(f"Unexpected ref JSON structure: {ref_json}") from exc
 
-    # 2) get the tree URL from the commit object
-    obj_resp = requests.get(object_url, headers=headers, timeout=30)
-    if obj_resp.status_code != 200:
-        raise GitHubTreeRetrievalError(f"Failed to fetch commit object: {obj_resp.status_code} {obj_resp.text}")
-    try:
-        tree_url = obj_resp.json()["tree"]["url"]
-    except KeyError as exc:
-        raise GitHubTreeRetrievalError("Commit JSON missing tree URL") from exc
+def get_known_branch_head(owner: str, repo_name: str, branch: str, access_token: str) -> tuple[str, str] | None:
+    """Return the (commit sha, tree sha) of a branch head seen recently by get_repo_tree."""
+    head = _branch_heads.get(_head_key(owner, repo_name, branch, access_token))
+    if head is None or time.monotonic() - head[2] > BRANCH_HEAD_MAX_AGE:
+        return None
+    return head[0], head[1]
 
-    # 3) fetch the full tree recursively
-    tree_resp = requests.get(f"{tree_url}?recursive=1", headers=headers, timeout=60)
-    
-    if tree_resp.status_code != 200:
-        raise GitHubTreeRetrievalError(f"Failed to fetch tree: {tree_resp.status_code} {tree_resp.text}")
+def _head_key(owner: str, repo_name: str, branch: str, access_token: str) -> tuple:
+    return (owner.lower(), repo_name.lower(), branch, token_fingerprint(access_token))
+
+async def _get_json(url: str, access_token: str, what: str, immutable: bool = False, timeout: int = 30):
+    """GET a GitHub API URL, reusing the cached response when it is still valid.
 
-    flat_items = tree_resp.json().get("tree", [])
-    return build_tree_from_flat_list(flat_items)
+    Responses for SHA-addressed (immutable) URLs are served from the cache
+    without a request; everything else is revalidated with If-None-Match.
+    """
+    cache_key = (url, token_fingerprint(access_token))
+    cached = _response_cache.get(cache_key)
+    if cached is not None and immutable:
+        return cached[1]
+
+    headers = {}
+    if cached is not None and cached[0]:
+        headers["If-None-Match"] = cached[0]
+
+    resp = await github.aget(url, access_token, headers=headers, timeout=timeout)
+    if resp.status_code == 304 and cached is not None:
+        return cached[1]
+    if resp.status_code != 200:
+        raise GitHubTreeRetrievalError(f"Failed to fetch {what}: {resp.status_code} {resp.text}")
+
+    data = resp.json()
+    _response_cache.set(cache_key, (resp.headers.get("ETag"), data, len(resp.content)))
+    return data
+
+def _copy_tree(nodes: List[Dict]) -> List[Dict]:
+    """A copy of a built tree that shares nothing mutable with it.
+
+    The memoized tree is shared by every job listing the same tree SHA, so a
+    caller that edits its result must not change what the next one gets.
+    Nodes only hold strings besides `children`, so copying node by node is
+    enough, and much cheaper than `copy.deepcopy`.
+    """
+    return [{**node, 'children': _copy_tree(node['children'])} if 'children' in node else dict(node)
+            for node in nodes]
 
 def build_tree_from_flat_list(flat_items: List[Dict]) -> List[Dict]:
     ignored_folders = {'node_modules', '.git', 'dist', 'build', 'coverage'}
@@ -1,70 +1,43 @@
-import requests
+import asyncio
+import os
 import uuid
 from models import Repo
+from github_client import github
+from metrics import timed
+from tools.get_repo_tree import get_known_branch_head
 
-def submit_pull_request(repo: Repo, access_token: str, new_file_contents: dict, pr_description: str):
-    branch_name = repo.default_branch
+# Files up to this size are sent inline in the create-tree request instead of
+# as separate blobs.
+PR_INLINE_MAX_BYTES = int(os.getenv("PR_INLINE_MAX_BYTES", str(256 * 1024)))
+PR_BLOB_CONCURRENCY = int(os.getenv("PR_BLOB_CONCURRENCY", "8"))
 
-    # Get latest commit SHA of the main branch
-    branch_resp = requests.get(
-        f"https://api.github.com/repos/{repo.owner.login}/{repo.name}/git/ref/heads/{branch_name}",
-        headers={"Authorization": f"Bearer {access_token}"}
-    )
-    if branch_resp.status_code != 200:
-        raise Exception(f"Failed to get branch: {branch_resp.status_code} {branch_resp.text}")
-    commit_sha = branch_resp.json()['object']['sha']
+@timed("submit_pull_request")
+async def submit_pull_request(repo: Repo, access_token: str, new_file_contents: list[tuple[str, str]], pr_description: str):
+    """
+    Commits the new file contents on a fresh branch and opens a pull request.
 
-    # Create a new branch
-    branch_name = f"ticketAgent-{uuid.uuid4()}"
-    create_branch_resp = requests.post(
-        f"https://api.github.com/repos/{repo.owner.login}/{repo.name}/git/refs",
-        headers={"Authorization": f"Bearer {access_token}"},
-        json={
-            "ref": f"refs/heads/{branch_name}",
-            "sha": commit_sha
-        }
-    )
-    if create_branch_resp.status_code != 201:
-        raise Exception(f"Failed to create branch: {create_branch_resp.status_code} {create_branch_resp.text}")
-
-    # Create blobs from the new file contents
-    blobs = {}
-    for path, content in new_file_contents:
-        blob_resp = requests.post(
-            f"https://api.github.com/repos/{repo.owner.login}/{repo.name}/git/blobs",
-            headers={"Authorization": f"Bearer {access_token}"},
-            json={
-                "content": content,
-                "encoding": "utf-8"
-            }
-        )
-        if blob_resp.status_code != 201:
-            raise Exception(f"Failed to create blob: {blob_resp.status_code} {blob_resp.text}")
-        blobs[path] = blob_resp.json()["sha"]
-
-    # Get base tree SHA
-    base_tree_resp = requests.get(
-        f"https://api.github.com/repos/{repo.owner.login}/{repo.name}/git/commits/{commit_sha}",
-        headers={"Authorization": f"Bearer {access_token}"}
-    )
-    if base_tree_resp.status_code != 200:
-        raise Exception(f"Failed to get base tree: {base_tree_resp.status_code} {base_tree_resp.text}")
-    base_tree_sha = base_tree_resp.json()["tree"]["sha"]
+    Takes 4 API calls when the base branch head is already known from
+    get_repo_tree (create tree, create commit, create branch, create PR), plus
+    one to look the head up otherwise and one per file too large to inline.
+    """
+    repo_path = f"/repos/{repo.owner.login}/{repo.name}"
+    base_branch = repo.default_branch
 
-    # Create a tree from the blobs
-    tree_items = [
-        {
-            "path": path,
-            "mode": "100644",
-            "type": "blob",
-            "sha": blob_sha
-        }
-        for path, blob_sha in blobs.items()
-    ]
+    # Latest commit and tree SHA of the base branch
+    head = get_known_branch_head(repo.owner.login, repo.name, base_branch, access_token)
+    if head is None:
+        branch_resp = await github.aget(f"{repo_path}/branches/{base_branch}", access_token)
+        if branch_resp.status_code != 200:
+            raise Exception(f"Failed to get branch: {branch_resp.status_code} {branch_resp.text}")
+        branch_commit = branch_resp.json()["commit"]
+        head = (branch_commit["sha"], branch_commit["commit"]["tree"]["sha"])
+    commit_sha, base_tree_sha = head
 
-    tree_resp = requests.post(
-        f"https://api.github.com/repos/{repo.owner.login}/{repo.name}/git/trees",
-        headers={"Authorization": f"Bearer {access_token}"},
+    # Create a tree, inlining small files and uploading the rest as blobs in parallel
+    tree_items = await _build_tree_items(repo_path, access_token, new_file_contents)
+    tree_resp = await github.apost(
+        f"{repo_path}/git/trees",
+        access_token,
         json={
             "base_tree": base_tree_sha,
             "tree": tree_items
@@ -75,9 +48,9 @@ def submit_pull_request(repo: Repo, access_token: str, new_file_contents: dict,
     tree_sha = tree_resp.json()["sha"]
 
     # Create a commit
-    commit_resp = requests.post(
-        f"https://api.github.com/repos/{repo.owner.login}/{repo.name}/git/commits",
-        headers={"Authorization": f"Bearer {access_token}"},
+    commit_resp = await github.apost(
+        f"{repo_path}/git/commits",
+        access_token,
         json={
             "message": "Automated commit from agent",
             "tree": tree_sha,
@@ -88,23 +61,27 @@ def submit_pull_request(repo: Repo, access_token: str, new_file_contents: dict,
         raise Exception(f"Failed to create commit: {commit_resp.status_code} {commit_resp.text}")
     new_commit_sha = commit_resp.json()["sha"]
 
-    # Update the reference to point to new commit
-    update_ref_resp = requests.patch(
-        f"https://api.github.com/repos/{repo.owner.login}/{repo.name}/git/refs/heads/{branch_name}",
-        headers={"Authorization": f"Bearer {access_token}"},
-        json={"sha": new_commit_sha}
+    # Create the branch directly at the new commit
+    branch_name = f"ticketAgent-{uuid.uuid4()}"
+    create_branch_resp = await github.apost(
+        f"{repo_path}/git/refs",
+        access_token,
+        json={
+            "ref": f"refs/heads/{branch_name}",
+            "sha": new_commit_sha
+        }
     )
-    if update_ref_resp.status_code != 200:
-        raise Exception(f"Failed to update ref: {update_ref_resp.status_code} {update_ref_resp.text}")
+    if create_branch_resp.status_code != 201:
+        raise Exception(f"Failed to create branch: {create_branch_resp.status_code} {create_branch_resp.text}")
 
     # Create a pull request
-    pr_resp = requests.post(
-        f"https://api.github.com/repos/{repo.owner.login}/{repo.name}/pulls",
-        headers={"Authorization": f"Bearer {access_token}"},
+    pr_resp = await github.apost(
+        f"{repo_path}/pulls",
+        access_token,
         json={
             "title": pr_description,
             "head": branch_name,
-            "base": repo.default_branch,
+            "base": base_branch,
             "body": "This PR was created automatically by the agent. Please review and merge."
         }
     )
@@ -113,4 +90,31 @@ def submit_pull_request(repo: Repo, access_token: str, new_file_contents: dict,
 
     pr_url = pr_resp.json()["html_url"]
 
-    return pr_url
\ No newline at end of file
+    return pr_url
+
+async def _build_tree_items(repo_path: str, access_token: str, new_file_contents: list[tuple[str, str]]) -> list:
+    semaphore = asyncio.Semaphore(PR_BLOB_CONCURRENCY)
+
+    async def create_blob(content: str) -> str:
+        async with semaphore:
+            blob_resp = await github.apost(
+                f"{repo_path}/git/blobs",
+                access_token,
+                json={
+                    "content": content,
+                    "encoding": "utf-8"
+                }
+            )
+        if blob_resp.status_code != 201:
+            raise Exception(f"Failed to create blob: {blob_resp.status_code} {blob_resp.text}")
+        return blob_resp.json()["sha"]
+
+    async def tree_item(path: str, content: str) -> dict:
+        item = {"path": path, "mode": "100644", "type": "blob"}
+        if len(content.encode("utf-8")) <= PR_INLINE_MAX_BYTES:
+            item["content"] = content
+        else:
+            item["sha"] = await create_blob(content)
+        return item
+
+    return list(await asyncio.gather(*(tree_item(path, content) for path, content in new_file_contents)))
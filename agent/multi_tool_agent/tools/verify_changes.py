@@ -1,6 +1,12 @@
-from tree_sitter_language_pack import get_parser
 from tree_sitter import Node
+from parse_cache import parse_cache
 from typing import Optional, List, Tuple
+from tools.apply_code_changes import TextEdit
+from metrics import timed
+from cpu_pool import map_cpu_bound
+
+# (code, lang_name, base, edits), the arguments of verify_changes
+VerifyRequest = Tuple[str, str, Optional[str], Optional[List[TextEdit]]]
 
 def verify_code_changes(new_file_contents: List[Tuple[str,str]]) -> tuple[bool, str]:
     for file_path, file_content in new_file_contents:
@@ -9,9 +15,15 @@ def verify_code_changes(new_file_contents: List[Tuple[str,str]]) -> tuple[bool,
             return False, error_message
     return True, ""
 
-def verify_changes(code: str, lang_name: str) -> tuple[bool, str]:
-    parser = get_parser(lang_name)
-    tree = parser.parse(code.encode('utf-8'))
+@timed("verify_changes")
+def verify_changes(code: str, lang_name: str, base: str | None = None, edits: List[TextEdit] | None = None) -> tuple[bool, str]:
+    """
+    Checks that `code` parses without errors.
+    `base` is the source the code was edited from; passing it lets the parse
+    reuse the cached tree of the original file incrementally. `edits` is the
+    edit map apply_code_changes_with_edits produced for it, if any.
+    """
+    tree = parse_cache.parse(code, lang_name, base=base, edits=edits)
 
     if not tree.root_node.has_error:
         return True, ""
@@ -19,6 +31,15 @@ def verify_changes(code: str, lang_name: str) -> tuple[bool, str]:
     error_node = find_error_node(tree.root_node)
     return False, f"line {error_node.start_point[0]+1}:{error_node.start_point[1]+1}"
 
+def verify_files(requests: List[VerifyRequest]) -> List[Tuple[bool, str]]:
+    """verify_changes for each request; module-level so the CPU pool can run it."""
+    return [verify_changes(*request) for request in requests]
+
+async def averify_files(requests: List[VerifyRequest]) -> List[Tuple[bool, str]]:
+    """verify_files with large files (or many small ones) run in the CPU pool."""
+    return await map_cpu_bound("verify_changes", verify_files, requests,
+                               sizeof=lambda request: len(request[0]) + len(request[2] or ""))
+
 def find_error_node(node: Node) -> Optional[Node]:
     """Depth-first search for the left-most error node."""
     if node.has_error:
@@ -0,0 +1,56 @@
+"""
+Standalone queue worker: consumes the agent queue without FastAPI or a socket.io
+server, and reaches clients by publishing events through Redis to the API
+processes that hold their connections.
+
+Run any number of these next to the API tier (started with
+AGENT_INLINE_WORKER=false):
+
+    python worker.py [--concurrency N]
+
+Metrics are served on WORKER_METRICS_PORT (0 disables).
+"""
+import argparse
+import asyncio
+import os
+import time
+
+WORKER_METRICS_PORT = int(os.getenv("WORKER_METRICS_PORT", "9100"))
+
+
+# Importing this module must stay free of side effects: CPU pool processes
+# are started with spawn, which re-imports the parent's __main__ module in
+# each of them. Everything else is imported in main().
+def main():
+    import_started = time.perf_counter()
+    from dotenv import load_dotenv
+    from prometheus_client import start_http_server
+
+    load_dotenv()
+
+    import socket_client
+    import cpu_pool
+    import parsers
+    from metrics import report_import_time
+    from start_agent_queue import AGENT_WORKER_CONCURRENCY, start_agent_queue
+
+    report_import_time("worker", import_started)
+
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument("--concurrency", type=int, default=AGENT_WORKER_CONCURRENCY)
+    args = arg_parser.parse_args()
+
+    socket_client.use_write_only_emitter()
+    # Load the grammars now rather than in the first job.
+    parsers.warm_up()
+    if WORKER_METRICS_PORT:
+        start_http_server(WORKER_METRICS_PORT)
+        print(f"Worker metrics on :{WORKER_METRICS_PORT}/metrics")
+    try:
+        asyncio.run(start_agent_queue(args.concurrency))
+    finally:
+        cpu_pool.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,44 @@
+"""
+Shared test setup: the agent modules on sys.path, and Redis replaced by an
+in-memory fakeredis server (with Lua, for the queue and dedup scripts).
+
+The fake clients are installed before any agent module is imported, since
+modules bind `redis_client.async_redis_client` and register their scripts
+at import. Tests that touch Redis take the `redis` fixture, which skips them
+when fakeredis is not installed and empties the server first.
+"""
+import asyncio
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+AGENT_DIR = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(AGENT_DIR / "multi_tool_agent"))
+sys.path.insert(0, str(AGENT_DIR / "benchmarks"))
+
+# Keep socket.io state in process; the tests have no Redis pub/sub.
+os.environ.setdefault("SOCKETIO_USE_REDIS", "false")
+
+try:
+    import fakeredis
+except ImportError:
+    fakeredis = None
+
+if fakeredis is not None:
+    import redis_client
+
+    _server = fakeredis.FakeServer()
+    redis_client.redis_client = fakeredis.FakeRedis(server=_server, decode_responses=True)
+    redis_client.async_redis_client = fakeredis.FakeAsyncRedis(server=_server, decode_responses=True)
+
+
+@pytest.fixture
+def redis():
+    """The fake async Redis client the agent modules use, emptied."""
+    if fakeredis is None:
+        pytest.skip("fakeredis[lua] is not installed")
+    import redis_client
+    asyncio.run(redis_client.async_redis_client.flushall())
+    return redis_client.async_redis_client
@@ -0,0 +1,64 @@
+import React, { useEffect, useState } from 'react';
+import { fetchItems } from './api';
+
+const PAGE_SIZE = 20;
+let counter = 0, other = 1;
+var legacy;
+
+export default function WidgetList({ title, onSelect }) {
+  const [items, setItems] = useState([]);
+  const [{ page }, setState] = useState({ page: 0 });
+
+  useEffect(() => {
+    fetchItems(page, PAGE_SIZE).then((result) => setItems(result));
+  }, [page]);
+
+  const handleClick = (item) => {
+    counter += 1;
+    onSelect(item);
+  };
+
+  return (
+    <section className="widgets">
+      <Header title={title} />
+      <ul>
+        {items.map((item) => (
+          <li key={item.id} onClick={() => handleClick(item)}>
+            <Item.Label text={item.name} />
+            <span>{item.count}</span>
+          </li>
+        ))}
+      </ul>
+      <>
+        <button onClick={() => setState({ page: page + 1 })}>More</button>
+      </>
+    </section>
+  );
+}
+
+export const Header = ({ title }) => <h1>{title}</h1>;
+
+export class Store extends Base {
+  static instance = null;
+
+  constructor(items) {
+    super();
+    this.items = items;
+  }
+
+  get size() {
+    return this.items.length;
+  }
+
+  async load() {
+    const result = await fetchItems(0, PAGE_SIZE);
+    this.items = result.filter(function keep(item) {
+      return item.visible;
+    });
+  }
+}
+
+function* ids() {
+  let id = 0;
+  while (true) yield id++;
+}
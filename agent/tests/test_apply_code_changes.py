@@ -0,0 +1,117 @@
+"""
+The Coder's line-range edits: several edits to one file are applied against
+the original line numbers, bad ranges are rejected instead of stacked, and
+line endings are kept. The edit map must describe exactly what changed.
+"""
+import json
+
+import pytest
+
+from tools.apply_code_changes import CoderChange, apply_code_changes_with_edits, edit_lines
+
+ORIGINAL = "".join(f"line {n}\n" for n in range(1, 11))
+
+
+def change(start: int | None, end: int | None, new_code: str, file_path: str = "src/App.jsx") -> CoderChange:
+    return CoderChange(is_new_file=False, file_path=file_path, start_line=start, end_line=end, new_code=new_code)
+
+
+def assert_edits_describe(original: str, new: str, edits):
+    """Replaying the edits bottom-up on the original bytes gives the new content."""
+    assert [edit.start_byte for edit in edits] == sorted((edit.start_byte for edit in edits), reverse=True)
+    content, new_bytes = original.encode("utf8"), new.encode("utf8")
+    for index, edit in enumerate(edits):
+        # In the new content, a block moves by what the edits above it (later in the list) added.
+        shift = sum(above.new_end_byte - above.old_end_byte for above in edits[index + 1:])
+        replacement = new_bytes[edit.start_byte + shift:edit.new_end_byte + shift]
+        content = content[:edit.start_byte] + replacement + content[edit.old_end_byte:]
+    assert content == new_bytes
+
+
+def test_edits_use_the_original_line_numbers():
+    # Given out of order, and the first one changes the line count.
+    changes = [change(8, 8, "eight\n"), change(2, 3, "two\nand a half\nthree\n"), change(5, 5, "")]
+    new, edits, rejected = edit_lines(ORIGINAL, changes)
+    assert new.splitlines() == ["line 1", "two", "and a half", "three", "line 4", "line 6", "line 7",
+                                "eight", "line 9", "line 10"]
+    assert new.endswith("\n")
+    assert rejected == []
+    assert len(edits) == 3
+    assert_edits_describe(ORIGINAL, new, edits)
+
+
+def test_edit_points_are_rows_and_columns_in_the_original():
+    new, edits, _ = edit_lines(ORIGINAL, [change(2, 3, "two\nthree\nfour\n"), change(9, 9, "nine")])
+    bottom, top = edits
+    assert (bottom.start_point, bottom.old_end_point, bottom.new_end_point) == ((8, 0), (9, 0), (9, 0))
+    assert (top.start_point, top.old_end_point, top.new_end_point) == ((1, 0), (3, 0), (4, 0))
+    assert top.start_byte == len("line 1\n")
+
+
+@pytest.mark.parametrize("start, end, reason", [
+    (0, 1, "lines 0-1 are outside the file's 1-10"),
+    (10, 11, "lines 10-11 are outside the file's 1-10"),
+    (4, 3, "lines 4-3 are outside the file's 1-10"),
+    (None, 2, "lines None-2 are outside the file's 1-10"),
+])
+def test_out_of_range_changes_are_rejected(start, end, reason):
+    new, edits, rejected = edit_lines(ORIGINAL, [change(start, end, "x\n"), change(1, 1, "one\n")])
+    assert rejected == [reason]
+    assert new == ORIGINAL.replace("line 1\n", "one\n", 1)
+    assert len(edits) == 1
+
+
+def test_overlapping_changes_are_rejected():
+    changes = [change(3, 5, "first\n"), change(5, 6, "second\n"), change(1, 3, "third\n"), change(6, 6, "fourth\n")]
+    new, edits, rejected = edit_lines(ORIGINAL, changes)
+    assert rejected == ["lines 5-6 overlap the change to lines 3-5", "lines 1-3 overlap the change to lines 3-5"]
+    # The first change is kept, and a later one that overlaps only a rejected change is kept too.
+    assert new.splitlines() == ["line 1", "line 2", "first", "fourth", "line 7", "line 8", "line 9", "line 10"]
+    assert_edits_describe(ORIGINAL, new, edits)
+
+
+def test_crlf_file_keeps_its_line_endings():
+    original = ORIGINAL.replace("\n", "\r\n")
+    new, edits, rejected = edit_lines(original, [change(2, 2, "two\nand more\n"), change(9, 10, "end\r\n")])
+    assert rejected == []
+    assert new == original.replace("line 2\r\n", "two\r\nand more\r\n").replace("line 9\r\nline 10\r\n", "end\r\n")
+    assert "\n" not in new.replace("\r\n", "")
+    assert_edits_describe(original, new, edits)
+
+
+def test_file_without_trailing_newline_stays_unterminated():
+    original = ORIGINAL.rstrip("\n")
+    new, edits, _ = edit_lines(original, [change(10, 10, "last\n"), change(1, 1, "first\n")])
+    assert new == original.replace("line 1", "first", 1).replace("line 10", "last")
+    assert_edits_describe(original, new, edits)
+    # The replaced last line has no line break to end at.
+    assert edits[0].old_end_point == (9, len("line 10"))
+
+
+def test_deleting_the_unterminated_last_lines_drops_the_line_break_before_them():
+    original = ORIGINAL.rstrip("\n")
+    new, edits, _ = edit_lines(original, [change(9, 10, "")])
+    assert new == "".join(f"line {n}\n" for n in range(1, 9)).rstrip("\n")
+    assert edits is None
+
+
+def test_apply_reports_edits_and_rejections_per_file():
+    response = json.dumps({"pr_description": "Rename", "changes": [
+        change(1, 1, "one\n").model_dump(),
+        change(1, 2, "clash\n").model_dump(),
+        change(1, 1, "other\n", file_path="src/Other.jsx").model_dump(),
+        {"is_new_file": True, "file_path": "src/New.jsx", "new_code": "export {};\n"},
+        change(1, 1, "missing\n", file_path="src/Missing.jsx").model_dump(),
+    ]})
+    originals = [("src/App.jsx", ORIGINAL), ("src/Other.jsx", "a\nb\n")]
+    description, files, file_edits = apply_code_changes_with_edits(response, originals)
+
+    assert description == "Rename"
+    assert dict(files) == {"src/App.jsx": ORIGINAL.replace("line 1", "one", 1), "src/Other.jsx": "other\nb\n",
+                           "src/New.jsx": "export {};\n"}
+    assert file_edits["src/App.jsx"].rejected == ["lines 1-2 overlap the change to lines 1-1"]
+    assert len(file_edits["src/App.jsx"].edits) == 1
+    assert file_edits["src/Other.jsx"].rejected == []
+    # A created file has no edit map against an original.
+    assert file_edits["src/New.jsx"].edits is None
+    assert "src/Missing.jsx" not in file_edits
@@ -0,0 +1,109 @@
+"""
+The file contents cache: the byte-bounded LRU it is built on, the path index
+scoped to the token that listed the tree, and the Redis tier, which
+FILE_CACHE_REDIS_TTL=0 turns off.
+"""
+import asyncio
+import base64
+
+import httpx
+import pytest
+
+import tools.get_file_content as get_file_content_module
+from cache import LRUCache, token_fingerprint
+from file_cache import REDIS_KEY_PREFIX, FileCache
+from redis_client import redis_client
+
+TREE = [{"path": "src/App.jsx", "type": "blob", "sha": "sha-app"}, {"path": "src", "type": "tree", "sha": "sha-src"}]
+
+
+def test_lru_evicts_least_recently_used_to_fit_max_bytes():
+    cache = LRUCache(max_bytes=10, sizeof=len)
+    cache.set("a", "aaaa")
+    cache.set("b", "bbbb")
+    assert cache.get("a") == "aaaa"
+    cache.set("c", "cccc")
+    assert "b" not in cache
+    assert (cache.get("a"), cache.get("c"), cache.total_bytes) == ("aaaa", "cccc", 8)
+
+    # Replacing a value re-weighs it and makes it the most recently used.
+    cache.set("a", "a")
+    assert cache.total_bytes == 5
+    cache.set("d", "dddddd")
+    assert ("a" in cache, "c" in cache, "d" in cache, cache.total_bytes) == (True, False, True, 7)
+
+
+def test_lru_does_not_cache_values_over_max_bytes():
+    cache = LRUCache(max_bytes=10, sizeof=len)
+    cache.set("a", "aaaa")
+    cache.set("big", "x" * 11)
+    cache.set("a", "y" * 11)
+    assert len(cache) == 0 and cache.total_bytes == 0
+
+
+def test_lru_max_entries():
+    cache = LRUCache(max_entries=2)
+    for key in "abc":
+        cache.set(key, key)
+    assert ("a" in cache, "b" in cache, "c" in cache) == (False, True, True)
+    assert cache.pop("b") == "b" and cache.total_bytes == 0
+
+
+def test_path_index_is_scoped_to_the_listing_token():
+    cache = FileCache(redis_ttl=0)
+    cache.index_tree("Acme", "App", "token-a", TREE)
+    assert cache.sha_for_path("acme", "app", "token-a", "src/App.jsx") == "sha-app"
+    assert cache.sha_for_path("acme", "app", "token-a", "src") is None
+    assert cache.sha_for_path("acme", "app", "token-b", "src/App.jsx") is None
+    assert token_fingerprint("token-a") != token_fingerprint("token-b")
+    assert "token-a" not in token_fingerprint("token-a")
+
+
+def test_cached_file_is_only_served_to_the_listing_token(monkeypatch):
+    requests = []
+
+    class FakeGitHub:
+        async def aget(self, url, access_token, **kwargs):
+            requests.append((url, access_token))
+            content = base64.b64encode(b"export default App;\n").decode()
+            return httpx.Response(200, json={"content": content, "sha": "sha-app"})
+
+    cache = FileCache(redis_ttl=0)
+    cache.index_tree("acme", "app", "token-a", TREE)
+    cache.set("sha-app", "cached App")
+    monkeypatch.setattr(get_file_content_module, "file_cache", cache)
+    monkeypatch.setattr(get_file_content_module, "github", FakeGitHub())
+
+    async def read(access_token):
+        return await get_file_content_module.get_file_content("acme", "app", "src/App.jsx", access_token)
+
+    assert asyncio.run(read("token-a")) == "cached App"
+    assert requests == []
+    assert asyncio.run(read("token-b")) == "export default App;\n"
+    assert requests == [("/repos/acme/app/contents/src/App.jsx", "token-b")]
+
+
+@pytest.fixture
+def flushed(redis):
+    redis_client.flushall()
+    return redis
+
+
+def test_redis_tier_is_shared_between_processes(flushed):
+    FileCache(redis_ttl=60).set("sha-1", "content")
+    assert 0 < redis_client.ttl(REDIS_KEY_PREFIX + "sha-1") <= 60
+    # A fresh in-process tier, as in another worker.
+    assert FileCache(redis_ttl=60).get("sha-1") == "content"
+    assert asyncio.run(FileCache(redis_ttl=60).aget("sha-1")) == "content"
+
+
+def test_zero_ttl_bypasses_redis(flushed):
+    cache = FileCache(redis_ttl=0)
+    cache.set("sha-1", "content")
+    asyncio.run(cache.aset("sha-2", "content"))
+    assert redis_client.keys("*") == []
+    assert (cache.get("sha-1"), asyncio.run(cache.aget("sha-2"))) == ("content", "content")
+
+    redis_client.set(REDIS_KEY_PREFIX + "sha-3", "from redis")
+    assert FileCache(redis_ttl=0).get("sha-3") is None
+    assert asyncio.run(FileCache(redis_ttl=0).aget("sha-3")) is None
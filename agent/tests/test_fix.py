@@ -0,0 +1,93 @@
+"""
+Fanned-out generation: the concurrent group calls together stay within the
+job's token budget, even when each uses everything it is allowed.
+"""
+import asyncio
+import json
+
+import pytest
+
+from fix import _generate_fanned_out, group_related_files
+from llm_models.model import AgentResponse, Model
+from llm_models.tokens import (
+    JOB_MAX_INPUT_TOKENS, JOB_MAX_OUTPUT_TOKENS, TokenBudget, TokenBudgetExceeded, estimate_tokens,
+)
+
+# What a provider produces when no output cap is sent.
+MODEL_MAX_OUTPUT = 20_000
+
+
+class GreedyModel(Model):
+    """Uses the whole input estimate and every output token it is allowed, after all groups have started."""
+
+    provider = "gpt"
+
+    def __init__(self):
+        super().__init__("greedy")
+        self.outputs = []
+
+    async def agenerate_content(self, user_prompt, analyst_response, budget=None, on_text=None):
+        prompt = self.get_fix_prompt(user_prompt, analyst_response)
+        estimated = budget.check_input(self.provider, prompt)
+        cap = budget.output_cap()
+        await asyncio.sleep(0.01)
+        output = cap if cap is not None else MODEL_MAX_OUTPUT
+        budget.record(self.provider, self.name, prompt, estimated, output)
+        self.outputs.append(output)
+        return json.dumps({"pr_description": "Update widgets", "changes": []})
+
+
+def component(name: str) -> str:
+    return "\n".join([f"export function {name}() {{", f"  return <div className=\"{name}\">{name}</div>;", "}", ""] * 20)
+
+
+def analyst_response() -> AgentResponse:
+    files = [(f"src/{name}.jsx", component(name)) for name in ("Header", "Footer", "Sidebar", "Card")]
+    return AgentResponse(plan="Add a data-testid to every component.", file_contents=files)
+
+
+def fan_out(model: Model, budget: TokenBudget):
+    response = analyst_response()
+    groups = group_related_files(response.file_contents)
+    assert len(groups) == 4
+    return asyncio.run(_generate_fanned_out("Add test ids", response, groups, model, budget))
+
+
+def test_group_calls_share_the_output_budget():
+    model, budget = GreedyModel(), TokenBudget(JOB_MAX_INPUT_TOKENS, JOB_MAX_OUTPUT_TOKENS)
+    assert fan_out(model, budget) is not None
+    assert len(model.outputs) == 4
+    # Uncapped, four calls would have used 4 x MODEL_MAX_OUTPUT.
+    assert 4 * MODEL_MAX_OUTPUT > JOB_MAX_OUTPUT_TOKENS
+    assert budget.output_tokens == sum(model.outputs) <= JOB_MAX_OUTPUT_TOKENS
+    assert budget.input_tokens <= JOB_MAX_INPUT_TOKENS
+    assert len(budget.calls) == 4
+
+
+def test_group_calls_share_the_input_budget():
+    model = GreedyModel()
+    response = analyst_response()
+    prompts = [model.get_fix_prompt("Add test ids", response.model_copy(update={"file_contents": group}))
+               for group in group_related_files(response.file_contents)]
+    estimates = [estimate_tokens(prompt, model.provider) for prompt in prompts]
+    # Each prompt fits on its own, all four together do not.
+    budget = TokenBudget(max_input_tokens=int(sum(estimates) * 0.75), max_output_tokens=JOB_MAX_OUTPUT_TOKENS)
+    assert max(estimates) < budget.max_input_tokens
+
+    with pytest.raises(TokenBudgetExceeded):
+        fan_out(model, budget)
+    assert budget.input_tokens <= budget.max_input_tokens
+
+
+def test_split_shares_fit_the_remaining_budget():
+    budget = TokenBudget(max_input_tokens=1000, max_output_tokens=100)
+    budget.record("gpt", "model", "", 400, 40)
+    shares = budget.split([1, 2, 3])
+    assert sum(share.max_input_tokens for share in shares) <= 600
+    assert sum(share.max_output_tokens for share in shares) <= 60
+    assert [share.max_output_tokens for share in shares] == [10, 20, 30]
+
+    shares[2].record("gpt", "model", "", 100, 5)
+    assert (shares[2].input_tokens, shares[2].remaining_output_tokens) == (100, 25)
+    assert (budget.input_tokens, budget.output_tokens, len(budget.calls)) == (500, 45, 2)
+    assert shares[2].output_cap() == 25
@@ -0,0 +1,106 @@
+"""
+get_repo_tree against a fake GitHub: an unchanged branch costs one
+revalidated ref request, a moved branch is followed, responses are not
+shared between tokens, and every caller gets its own copy of the tree.
+"""
+import asyncio
+
+import httpx
+import pytest
+
+import tools.get_repo_tree as get_repo_tree_module
+from file_cache import file_cache
+from tools.get_repo_tree import get_known_branch_head, get_repo_tree
+
+REF_URL = "/repos/acme/app/git/refs/heads/main"
+FLAT_TREE = [
+    {"path": "src", "type": "tree", "sha": "s1", "url": "u"},
+    {"path": "src/App.jsx", "type": "blob", "sha": "s2", "url": "u"},
+    {"path": "node_modules/react/index.js", "type": "blob", "sha": "s3", "url": "u"},
+]
+
+
+class FakeGitHub:
+    """Serves one branch whose head can be moved; the ref honours If-None-Match."""
+
+    def __init__(self):
+        self.head = "c1"
+        self.requests = []
+
+    async def aget(self, url, access_token, headers=None, timeout=None):
+        self.requests.append((url, (headers or {}).get("If-None-Match")))
+        if url == REF_URL:
+            etag = f'"ref-{self.head}"'
+            if (headers or {}).get("If-None-Match") == etag:
+                return httpx.Response(304)
+            ref = {"object": {"sha": self.head, "url": f"/repos/acme/app/git/commits/{self.head}"}}
+            return httpx.Response(200, json=ref, headers={"ETag": etag})
+        if url.startswith("/repos/acme/app/git/commits/"):
+            sha = url.rsplit("/", 1)[1]
+            commit = {"sha": sha, "tree": {"sha": f"tree-{sha}", "url": f"/repos/acme/app/git/trees/tree-{sha}"}}
+            return httpx.Response(200, json=commit)
+        if url.startswith("/repos/acme/app/git/trees/"):
+            return httpx.Response(200, json={"tree": FLAT_TREE})
+        return httpx.Response(404, json={})
+
+
+@pytest.fixture
+def github(monkeypatch):
+    fake = FakeGitHub()
+    monkeypatch.setattr(get_repo_tree_module, "github", fake)
+    for cache in (get_repo_tree_module._response_cache, get_repo_tree_module._built_tree_cache,
+                  get_repo_tree_module._branch_heads):
+        cache.clear()
+    return fake
+
+
+def list_tree(access_token: str = "token-a"):
+    return asyncio.run(get_repo_tree("acme", "app", "main", access_token))
+
+
+def test_unchanged_branch_is_revalidated_with_one_request(github):
+    first = list_tree()
+    assert [url for url, _ in github.requests] == [
+        REF_URL, "/repos/acme/app/git/commits/c1", "/repos/acme/app/git/trees/tree-c1?recursive=1",
+    ]
+    assert [node["path"] for node in first] == ["src"]
+    assert file_cache.sha_for_path("acme", "app", "token-a", "src/App.jsx") == "s2"
+
+    github.requests.clear()
+    assert list_tree() == first
+    assert github.requests == [(REF_URL, '"ref-c1"')]
+    assert get_known_branch_head("acme", "app", "main", "token-a") == ("c1", "tree-c1")
+
+
+def test_moved_branch_is_followed(github):
+    list_tree()
+    github.head = "c2"
+    github.requests.clear()
+    list_tree()
+    assert github.requests == [
+        (REF_URL, '"ref-c1"'),
+        ("/repos/acme/app/git/commits/c2", None),
+        ("/repos/acme/app/git/trees/tree-c2?recursive=1", None),
+    ]
+    assert get_known_branch_head("acme", "app", "main", "token-a") == ("c2", "tree-c2")
+
+
+def test_cached_responses_are_not_shared_between_tokens(github):
+    list_tree("token-a")
+    github.requests.clear()
+    list_tree("token-b")
+    assert github.requests[0] == (REF_URL, None)
+    assert len(github.requests) == 3
+    assert get_known_branch_head("acme", "app", "main", "token-b") == ("c1", "tree-c1")
+
+
+def test_callers_get_their_own_copy_of_the_tree(github):
+    first = list_tree()
+    first[0]["children"].clear()
+    first[0]["name"] = "changed"
+    first.append({"name": "extra"})
+
+    second = list_tree()
+    assert [node["name"] for node in second] == ["src"]
+    assert [child["path"] for child in second[0]["children"]] == ["src/App.jsx"]
+    assert second[0]["children"] is not list_tree()[0]["children"]
@@ -0,0 +1,110 @@
+"""
+implement_changes' per-file retry state, driven by a scripted model: which
+files each attempt regenerates and from what content, which are sent as
+verified context, and what is finally submitted.
+"""
+import asyncio
+import json
+
+import pytest
+
+import main
+from llm_models.model import Model
+from models import Repo
+
+FILES = {"src/a.js": "const a = 1;\nexport default a;\n", "src/b.js": "const b = 2;\nexport default b;\n"}
+
+
+class ScriptedModel(Model):
+    """Answers each attempt with the next scripted response and records what it was asked to change."""
+
+    provider = "fake"
+
+    def __init__(self, responses: list[str]):
+        super().__init__("scripted")
+        self._responses = list(responses)
+        self.pending = []
+        self.context = []
+
+    async def agenerate_content(self, user_prompt, analyst_response, budget=None, on_text=None):
+        self.pending.append(dict(analyst_response.file_contents))
+        self.context.append(dict(analyst_response.context_files))
+        return self._responses.pop(0)
+
+
+def response(*changes: tuple[str, int, int, str]) -> str:
+    return json.dumps({"pr_description": "Update constants", "changes": [
+        {"is_new_file": False, "file_path": path, "start_line": start, "end_line": end, "new_code": code}
+        for path, start, end, code in changes
+    ]})
+
+
+@pytest.fixture
+def run(monkeypatch):
+    """Runs implement_changes on FILES with the scripted responses; returns (result, model, submitted files)."""
+    submitted = []
+
+    async def get_file_content(owner, repo_name, path, access_token):
+        return FILES[path]
+
+    async def submit_pull_request(repo, access_token, new_file_contents, pr_description):
+        submitted.append(dict(new_file_contents))
+        return "https://github.com/acme/app/pull/1"
+
+    monkeypatch.setattr(main, "get_file_content", get_file_content)
+    monkeypatch.setattr(main, "submit_pull_request", submit_pull_request)
+
+    def run_responses(*responses: str):
+        model = ScriptedModel(list(responses))
+        repo = Repo(id=1, name="app", full_name="acme/app", private=False, owner={"login": "acme", "id": 1},
+                    html_url="https://github.com/acme/app", default_branch="main")
+        tool = main.ImplementChangesTool(model=model, repo=repo, access_token="token", user_prompt="Update",
+                                         socket_id=None)
+        result = asyncio.run(tool.implement_changes("Change the constants", list(FILES)))
+        return result, model, submitted
+
+    return run_responses
+
+
+def test_file_with_a_rejected_edit_reverts_to_its_base(run):
+    partly_rejected = response(("src/a.js", 1, 1, "const a = 10;"),
+                               ("src/b.js", 1, 1, "const b = 20;"), ("src/b.js", 5, 6, "oops"))
+    result, model, submitted = run(partly_rejected, response(("src/b.js", 1, 1, "const b = 30;")))
+
+    assert result == "https://github.com/acme/app/pull/1"
+    # b.js is regenerated from its original content, without the edit that did apply.
+    assert model.pending[1] == {"src/b.js": FILES["src/b.js"]}
+    assert model.context[1] == {"src/a.js": "const a = 10;\nexport default a;\n"}
+    assert submitted == [{"src/a.js": "const a = 10;\nexport default a;\n",
+                          "src/b.js": "const b = 30;\nexport default b;\n"}]
+
+
+def test_file_without_a_change_stays_pending(run):
+    rejected = response(("src/a.js", 1, 1, "const a = 10;"), ("src/b.js", 5, 6, "oops"))
+    nothing = response()
+    result, model, submitted = run(rejected, nothing, nothing)
+
+    # Unchanged, b.js would parse; it is not verified because it still needs the planned change.
+    assert result == "Failed to implement and verify the changes after 3 attempts."
+    assert model.pending[1:] == [{"src/b.js": FILES["src/b.js"]}] * 2
+    assert submitted == []
+
+
+def test_file_is_submitted_once_a_later_attempt_changes_it(run):
+    rejected = response(("src/a.js", 1, 1, "const a = 10;"), ("src/b.js", 5, 6, "oops"))
+    result, model, submitted = run(rejected, response(), response(("src/b.js", 1, 1, "const b = 20;")))
+
+    assert result == "https://github.com/acme/app/pull/1"
+    assert len(model.pending) == 3
+    assert submitted[0]["src/b.js"] == "const b = 20;\nexport default b;\n"
+
+
+def test_file_failing_verification_is_retried_from_its_edited_content(run):
+    broken = response(("src/a.js", 1, 1, "const a = 10;"), ("src/b.js", 1, 1, "const b = (;"))
+    result, model, submitted = run(broken, response(("src/b.js", 1, 1, "const b = 20;")))
+
+    assert result == "https://github.com/acme/app/pull/1"
+    # The verification error refers to the edited content, so that is what is sent back.
+    assert model.pending[1] == {"src/b.js": "const b = (;\nexport default b;\n"}
+    assert model.context[1] == {"src/a.js": "const a = 10;\nexport default a;\n"}
+    assert submitted[0]["src/b.js"] == "const b = 20;\nexport default b;\n"
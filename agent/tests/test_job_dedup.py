@@ -0,0 +1,114 @@
+"""
+Job coalescing: keys are scoped to the requester's token, duplicates attach
+to the job in flight, and finishing hands them over and caches only PRs.
+"""
+import asyncio
+
+import pytest
+
+from job_dedup import INFLIGHT_KEY_PREFIX, RESULT_KEY_PREFIX, WAITERS_KEY_PREFIX, coalesce, finish, job_key
+
+
+def key_for(access_token: str, prompt: str = "Add a button") -> str:
+    return job_key(access_token, "Acme/App", "abc123", prompt, "gemini", "gemini-2.5-pro")
+
+
+def test_key_is_scoped_to_the_token():
+    assert key_for("token-a") == key_for("token-a")
+    assert key_for("token-a") != key_for("token-b")
+    assert "token-a" not in key_for("token-a")
+
+
+def test_key_ignores_prompt_whitespace_and_repo_case():
+    assert key_for("token", "Add a button") == key_for("token", "  Add a button\n")
+    assert job_key("token", "acme/app", "abc123", "p", "gemini", "m") == job_key("token", "Acme/App", "abc123", "p", "gemini", "m")
+
+
+def test_different_tokens_do_not_coalesce(redis):
+    async def scenario():
+        return (await coalesce(key_for("token-a"), "job-a", {"socket_id": "a"}),
+                await coalesce(key_for("token-b"), "job-b", {"socket_id": "b"}))
+
+    assert asyncio.run(scenario()) == (("claimed", None), ("claimed", None))
+
+
+def test_duplicate_attaches_to_job_in_flight(redis):
+    key = key_for("token")
+
+    async def scenario():
+        first = await coalesce(key, "job-1", {"socket_id": "first"})
+        second = await coalesce(key, "job-2", {"socket_id": "second"})
+        return first, second, await redis.get(INFLIGHT_KEY_PREFIX + key), await redis.llen(WAITERS_KEY_PREFIX + key)
+
+    assert asyncio.run(scenario()) == (("claimed", None), ("attached", None), "job-1", 1)
+
+
+def test_finish_drains_waiters_and_caches_pull_request(redis):
+    key = key_for("token")
+    result = {"pr_url": "https://github.com/acme/app/pull/1", "session": "session-1"}
+
+    async def scenario():
+        await coalesce(key, "job-1", {})
+        await coalesce(key, "job-2", {"socket_id": "second"})
+        await coalesce(key, "job-3", {"socket_id": "third"})
+        waiters = await finish(key, "job-1", result)
+        return waiters, await redis.exists(INFLIGHT_KEY_PREFIX + key, WAITERS_KEY_PREFIX + key), await coalesce(key, "job-4", {})
+
+    waiters, remaining, later = asyncio.run(scenario())
+    assert waiters == [{"socket_id": "second"}, {"socket_id": "third"}]
+    assert remaining == 0
+    assert later == ("cached", result)
+
+
+def test_finish_without_result_caches_nothing(redis):
+    key = key_for("token")
+
+    async def scenario():
+        await coalesce(key, "job-1", {})
+        await coalesce(key, "job-2", {"socket_id": "second"})
+        waiters = await finish(key, "job-1", None)
+        return waiters, await redis.exists(RESULT_KEY_PREFIX + key), await coalesce(key, "job-3", {})
+
+    assert asyncio.run(scenario()) == ([{"socket_id": "second"}], 0, ("claimed", None))
+
+
+def test_finish_keeps_a_claim_taken_by_another_job(redis):
+    key = key_for("token")
+
+    async def scenario():
+        await coalesce(key, "job-2", {})
+        await finish(key, "job-1", None)
+        return await redis.get(INFLIGHT_KEY_PREFIX + key)
+
+    assert asyncio.run(scenario()) == "job-2"
+
+
+@pytest.mark.parametrize("pr_url, error, cached", [
+    ("https://github.com/acme/app/pull/1", None, True),
+    ("No changes were needed", None, False),
+    (None, RuntimeError("boom"), False),
+])
+def test_only_submitted_pull_requests_are_cached(redis, monkeypatch, pr_url, error, cached):
+    import start_agent_queue
+
+    delivered = []
+
+    async def deliver_result(req, url, session_id):
+        delivered.append(("result", req["socket_id"]))
+
+    async def deliver_error(req, exc):
+        delivered.append(("error", req["socket_id"]))
+
+    monkeypatch.setattr(start_agent_queue, "deliver_result", deliver_result)
+    monkeypatch.setattr(start_agent_queue, "deliver_error", deliver_error)
+    key = key_for("token")
+    job = {"dedup_key": key, "job_id": "job-1", "socket_id": "first"}
+
+    async def scenario():
+        await coalesce(key, "job-1", {})
+        await coalesce(key, "job-2", {"socket_id": "second"})
+        await start_agent_queue._resolve_duplicates(job, pr_url, "session-1", error)
+        return await redis.exists(RESULT_KEY_PREFIX + key)
+
+    assert asyncio.run(scenario()) == int(cached)
+    assert delivered == [("result" if pr_url and error is None else "error", "second")]
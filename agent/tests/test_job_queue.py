@@ -0,0 +1,167 @@
+"""
+The queue's Lua scripts against fakeredis: admission limits, weighted lane
+order, owner counts released once per job, requeueing, and the response
+/agent gives when admission is refused.
+"""
+import asyncio
+import json
+
+import pytest
+
+import job_queue
+from job_queue import OWNER_COUNT_KEY_PREFIX, ack_job, admit, lane_key, owner_count_key, pop_job, requeue
+
+PROCESSING = job_queue.PROCESSING_KEY_PREFIX + "worker-1"
+
+
+@pytest.fixture
+def queue(redis, monkeypatch):
+    """An empty queue with small limits, its stats recomputed on every call."""
+    monkeypatch.setattr(job_queue, "_stats", None)
+    monkeypatch.setattr(job_queue, "QUEUE_STATS_TTL", 0)
+    monkeypatch.setattr(job_queue, "QUEUE_MAX_JOBS", 10)
+    monkeypatch.setattr(job_queue, "QUEUE_MAX_JOBS_PER_OWNER", 2)
+    monkeypatch.setattr(job_queue, "QUEUE_LANE_LIMITS", {"paid": 0, "interactive": 0, "batch": 2})
+    monkeypatch.setattr(job_queue, "QUEUE_LANE_WEIGHTS", {"paid": 2, "interactive": 1, "batch": 1})
+    return redis
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_admission_reports_position(queue):
+    first = run(admit({"n": 1}, "interactive"))
+    second = run(admit({"n": 2}, "interactive"))
+    paid = run(admit({"n": 3}, "paid"))
+    assert (first.accepted, first.position) == (True, 1)
+    assert second.position == 2
+    # Paid jobs run first, so nothing queued in lower lanes is ahead of it.
+    assert paid.position == 1
+    assert first.estimated_wait_seconds is None
+
+
+def test_queue_lane_and_owner_limits(queue, monkeypatch):
+    assert run(admit({}, "batch")).accepted
+    assert run(admit({}, "batch")).accepted
+    assert run(admit({}, "batch")).status == "lane_full"
+
+    assert run(admit({}, "interactive", owner="a@example.com")).accepted
+    assert run(admit({}, "paid", owner="a@example.com")).accepted
+    assert run(admit({}, "interactive", owner="a@example.com")).status == "owner_limit"
+    assert run(admit({}, "interactive", owner="b@example.com")).accepted
+
+    monkeypatch.setattr(job_queue, "QUEUE_MAX_JOBS", 5)
+    rejected = run(admit({}, "interactive"))
+    assert (rejected.accepted, rejected.status, rejected.position) == (False, "queue_full", None)
+    assert run(queue.llen(lane_key("interactive"))) == 2
+
+
+def test_owner_count_expires(queue):
+    run(admit({}, "interactive", owner="a@example.com"))
+    assert 0 < run(queue.ttl(owner_count_key("a@example.com"))) <= job_queue.QUEUE_OWNER_COUNT_TTL
+
+
+def test_lanes_are_served_by_weight(queue):
+    for lane in ("paid", "interactive"):
+        for n in range(4):
+            run(admit({"n": n}, lane))
+    run(admit({"n": 0}, "batch"))
+    run(admit({"n": 1}, "batch"))
+
+    async def drain(count):
+        return [json.loads(await pop_job(PROCESSING))["lane"] for _ in range(count)]
+
+    lanes = run(drain(8))
+    assert lanes.count("paid") == 4 and lanes.count("interactive") == 2 and lanes.count("batch") == 2
+    # Jobs within a lane run in arrival order.
+    assert [job["n"] for job in map(json.loads, run(queue.lrange(PROCESSING, 0, -1))) if job["lane"] == "paid"] == [3, 2, 1, 0]
+
+
+def test_empty_turn_falls_through_by_priority(queue):
+    run(admit({}, "batch"))
+    run(admit({}, "interactive"))
+    assert json.loads(run(pop_job(PROCESSING)))["lane"] == "interactive"
+    assert json.loads(run(pop_job(PROCESSING)))["lane"] == "batch"
+
+
+def test_unlaned_legacy_jobs_still_run(queue):
+    run(queue.lpush(job_queue.AGENT_QUEUE, json.dumps({"legacy": True})))
+    assert json.loads(run(pop_job(PROCESSING))) == {"legacy": True}
+
+
+def test_owner_count_is_released_once_when_the_job_is_acknowledged(queue):
+    owner = "a@example.com"
+    run(admit({}, "interactive", owner=owner))
+    run(admit({}, "interactive", owner=owner))
+    payload = run(pop_job(PROCESSING))
+    # Taking the job does not free the owner's slot; finishing it does.
+    assert run(queue.get(owner_count_key(owner))) == "2"
+    assert run(admit({}, "interactive", owner=owner)).status == "owner_limit"
+
+    run(ack_job(PROCESSING, payload))
+    run(ack_job(PROCESSING, payload))
+    assert run(queue.get(owner_count_key(owner))) == "1"
+    assert run(queue.llen(PROCESSING)) == 0
+
+
+def test_owner_count_is_clamped_at_zero(queue):
+    owner = "a@example.com"
+    run(admit({}, "interactive", owner=owner))
+    payload = run(pop_job(PROCESSING))
+    # The count expired while the job ran.
+    run(queue.delete(owner_count_key(owner)))
+    run(ack_job(PROCESSING, payload))
+    assert run(queue.keys(OWNER_COUNT_KEY_PREFIX + "*")) == []
+
+
+def test_malformed_payload_is_acknowledged(queue):
+    run(queue.lpush(PROCESSING, "not json"))
+    run(ack_job(PROCESSING, "not json"))
+    assert run(queue.llen(PROCESSING)) == 0
+
+
+def test_requeue_keeps_lane_and_owner_count(queue):
+    owner = "a@example.com"
+    run(admit({"n": 1}, "batch", owner=owner))
+    run(admit({"n": 2}, "batch"))
+    payload = run(pop_job(PROCESSING))
+    assert run(requeue(PROCESSING)) == 1
+    assert run(queue.llen(PROCESSING)) == 0
+    # Back at the consuming end of its lane, so it runs next.
+    assert run(pop_job(PROCESSING)) == payload
+    assert run(queue.get(owner_count_key(owner))) == "1"
+
+
+def test_rejected_request_keeps_the_error_response_shape(queue, monkeypatch):
+    from fastapi.testclient import TestClient
+    import agent
+
+    async def no_head(*args):
+        raise RuntimeError("offline")
+
+    monkeypatch.setattr(agent, "get_branch_head_sha", no_head)
+    monkeypatch.setattr(agent, "AGENT_INLINE_WORKER", False)
+    monkeypatch.setattr(job_queue, "QUEUE_MAX_JOBS", 1)
+    # One live worker with one slot, so waits can be estimated.
+    run(queue.set(job_queue.WORKER_HEARTBEAT_PREFIX + "worker-1", 1))
+
+    request = {
+        "user_prompt": "Add a button", "project_id": "project-1", "access_token": "token",
+        "llm_model_type": "gemini", "llm_model_name": "gemini-2.5-pro", "socket_id": "socket-1",
+        "repo": {"id": 1, "name": "app", "full_name": "acme/app", "private": False,
+                 "owner": {"login": "acme", "id": 1}, "html_url": "https://github.com/acme/app",
+                 "default_branch": "main"},
+        "chat": {"id": "chat-1", "projectId": "project-1", "userEmail": "a@example.com", "message": "hi",
+                 "pullRequestUrl": "", "createdAt": "now", "chatUrl": "", "seen": False},
+    }
+    client = TestClient(agent.app)
+    accepted = client.post("/agent", json=request)
+    assert accepted.status_code == 200
+    assert accepted.json() == {"message": "Queued", "lane": "interactive", "position": 1,
+                               "estimated_wait_seconds": 0.0}
+
+    rejected = client.post("/agent", json=request)
+    assert rejected.status_code == 200
+    assert rejected.json() == {"error": agent.ADMISSION_ERRORS["queue_full"],
+                               "retry_after_seconds": job_queue.QUEUE_DEFAULT_JOB_SECONDS}
@@ -0,0 +1,68 @@
+"""
+Incremental re-parsing: a tree parsed from the cached base tree and the edit
+map must be the tree a full parse gives, errors included, and editing the
+copy must leave the cached base tree alone.
+"""
+import pytest
+
+from parse_cache import ParseCache
+from parsers import get_parser
+from tools.apply_code_changes import CoderChange, edit_lines
+
+BASE = """import React from "react";
+
+export function Header({ title }) {
+  return <h1 className="title">{title}</h1>;
+}
+
+export function Footer() {
+  return <footer>Footer</footer>;
+}
+
+export function Card({ children }) {
+  return <div className="card">{children}</div>;
+}
+"""
+
+
+def change(start: int, end: int, new_code: str) -> CoderChange:
+    return CoderChange(is_new_file=False, file_path="src/App.jsx", start_line=start, end_line=end, new_code=new_code)
+
+
+VALID = [change(4, 4, '  return <h1 className="title" data-testid="header">{title}</h1>;\n'),
+         change(12, 12, '  const label = "card";\n  return <div className={label}>{children}</div>;\n')]
+BROKEN = [change(4, 4, '  return <h1 className="title">{title}</h1>;\n'),
+          change(8, 8, "  return <footer>Footer</div>;\n  if (\n")]
+
+
+def full_parse(code: str):
+    return get_parser("javascript").parse(code.encode("utf8"))
+
+
+@pytest.mark.parametrize("base", [BASE, BASE.replace("\n", "\r\n"), BASE.rstrip("\n")],
+                         ids=["lf", "crlf", "unterminated"])
+@pytest.mark.parametrize("changes, has_error", [(VALID, False), (BROKEN, True)], ids=["valid", "broken"])
+@pytest.mark.parametrize("with_edit_map", [True, False], ids=["edit-map", "diff"])
+def test_incremental_parse_matches_full_parse(base, changes, has_error, with_edit_map):
+    cache = ParseCache()
+    base_tree = cache.parse(base, "javascript")
+    base_sexp = str(base_tree.root_node)
+
+    code, edits, rejected = edit_lines(base, changes)
+    assert rejected == [] and edits is not None
+    tree = cache.parse(code, "javascript", base=base, edits=edits if with_edit_map else None)
+
+    expected = full_parse(code)
+    assert tree.root_node.has_error == expected.root_node.has_error == has_error
+    assert str(tree.root_node) == str(expected.root_node)
+    assert tree.root_node.end_byte == len(code.encode("utf8"))
+    # The cached base tree was copied before being edited.
+    assert str(cache.parse(base, "javascript").root_node) == base_sexp
+    assert not cache.parse(base, "javascript").root_node.has_error
+
+
+def test_unknown_base_is_parsed_in_full():
+    cache = ParseCache()
+    code, edits, _ = edit_lines(BASE, BROKEN)
+    tree = cache.parse(code, "javascript", base=BASE, edits=edits)
+    assert str(tree.root_node) == str(full_parse(code).root_node)
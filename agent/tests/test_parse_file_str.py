@@ -0,0 +1,33 @@
+"""
+parse_file_str must return exactly what the recursive implementation it
+replaced returned. The old implementation is kept in the parse_file_str
+benchmark, which also measures the speedup.
+"""
+from pathlib import Path
+
+import pytest
+
+from bench_parse_file_str import legacy_parse_file_str, synthetic_component
+from parse_cache import parse_cache
+from parse_file_str import parse_file_str
+
+FIXTURES = Path(__file__).resolve().parent / "fixtures"
+
+
+@pytest.mark.parametrize("extension", ["js", "jsx", "tsx"])
+def test_fixture_matches_legacy(extension):
+    code = (FIXTURES / "widgets.jsx").read_text(encoding="utf-8")
+    parse_cache.clear()
+    assert parse_file_str(code, extension) == legacy_parse_file_str(code, extension)
+
+
+def test_synthetic_component_matches_legacy():
+    code = synthetic_component(components=5)
+    assert parse_file_str(code, "jsx") == legacy_parse_file_str(code, "jsx")
+
+
+def test_outline_without_code_matches_legacy():
+    code = (FIXTURES / "widgets.jsx").read_text(encoding="utf-8")
+    legacy = [{key: value for key, value in declaration.items() if key != "code"}
+              for declaration in legacy_parse_file_str(code, "jsx")]
+    assert parse_file_str(code, "jsx", include_code=False) == legacy
@@ -0,0 +1,83 @@
+"""
+Sessions stored in Redis: the access token never reaches the stored meta or
+events, and compacted events still load as the events they were.
+"""
+import asyncio
+
+from google.adk.events import Event, EventActions
+from google.genai import types
+
+from session_service import REDACTED, SESSION_EVENT_MAX_STRING, RedisSessionService, compact_event
+
+TOKEN = "ghp_" + "a" * 36
+# Not in a GitHub token format: only found by its argument name or prompt label.
+OPAQUE_TOKEN = "opaque-token-123"
+
+
+def agent_events() -> list[Event]:
+    prompt = f"Add a button\nowner: acme\nrepo_name: app\nbranch: main\naccess_token: {OPAQUE_TOKEN}"
+    return [
+        Event(author="user", content=types.Content(role="user", parts=[types.Part(text=prompt)])),
+        Event(author="planner", content=types.Content(role="model", parts=[types.Part(function_call=types.FunctionCall(
+            name="get_file_content",
+            args={"owner": "acme", "repo_name": "app", "path": "src/App.jsx", "access_token": OPAQUE_TOKEN},
+        ))])),
+        Event(author="planner", content=types.Content(role="user", parts=[types.Part(function_response=types.FunctionResponse(
+            name="get_file_content",
+            response={"content": "x" * (SESSION_EVENT_MAX_STRING * 3), "note": f"cloned with {TOKEN}"},
+        ))])),
+        Event(author="planner", actions=EventActions(state_delta={"access_token": TOKEN, "repo": "acme/app"})),
+    ]
+
+
+def test_token_is_not_stored(redis):
+    service = RedisSessionService(redis=redis)
+
+    async def scenario():
+        session = await service.create_session(app_name="app", user_id="user", session_id="s1",
+                                               state={"access_token": OPAQUE_TOKEN, "temp:token": TOKEN})
+        for event in agent_events():
+            await service.append_event(session, event)
+        stored = []
+        async for key in redis.scan_iter():
+            if await redis.type(key) == "list":
+                stored += await redis.lrange(key, 0, -1)
+            else:
+                stored.append(await redis.get(key))
+        return session, stored
+
+    session, stored = asyncio.run(scenario())
+    assert len(stored) == 5
+    for value in stored:
+        assert TOKEN not in value and OPAQUE_TOKEN not in value
+    # The running invocation still has the real values.
+    assert session.state["access_token"] == TOKEN
+
+
+def test_compacted_events_keep_their_shape(redis):
+    service = RedisSessionService(redis=redis)
+
+    async def scenario():
+        session = await service.create_session(app_name="app", user_id="user", session_id="s1")
+        for event in agent_events():
+            await service.append_event(session, event)
+        return await service.get_session(app_name="app", user_id="user", session_id="s1")
+
+    original = agent_events()
+    loaded = asyncio.run(scenario()).events
+    assert [event.author for event in loaded] == [event.author for event in original]
+
+    assert loaded[0].content.parts[0].text.endswith(f"access_token: {REDACTED}")
+    call = loaded[1].content.parts[0].function_call
+    assert call.name == "get_file_content"
+    assert call.args == {"owner": "acme", "repo_name": "app", "path": "src/App.jsx", "access_token": REDACTED}
+    response = loaded[2].content.parts[0].function_response.response
+    assert response["content"].startswith("x" * SESSION_EVENT_MAX_STRING)
+    assert response["content"].endswith(f"[{SESSION_EVENT_MAX_STRING * 2} chars not stored]")
+    assert response["note"] == f"cloned with {REDACTED}"
+    assert loaded[3].actions.state_delta == {"access_token": REDACTED, "repo": "acme/app"}
+
+
+def test_compact_event_leaves_small_events_alone():
+    event = Event(author="planner", content=types.Content(role="model", parts=[types.Part(text="Done")]))
+    assert Event.model_validate_json(compact_event(event)) == event
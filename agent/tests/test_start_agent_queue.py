@@ -0,0 +1,54 @@
+"""
+A job cancelled mid-run (worker shutdown) stays on the processing list and is
+requeued, so it must keep its dedup claim and leave its duplicates waiting.
+"""
+import asyncio
+import json
+import sys
+import types
+
+import pytest
+
+
+def test_cancelled_job_keeps_its_dedup_claim(redis, monkeypatch):
+    import job_dedup
+    import job_queue
+    import start_agent_queue
+
+    started = asyncio.Event()
+
+    async def run_agent(*args):
+        started.set()
+        await asyncio.sleep(3600)
+
+    emitted = []
+
+    async def emit(event, data, room=None):
+        emitted.append(event)
+
+    monkeypatch.setitem(sys.modules, "main", types.SimpleNamespace(run_agent=run_agent))
+    monkeypatch.setattr(start_agent_queue, "emit", emit)
+    monkeypatch.setattr(start_agent_queue, "Repo", lambda **fields: fields)
+
+    key, job_id = "owner:acme/app:sha:gemini:model:prompt", "job-1"
+    job = {
+        "user_prompt": "Add a button", "repo": {}, "access_token": "token", "socket_id": "socket-1",
+        "llm_model_type": "gemini", "llm_model_name": "model", "chat": {"id": "chat-1"},
+        "project_id": "project-1", "dedup_key": key, "job_id": job_id,
+    }
+
+    async def scenario():
+        assert await job_dedup.coalesce(key, job_id, {}) == ("claimed", None)
+        assert await job_dedup.coalesce(key, "job-2", {"socket_id": "socket-2"}) == ("attached", None)
+        task = asyncio.create_task(start_agent_queue.process_job(json.dumps(job)))
+        await started.wait()
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(scenario())
+
+    assert asyncio.run(redis.get(job_dedup.INFLIGHT_KEY_PREFIX + key)) == job_id
+    assert asyncio.run(redis.llen(job_dedup.WAITERS_KEY_PREFIX + key)) == 1
+    assert asyncio.run(redis.llen(job_queue.DURATIONS_KEY)) == 0
+    assert emitted == []